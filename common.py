@@ -5,6 +5,15 @@ Things to be used across the entire application
 # Constants
 ###############################################################################
 USERNAME = 'username'
+SEARCH_PAGE_SIZE = 20
+# Review lists, ?page_size= can pick anything up to the maximum
+REVIEWS_PAGE_SIZE = 20
+MAX_REVIEWS_PAGE_SIZE = 100
+SEARCH_CACHE_SECONDS = 60
+# Search ranks at most this many of the newest matches
+SEARCH_MAX_RANKED = 1000
+SUGGEST_LIMIT = 10
+SUGGEST_CACHE_SECONDS = 60
 
 
 ###############################################################################
@@ -34,3 +43,4 @@ CREATE_REVIEW_FORM = "main/templates/reviews/create_review_form.html"
 UPDATE_REVIEW_FORM = "main/templates/reviews/update_review_form.html"
 REVIEW_TEMPLATE = "main/templates/reviews/review.html"
 CITY_REVIEWS_TEMPLATE = "main/templates/reviews/city_reviews.html"
+SEARCH_REVIEWS_TEMPLATE = "main/templates/reviews/search_results.html"
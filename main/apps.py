@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from main import signals  # noqa: F401
+        from main.utils.metrics_utils import install_query_recorder
+
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,95 @@
+"""
+The PostgreSQL backend, taking its connections from a per-process pool.
+
+With a "POOL" entry in the database settings, a connection Django closes goes
+back to the pool instead, and the next thread to connect reuses it. Without
+one it behaves like the stock backend. Either way the time to get a
+connection is recorded in db_connection_acquire_seconds.
+
+    "POOL": {
+        "MAX_SIZE": 10,             # connections the process may open
+        "TIMEOUT": 10,              # seconds to wait for a free one
+        "MAX_IDLE": 300,            # seconds an idle connection is kept
+        "HEALTH_CHECK_AFTER": 30,   # idle seconds after which it is checked first
+    }
+"""
+import time
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation as PostgresDatabaseCreation
+from main.utils.connection_pool_utils import ConnectionPool, close_pools, get_pool
+from main.utils.metrics_utils import DB_CONNECTION_ACQUIRE_SECONDS
+
+Database = base.Database
+TRANSACTION_STATUS_IDLE = Database.extensions.TRANSACTION_STATUS_IDLE
+TRANSACTION_STATUS_UNKNOWN = Database.extensions.TRANSACTION_STATUS_UNKNOWN
+
+
+class DatabaseCreation(PostgresDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would keep it from being dropped
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get("POOL")
+        if options is None:
+            started = time.perf_counter()
+            connection = super().get_new_connection(conn_params)
+            DB_CONNECTION_ACQUIRE_SECONDS.observe(time.perf_counter() - started, conn_params["database"], "opened")
+            return connection
+        self.pool = get_pool(
+            (self.alias, repr(sorted(conn_params.items()))),
+            lambda: ConnectionPool(
+                conn_params["database"],
+                check=_is_usable,
+                reset=_reset,
+                max_size=options.get("MAX_SIZE", 10),
+                timeout=options.get("TIMEOUT", 10),
+                max_idle=options.get("MAX_IDLE", 300),
+                check_after=options.get("HEALTH_CHECK_AFTER", 30),
+            ),
+        )
+        connection = self.pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # The stock backend sets this when it opens a connection
+        self.isolation_level = self.settings_dict["OPTIONS"].get("isolation_level", connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.release(self.connection)
+
+
+def _is_usable(connection) -> bool:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except Database.Error:
+        return False
+    return True
+
+
+def _reset(connection) -> bool:
+    """
+    Roll back whatever a returned connection left open, and say whether it can be reused
+    """
+    if connection.closed:
+        return False
+    status = connection.get_transaction_status()
+    if status == TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != TRANSACTION_STATUS_IDLE:
+        try:
+            connection.rollback()
+        except Database.Error:
+            return False
+    return True
@@ -0,0 +1,82 @@
+"""
+Rebuild or verify every AddressSummary from the review table
+"""
+from itertools import groupby
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from main.models import AddressSummary, Review
+from main.utils.database_utils import ADDRESS_SUMMARY_FIELDS
+from main.utils.review_utils import get_summary_fields
+
+
+class Command(BaseCommand):
+    help = "Rebuild every address summary from its reviews, or verify them with --verify"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Report summaries that don't match their reviews without changing them",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        verify = options["verify"]
+        batch_size = options["batch_size"]
+        mismatched = 0
+        checked = 0
+        batch = {}
+
+        rows = (
+            Review.objects.order_by("address_id")
+            .values_list("address_id", "rating", "starting_rent", "ending_rent")
+            .iterator(chunk_size=batch_size)
+        )
+        for address_id, address_rows in groupby(rows, key=lambda row: row[0]):
+            batch[address_id] = get_summary_fields(row[1:] for row in address_rows)
+            if len(batch) >= batch_size:
+                mismatched += self._sync_batch(batch, verify)
+                checked += len(batch)
+                batch = {}
+        if batch:
+            mismatched += self._sync_batch(batch, verify)
+            checked += len(batch)
+
+        orphans = AddressSummary.objects.exclude(address__review__isnull=False)
+        orphan_count = orphans.count()
+        if not verify:
+            orphans.delete()
+
+        action = "Found" if verify else "Fixed"
+        self.stdout.write(
+            f"Checked {checked} addresses. {action} {mismatched} mismatched and "
+            f"{orphan_count} orphaned summaries."
+        )
+
+    def _sync_batch(self, batch: dict, verify: bool) -> int:
+        """
+        Compare a batch of expected summaries with the stored ones.
+        Return the number that were missing or different
+        """
+        existing = AddressSummary.objects.in_bulk(list(batch))
+        to_create = []
+        to_update = []
+        for address_id, fields in batch.items():
+            summary = existing.get(address_id)
+            if summary is None:
+                to_create.append(AddressSummary(address_id=address_id, **fields))
+            elif any(getattr(summary, name) != value for name, value in fields.items()):
+                for name, value in fields.items():
+                    setattr(summary, name, value)
+                to_update.append(summary)
+
+        if verify:
+            for summary in to_create:
+                self.stdout.write(f"Missing summary for address {summary.address_id}")
+            for summary in to_update:
+                self.stdout.write(f"Stale summary for address {summary.address_id}")
+        else:
+            with transaction.atomic():
+                AddressSummary.objects.bulk_create(to_create)
+                AddressSummary.objects.bulk_update(to_update, ADDRESS_SUMMARY_FIELDS)
+        return len(to_create) + len(to_update)
@@ -0,0 +1,40 @@
+"""
+Archive the hourly log files of every finished day, and drop expired archives.
+
+Replaces bin/log_handling.py, which only ever looked at yesterday's files.
+Any day that was missed is archived on the next run, and a day archived
+before is appended to. Hours are compressed in parallel worker processes.
+See main/utils/log_archive_utils.py for the archive and index layout.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from main.utils.log_archive_utils import archive_days, days_ago, hourly_files, remove_expired
+
+
+class Command(BaseCommand):
+    help = "Compress and index the hourly log files of past days, and delete expired archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log-dir", default=os.path.dirname(os.path.abspath(settings.LOG_FILE)))
+        parser.add_argument("--archive-dir", default=settings.LOG_ARCHIVE_DIR)
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Compressing processes")
+        parser.add_argument("--compress-level", type=int, default=6, choices=range(1, 10))
+        parser.add_argument("--retention-days", type=int, default=settings.LOG_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        log_name = os.path.basename(settings.LOG_FILE)
+        # Today's hours are still being written to, they wait for tomorrow's run
+        days = hourly_files(options["log_dir"], log_name, before=date.today())
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            for day, hours in archive_days(
+                days, options["archive_dir"], log_name, executor, options["compress_level"]
+            ):
+                self.stdout.write(f"{day}: archived {hours} hours")
+
+        # Kept for the retention period, plus the day being archived
+        for day in remove_expired(options["archive_dir"], log_name, days_ago(options["retention_days"] + 1)):
+            self.stdout.write(f"{day}: deleted, past retention")
+        self.stdout.write(self.style.SUCCESS("Log files archived."))
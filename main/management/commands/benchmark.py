@@ -0,0 +1,472 @@
+"""
+Load and latency benchmark of every route in main/urls.py.
+
+Requests go through the project's ASGI application in-process, with the full
+middleware stack, against whatever database and cache the settings point at.
+Seed a dataset with `manage.py seed_benchmark` first. For each route the
+benchmark reports p50/p99 latency, requests per second and the SQL queries and
+cache lookups per request, and can save the results as JSON to compare runs
+across commits. Queued mail is delivered to memory, nothing leaves the machine.
+"""
+import asyncio
+import json
+import platform
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from importlib import import_module
+from typing import Callable
+from urllib.parse import urlencode
+import django
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Max
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from main.management.commands.seed_benchmark import BENCHMARK_PASSWORD, BENCHMARK_USER_PREFIX, WORDS
+from main.models import Address, AddressSummary, City, Country, Review, State
+from main.urls import urlpatterns
+from main.utils.address_utils import get_address_dict
+from main.utils.benchmark_utils import AsgiDriver, RequestStats, count_requests, summarize
+
+# Share of address requests that go to the most reviewed addresses
+HOT_SHARE = 0.8
+LOCMEM_EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+API_VERSION = "v1"
+
+
+@dataclass
+class Target:
+    """
+    One request to send. A target with a `user` is sent with a session logged
+    in as that user, a `fresh_session` one with a session of its own.
+    """
+    method: str
+    path: str
+    query: dict = field(default_factory=dict)
+    data: dict | None = None
+    user: User | None = None
+    fresh_session: bool = False
+
+
+@dataclass
+class Route:
+    label: str
+    url_name: str
+    build: Callable[['Dataset'], Target]
+    # Changes data, left out of --read-only runs
+    writes: bool = False
+
+
+class Dataset:
+    """
+    Addresses, cities and users the requests are drawn from, read once before the run
+    """
+
+    def __init__(self, rng: random.Random, pool_size: int):
+        self.rng = rng
+        hot = AddressSummary.objects.exclude(address__slug="").order_by("-review_count")
+        self.hot_addresses = [summary.address for summary in hot.select_related("address")[:pool_size]]
+        max_id = Address.objects.aggregate(Max("id"))["id__max"] or 0
+        self.cold_addresses = []
+        for _ in range(pool_size if max_id else 0):
+            address = (
+                Address.objects.exclude(slug="")
+                .filter(pk__gte=rng.randint(1, max_id))
+                .order_by("pk")
+                .first()
+            )
+            if address is not None:
+                self.cold_addresses.append(address)
+        if not self.hot_addresses and not self.cold_addresses:
+            raise CommandError("No addresses to request, run `manage.py seed_benchmark` first")
+        self.cities = list(
+            City.objects.annotate(addresses=Count("address"))
+            .filter(addresses__gt=0)
+            .order_by("-addresses")
+            .select_related("state__country")[:pool_size]
+        )
+        # Seeded in order of activity, so the first users are the busiest reviewers
+        self.users = list(
+            User.objects.filter(username__startswith=BENCHMARK_USER_PREFIX).order_by("id")[:pool_size]
+        )
+        if not self.users:
+            raise CommandError("No benchmark users, run `manage.py seed_benchmark` first")
+        # Edit and delete look a review up by user and address, so only pairs with one review qualify
+        users = {user.pk: user for user in self.users}
+        self.user_reviews = [
+            (users[pair["user_id"]], pair["address__full_address"])
+            for pair in Review.objects.filter(user__in=self.users)
+            .values("user_id", "address__full_address")
+            .annotate(reviews=Count("id"))
+            .filter(reviews=1)[:pool_size]
+        ]
+
+    def address(self) -> Address:
+        if self.cold_addresses and (not self.hot_addresses or self.rng.random() >= HOT_SHARE):
+            return self.rng.choice(self.cold_addresses)
+        return self.rng.choice(self.hot_addresses)
+
+    def city(self) -> City:
+        return self.rng.choice(self.cities)
+
+    def user(self) -> User:
+        return self.rng.choice(self.users)
+
+    def user_review(self) -> tuple[User, str]:
+        if not self.user_reviews:
+            raise CommandError("No reviews by benchmark users, seed some reviews first")
+        return self.rng.choice(self.user_reviews)
+
+    def unreviewed(self) -> tuple[User, Address]:
+        """
+        A user and an address they haven't reviewed
+        """
+        while True:
+            user, address = self.user(), self.address()
+            if not Review.objects.filter(user=user, address=address).exists():
+                return user, address
+
+
+def _address_kwargs(address: Address) -> dict:
+    address_dict = get_address_dict(address.full_address)
+    return {key: address_dict[key] for key in ("country", "state", "city", "street")}
+
+
+def _city_kwargs(city: City) -> dict:
+    return {"country": city.state.country.name, "state": city.state.name, "city": city.name}
+
+
+def _lookup(data: Dataset) -> Target:
+    return Target("POST", reverse("index"), data={"address": data.address().full_address})
+
+
+def _login(data: Dataset) -> Target:
+    return Target(
+        "POST", reverse("user_login"), data={"username": data.user().username, "password": BENCHMARK_PASSWORD}
+    )
+
+
+def _password_reset_confirm(data: Dataset) -> Target:
+    user = data.user()
+    kwargs = {"uidb64": urlsafe_base64_encode(force_bytes(user.pk)), "token": default_token_generator.make_token(user)}
+    return Target("GET", reverse("password_reset_confirm", kwargs=kwargs))
+
+
+def _create_review_form(data: Dataset) -> Target:
+    return Target("GET", reverse("create_review", kwargs=_address_kwargs(data.address())), user=data.user())
+
+
+def _create_review(data: Dataset) -> Target:
+    return Target(
+        "POST",
+        reverse("create_review", kwargs=_address_kwargs(data.address())),
+        data={"title": "benchmark", "comment": "benchmark review", "rating": 4},
+        user=data.user(),
+    )
+
+
+def _edit_review(data: Dataset) -> Target:
+    user, full_address = data.user_review()
+    return Target("POST", reverse("edit_review"), data={"address": full_address, "edit": "true"}, user=user)
+
+
+def _delete_review(data: Dataset) -> Target:
+    # Written before the timed run, so every request has a review of its own to delete
+    user, address = data.unreviewed()
+    Review.objects.create(address=address, user=user, title="benchmark", comment="benchmark", rating=3)
+    return Target(
+        "POST", reverse("delete_review"), data={"address": address.full_address, "delete": "true"}, user=user
+    )
+
+
+def _suggest(data: Dataset) -> Target:
+    prefix = data.address().full_address[:data.rng.randint(3, 12)]
+    return Target("GET", reverse("suggest_addresses"), query={"q": prefix})
+
+
+def _cities_list(data: Dataset) -> Target:
+    city = data.city()
+    return Target(
+        "GET", reverse("get_cities_list"), query={"country": city.state.country.name, "state": city.state.name}
+    )
+
+
+def _api_states(data: Dataset) -> Target:
+    country = data.city().state.country.name
+    return Target("GET", reverse("api_states", kwargs={"version": API_VERSION, "country": country}))
+
+
+def _api_cities(data: Dataset) -> Target:
+    city = data.city()
+    kwargs = {"version": API_VERSION, "country": city.state.country.name, "state": city.state.name}
+    return Target("GET", reverse("api_cities", kwargs=kwargs))
+
+
+ROUTES = [
+    Route("index", "index", lambda data: Target("GET", reverse("index"))),
+    Route("index:lookup", "index", _lookup),
+    Route("register", "register", lambda data: Target("GET", reverse("register"))),
+    Route("user_login", "user_login", lambda data: Target("GET", reverse("user_login"))),
+    Route("user_login:post", "user_login", _login),
+    Route(
+        "user_logout",
+        "user_logout",
+        lambda data: Target("POST", reverse("user_logout"), user=data.user(), fresh_session=True),
+    ),
+    Route("user_profile", "user_profile", lambda data: Target("GET", reverse("user_profile"), user=data.user())),
+    Route("forgot_username", "forgot_username", lambda data: Target("GET", reverse("forgot_username"))),
+    Route("password_reset", "password_reset", lambda data: Target("GET", reverse("password_reset"))),
+    Route("password_reset_confirm", "password_reset_confirm", _password_reset_confirm),
+    Route(
+        "password_reset_complete",
+        "password_reset_complete",
+        lambda data: Target("GET", reverse("password_reset_complete")),
+    ),
+    Route("create_review", "create_review", _create_review_form),
+    Route("create_review:post", "create_review", _create_review, writes=True),
+    Route("edit_review", "edit_review", _edit_review),
+    Route("delete_review", "delete_review", _delete_review, writes=True),
+    Route(
+        "list_reviews",
+        "list_reviews",
+        lambda data: Target("GET", reverse("list_reviews", kwargs=_address_kwargs(data.address()))),
+    ),
+    Route(
+        "list_reviews_by_city",
+        "list_reviews_by_city",
+        lambda data: Target("GET", reverse("list_reviews_by_city", kwargs=_city_kwargs(data.city()))),
+    ),
+    Route(
+        "search_reviews",
+        "search_reviews",
+        lambda data: Target("GET", reverse("search_reviews"), query={"q": data.rng.choice(WORDS)}),
+    ),
+    Route("suggest_addresses", "suggest_addresses", _suggest),
+    Route("geography", "geography", lambda data: Target("GET", reverse("geography"))),
+    Route(
+        "get_states_list",
+        "get_states_list",
+        lambda data: Target("GET", reverse("get_states_list"), query={"country": data.city().state.country.name}),
+    ),
+    Route("get_cities_list", "get_cities_list", _cities_list),
+    Route(
+        "api_countries",
+        "api_countries",
+        lambda data: Target("GET", reverse("api_countries", kwargs={"version": API_VERSION})),
+    ),
+    Route("api_states", "api_states", _api_states),
+    Route("api_cities", "api_cities", _api_cities),
+    Route(
+        "api_city_reviews",
+        "api_city_reviews",
+        lambda data: Target(
+            "GET", reverse("api_city_reviews", kwargs={"version": API_VERSION, **_city_kwargs(data.city())})
+        ),
+    ),
+    Route(
+        "api_address",
+        "api_address",
+        lambda data: Target(
+            "GET", reverse("api_address", kwargs={"version": API_VERSION, "address_id": data.address().pk})
+        ),
+    ),
+    Route(
+        "api_address_reviews",
+        "api_address_reviews",
+        lambda data: Target(
+            "GET", reverse("api_address_reviews", kwargs={"version": API_VERSION, "address_id": data.address().pk})
+        ),
+    ),
+    Route("metrics", "metrics", lambda data: Target("GET", reverse("metrics"))),
+]
+
+
+class Runner:
+    """
+    Prepares each route's requests, then sends them with a bounded number in flight.
+    Building targets, sessions and review rows is not part of the timed run.
+    """
+
+    def __init__(self, data: Dataset, requests: int, warmup: int, concurrency: int):
+        self.data = data
+        self.requests = requests
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.driver = AsgiDriver(get_asgi_application())
+        self.session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        self.sessions = {}
+        # Every request carries the same CSRF secret as both cookie and header
+        self.csrf_secret = get_random_string(CSRF_SECRET_LENGTH, allowed_chars=CSRF_ALLOWED_CHARS)
+
+    async def run(self, routes: list[Route]) -> dict[str, list[RequestStats]]:
+        results = {}
+        for route in routes:
+            await self._send_all(await sync_to_async(self._prepare)(route, self.warmup))
+            requests = await sync_to_async(self._prepare)(route, self.requests)
+            started = time.perf_counter()
+            stats = await self._send_all(requests)
+            results[route.label] = (stats, time.perf_counter() - started)
+        return results
+
+    async def _send_all(self, requests: list) -> list[RequestStats]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(request):
+            async with semaphore:
+                _, stats = await self.driver.request(*request)
+                return stats
+
+        return await asyncio.gather(*(send(request) for request in requests))
+
+    def _prepare(self, route: Route, count: int) -> list[tuple]:
+        return [self._request(route.build(self.data)) for _ in range(count)]
+
+    def _request(self, target: Target) -> tuple:
+        cookies = {settings.CSRF_COOKIE_NAME: self.csrf_secret}
+        headers = [("accept-encoding", "gzip")]
+        if target.user is not None:
+            cookies[settings.SESSION_COOKIE_NAME] = self._session_key(target.user, target.fresh_session)
+        body = b""
+        if target.method == "POST":
+            body = urlencode(target.data or {}).encode()
+            headers += [
+                ("content-type", "application/x-www-form-urlencoded"),
+                ("x-csrftoken", self.csrf_secret),
+            ]
+        headers.append(("cookie", "; ".join(f"{name}={value}" for name, value in cookies.items())))
+        return target.method, target.path, urlencode(target.query), headers, body
+
+    def _session_key(self, user: User, fresh: bool) -> str:
+        if not fresh and user.pk in self.sessions:
+            return self.sessions[user.pk]
+        # What login() stores, without a request or a password check
+        session = self.session_store()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        if not fresh:
+            self.sessions[user.pk] = session.session_key
+        return session.session_key
+
+
+class Command(BaseCommand):
+    help = "Measure latency, throughput, queries and cache use of every route on a seeded dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Timed requests per route")
+        parser.add_argument("--warmup", type=int, default=20, help="Untimed requests per route before timing")
+        parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+        parser.add_argument("--routes", nargs="*", help="Only run these routes, by label")
+        parser.add_argument(
+            "--read-only",
+            action="store_true",
+            help="Skip the routes that create or delete reviews",
+        )
+        parser.add_argument("--pool", type=int, default=200, help="Addresses, cities and users to draw from")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--label", default="", help="Name of this run in the JSON results, e.g. a commit")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        routes = self._routes(options)
+        previous = None
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                previous = json.load(file)
+
+        with override_settings(EMAIL_OUTBOX_BACKEND=LOCMEM_EMAIL_BACKEND):
+            data = Dataset(random.Random(options["seed"]), options["pool"])
+            runner = Runner(data, options["requests"], options["warmup"], options["concurrency"])
+            with count_requests():
+                results = async_to_sync(runner.run)(routes)
+
+        report = self._report(results, options)
+        self._print(report, previous)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _routes(self, options: dict) -> list[Route]:
+        covered = {route.url_name for route in ROUTES}
+        for pattern in urlpatterns:
+            if pattern.name not in covered:
+                self.stderr.write(f"No benchmark for the {pattern.name} route")
+        routes = [route for route in ROUTES if not (options["read_only"] and route.writes)]
+        if options["routes"]:
+            unknown = set(options["routes"]) - {route.label for route in ROUTES}
+            if unknown:
+                raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+            routes = [route for route in routes if route.label in options["routes"]]
+        return routes
+
+    @staticmethod
+    def _report(results: dict, options: dict) -> dict:
+        all_stats = [stats for route_stats, _ in results.values() for stats in route_stats]
+        elapsed = sum(route_elapsed for _, route_elapsed in results.values())
+        cache = type(caches["default"])
+        return {
+            "label": options["label"],
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "environment": {
+                "database": connection.vendor,
+                "db_connections": settings.DB_CONNECTIONS,
+                "cache": f"{cache.__module__}.{cache.__qualname__}",
+                "session_engine": settings.SESSION_ENGINE,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+            },
+            "dataset": {
+                "countries": Country.objects.count(),
+                "states": State.objects.count(),
+                "cities": City.objects.count(),
+                "addresses": Address.objects.count(),
+                "users": User.objects.count(),
+                "reviews": Review.objects.count(),
+            },
+            "options": {
+                key: options[key] for key in ("requests", "warmup", "concurrency", "read_only", "pool", "seed")
+            },
+            "routes": {label: summarize(stats, route_elapsed) for label, (stats, route_elapsed) in results.items()},
+            "total": summarize(all_stats, elapsed),
+        }
+
+    def _print(self, report: dict, previous: dict | None):
+        header = f"{'route':<26}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'cache':>7}{'hits':>7}"
+        if previous:
+            header += f"{'p50 vs before':>15}"
+        self.stdout.write(header + "  statuses")
+        rows = [*report["routes"].items(), ("total", report["total"])]
+        for label, summary in rows:
+            hit_rate = summary["cache_hit_rate"]
+            line = (
+                f"{label:<26}{summary['p50_ms']:>9.2f}{summary['p99_ms']:>9.2f}"
+                f"{summary['requests_per_second']:>9.1f}{summary['queries_per_request']:>9.2f}"
+                f"{summary['cache_gets_per_request']:>7.1f}{'-' if hit_rate is None else f'{hit_rate:.0%}':>7}"
+            )
+            if previous:
+                before = previous["total"] if label == "total" else previous["routes"].get(label)
+                line += f"{_change(summary, before):>15}"
+            line += "  " + ",".join(str(status) for status in summary["statuses"])
+            self.stdout.write(self.style.ERROR(line) if summary["errors"] else line)
+
+
+def _change(summary: dict, before: dict | None) -> str:
+    if not before or not before["p50_ms"]:
+        return "-"
+    return f"{(summary['p50_ms'] - before['p50_ms']) / before['p50_ms']:+.0%}"
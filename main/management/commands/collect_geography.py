@@ -0,0 +1,111 @@
+"""
+Delete the cities, states and countries no address uses any more.
+
+Deleting an address's last review deletes the address, but not its city, state
+or country, which stay in the dropdowns. Orphans are found with NOT EXISTS
+anti-joins and deleted deepest first in batches, one transaction per batch.
+Each batch is one DELETE that checks the anti-join again, so a row an address
+or review started using meanwhile is kept. It bypasses Django's cascading
+delete, which could collect rows committed after the check and delete them
+too, so only orphans are deleted and counted. After each batch only the dropdown lists it changed are
+invalidated: a state's cities, a country's states, or the country list.
+"""
+import logging
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from main.models import Address, City, Country, Review, State
+from main.utils.cache_utils import (
+    COUNTRIES_SCOPE,
+    GEOGRAPHY_SCOPE,
+    bump_generation,
+    country_scope,
+    state_scope,
+)
+
+logger = logging.getLogger()
+
+
+def _city_used():
+    return Exists(Address.objects.filter(city_id=OuterRef("pk"))) | Exists(
+        Review.objects.filter(city_id=OuterRef("pk"))
+    )
+
+
+def _state_used():
+    return Exists(City.objects.filter(_city_used(), state_id=OuterRef("pk")))
+
+
+def _country_used():
+    return Exists(State.objects.filter(_state_used(), country_id=OuterRef("pk")))
+
+
+def orphaned_cities():
+    return City.objects.filter(~_city_used())
+
+
+def orphaned_states():
+    """
+    States whose cities are all orphans, so they are orphans once those are deleted
+    """
+    return State.objects.filter(~_state_used())
+
+
+def orphaned_countries():
+    return Country.objects.filter(~_country_used())
+
+
+# Deepest first: (name, orphans, the names each row's dropdown scope is built from, that scope)
+LEVELS = (
+    ("cities", orphaned_cities, ("state__name", "state__country__name"), lambda names: state_scope(*names)),
+    ("states", orphaned_states, ("country__name",), lambda names: country_scope(*names)),
+    ("countries", orphaned_countries, (), lambda names: COUNTRIES_SCOPE),
+)
+
+
+class Command(BaseCommand):
+    help = "Delete cities, states and countries without addresses, or report them with --dry-run"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report how many rows would be deleted without deleting them",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            counts = [(name, orphans().count()) for name, orphans, _, _ in LEVELS]
+            self.stdout.write("Would delete " + ", ".join(f"{count} {name}" for name, count in counts) + ".")
+            return
+        counts = [
+            (name, self._collect(orphans, names, scope, options["batch_size"]))
+            for name, orphans, names, scope in LEVELS
+        ]
+        self.stdout.write("Deleted " + ", ".join(f"{count} {name}" for name, count in counts) + ".")
+
+    def _collect(self, orphans, names: tuple, scope, batch_size: int) -> int:
+        """
+        Delete one level's orphans a batch at a time, return how many were deleted
+        """
+        deleted = 0
+        last_id = 0
+        while True:
+            try:
+                with transaction.atomic():
+                    rows = list(
+                        orphans().filter(id__gt=last_id).order_by("id").values_list("id", *names)[:batch_size]
+                    )
+                    if not rows:
+                        return deleted
+                    last_id = rows[-1][0]
+                    batch = orphans().filter(id__in=[row[0] for row in rows])
+                    count = batch._raw_delete(batch.db)
+            except IntegrityError as e:
+                # A review started using one of these rows before the commit, the next run retries them
+                logger.warning("Kept a batch of geography that came back into use: %s", e)
+                continue
+            deleted += count
+            if count:
+                bump_generation(GEOGRAPHY_SCOPE, *{scope(row[1:]) for row in rows})
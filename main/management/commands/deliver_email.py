@@ -0,0 +1,29 @@
+"""
+Deliver the email outbox.
+
+Runs the same worker the web processes start when EMAIL_OUTBOX_WORKER is on,
+in the foreground, for deployments that keep delivery in its own process.
+"""
+from django.core.management.base import BaseCommand
+from main.utils.email_utils import OutboxWorker, deliver_batch, pending_count
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails, until stopped or once with --once"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Deliver what is due now and exit")
+        parser.add_argument("--batch-size", type=int, help="Emails per connection to the mail server")
+
+    def handle(self, *args, **options):
+        if not options["once"]:
+            worker = OutboxWorker()
+            try:
+                worker.run()
+            except KeyboardInterrupt:
+                worker.stop()
+            return
+        claimed = 0
+        while batch := deliver_batch(options["batch_size"]):
+            claimed += batch
+        self.stdout.write(f"Tried {claimed} emails, {pending_count()} still pending.")
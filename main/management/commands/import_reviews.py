@@ -0,0 +1,325 @@
+"""
+Bulk import reviews from partner CSV or JSON lines files.
+
+Each row needs `full_address` (in the format get_address_dict parses), `rating`
+and `comment`. `title`, `username`, `starting_rent`, `starting_rent_month_year`,
+`ending_rent` and `ending_rent_month_year` are optional.
+
+A row the database would reject (a missing or over-long field, a rating outside
+0-5) is reported and skipped, as is a review its user already left for the same
+rental dates.
+
+Rows are read as a stream and written in batches, one transaction per batch.
+After each batch the number of rows done is written to a checkpoint file, and
+--resume skips that many rows so a failed import can pick up where it stopped.
+"""
+import csv
+import json
+import logging
+import os
+import time
+from datetime import date
+from itertools import islice
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from main.models import Address, City, Country, Review, State
+from main.utils.address_utils import get_address_dict, get_address_key, get_address_slug
+from main.utils.cache_utils import (
+    ADDRESSES_SCOPE,
+    COUNTRIES_SCOPE,
+    GEOGRAPHY_SCOPE,
+    address_id_scope,
+    address_scope,
+    city_scope,
+    country_scope,
+    reset_generations,
+    state_scope,
+    user_scope,
+)
+from main.utils.database_utils import rebuild_address_summaries
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+    help = "Stream reviews and their addresses from a CSV or JSON lines file into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="Input format, taken from the file extension when not given",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--checkpoint",
+            help="Progress file, defaults to <path>.checkpoint",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip the rows a previous run already imported",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        input_format = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+        batch_size = options["batch_size"]
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        done = _read_checkpoint(checkpoint) if options["resume"] else 0
+        resumed_at = done
+
+        geography = GeographyMap()
+        started = time.monotonic()
+        imported = skipped = 0
+        with open(path, newline="", encoding="utf-8") as file:
+            rows = islice(_read_rows(file, input_format), done, None)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    batch_imported, touched_scopes = _import_batch(batch, geography)
+                reset_generations(touched_scopes)
+                imported += batch_imported
+                skipped += len(batch) - batch_imported
+                done += len(batch)
+                _write_checkpoint(checkpoint, done)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{done} rows read, {imported} imported, {skipped} skipped, "
+                    f"{(done - resumed_at) / elapsed:.0f} rows/sec"
+                )
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} reviews from {path}"))
+
+
+class GeographyMap:
+    """
+    Every country, state and city id, held in memory so rows resolve without a query.
+    Names that aren't known yet are created a batch at a time.
+    """
+
+    def __init__(self):
+        self.countries = dict(Country.objects.values_list("name", "id"))
+        self.states = {
+            (country_id, name): pk
+            for pk, country_id, name in State.objects.values_list("id", "country_id", "name")
+        }
+        self.cities = {
+            (state_id, name): pk
+            for pk, state_id, name in City.objects.values_list("id", "state_id", "name")
+        }
+
+    def resolve(self, names: set) -> tuple[dict, set]:
+        """
+        Map (country, state, city) name tuples to city ids, creating any missing rows.
+        Return the map and the cache scopes whose dropdown lists gained a row
+        """
+        touched = set()
+        new_countries = {country for country, _, _ in names} - self.countries.keys()
+        if new_countries:
+            Country.objects.bulk_create(
+                [Country(name=name) for name in new_countries], ignore_conflicts=True
+            )
+            self.countries.update(
+                Country.objects.filter(name__in=new_countries).values_list("name", "id")
+            )
+            touched.add(COUNTRIES_SCOPE)
+
+        state_names = {(self.countries[country], state) for country, state, _ in names}
+        new_states = state_names - self.states.keys()
+        if new_states:
+            State.objects.bulk_create(
+                [State(country_id=country_id, name=name) for country_id, name in new_states],
+                ignore_conflicts=True,
+            )
+            self._refetch(State, "country_id", new_states, self.states)
+            touched.update(country_scope(country) for country, _, _ in names)
+
+        city_names = {
+            (self.states[(self.countries[country], state)], city)
+            for country, state, city in names
+        }
+        new_cities = city_names - self.cities.keys()
+        if new_cities:
+            City.objects.bulk_create(
+                [City(state_id=state_id, name=name) for state_id, name in new_cities],
+                ignore_conflicts=True,
+            )
+            self._refetch(City, "state_id", new_cities, self.cities)
+            touched.update(state_scope(state, country) for country, state, _ in names)
+
+        if touched:
+            touched.add(GEOGRAPHY_SCOPE)
+        city_ids = {
+            (country, state, city): self.cities[(self.states[(self.countries[country], state)], city)]
+            for country, state, city in names
+        }
+        return city_ids, touched
+
+    @staticmethod
+    def _refetch(model, parent_field: str, keys: set, ids: dict):
+        parent_ids = {parent_id for parent_id, _ in keys}
+        names = {name for _, name in keys}
+        rows = model.objects.filter(
+            **{f"{parent_field}__in": parent_ids, "name__in": names}
+        ).values_list("id", parent_field, "name")
+        for pk, parent_id, name in rows:
+            ids[(parent_id, name)] = pk
+
+
+def _import_batch(batch: list, geography: GeographyMap) -> tuple[int, set]:
+    """
+    Write one batch of rows. Return the number of reviews written and the
+    cache scopes the batch touched
+    """
+    parsed = []
+    for row in batch:
+        try:
+            address_dict = get_address_dict(row["full_address"])
+            review = _review_fields(row)
+            names = (address_dict["country"], address_dict["state"], address_dict["city"])
+            _validate(row["full_address"], names, review)
+        except (KeyError, IndexError, TypeError, ValueError, ValidationError) as e:
+            logger.warning("Skipping review row %s: %r", row, e)
+            continue
+        parsed.append((row["full_address"], names, row.get("username") or None, review))
+    if not parsed:
+        return 0, set()
+
+    city_ids, touched = geography.resolve({names for _, names, _, _ in parsed})
+
+    address_cities = {full_address: city_ids[names] for full_address, names, _, _ in parsed}
+    address_keys = {full_address: get_address_key(full_address) for full_address in address_cities}
+    # (id, city id) by key
+    addresses = {
+        key: (pk, city_id)
+        for key, pk, city_id in Address.objects.filter(
+            canonical_key__in=set(address_keys.values())
+        ).values_list("canonical_key", "id", "city_id")
+    }
+    new_addresses = {}
+    for full_address, city_id in address_cities.items():
+        key = address_keys[full_address]
+        if key not in addresses and key not in new_addresses:
+            new_addresses[key] = Address(
+                full_address=full_address,
+                city_id=city_id,
+                slug=get_address_slug(full_address),
+                canonical_key=key,
+            )
+    if new_addresses:
+        # Another writer may add one of these addresses first, theirs is used then
+        Address.objects.bulk_create(new_addresses.values(), ignore_conflicts=True)
+        addresses.update(
+            (key, (pk, city_id))
+            for key, pk, city_id in Address.objects.filter(canonical_key__in=new_addresses).values_list(
+                "canonical_key", "id", "city_id"
+            )
+        )
+        touched.add(ADDRESSES_SCOPE)
+        touched.update(address_id_scope(addresses[key][0]) for key in new_addresses)
+
+    usernames = {username for _, _, username, _ in parsed if username}
+    user_ids = dict(User.objects.filter(username__in=usernames).values_list("username", "id"))
+
+    # Duplicate reviews are dropped by the insert, so the count is taken from the table
+    address_ids = [pk for pk, _ in addresses.values()]
+    existing = Review.objects.filter(address_id__in=address_ids).count()
+    Review.objects.bulk_create(
+        [
+            Review(
+                address_id=addresses[address_keys[full_address]][0],
+                city_id=addresses[address_keys[full_address]][1],
+                user_id=user_ids.get(username),
+                **review,
+            )
+            for full_address, _, username, review in parsed
+        ],
+        ignore_conflicts=True,
+    )
+    imported = Review.objects.filter(address_id__in=address_ids).count() - existing
+    rebuild_address_summaries(address_ids)
+
+    touched.update(address_scope(full_address) for full_address in address_cities)
+    touched.update(user_scope(user_id) for user_id in user_ids.values())
+    for country, state, city in city_ids:
+        touched.update(
+            [city_scope(city, state, country), state_scope(state, country), country_scope(country)]
+        )
+    return imported, touched
+
+
+def _validate(full_address: str, names: tuple, review: dict):
+    """
+    Raise ValidationError for a row the database would reject
+    """
+    for model, field, value in (
+        (Address, "full_address", full_address),
+        (Address, "slug", get_address_slug(full_address)),
+        (Address, "canonical_key", get_address_key(full_address)),
+        (Country, "name", names[0]),
+        (State, "name", names[1]),
+        (City, "name", names[2]),
+        (Review, "title", review["title"]),
+    ):
+        model._meta.get_field(field).run_validators(value)
+    # The title may be blank here, unlike in the review form
+    Review(**review).clean_fields(exclude=["address", "city", "user", "title", "search_vector"])
+
+
+def _review_fields(row: dict) -> dict:
+    return {
+        "title": row.get("title") or "",
+        "comment": row["comment"],
+        "rating": int(row["rating"]),
+        "starting_rent": _int_or_none(row.get("starting_rent")),
+        "starting_rent_month_year": _date_or_none(row.get("starting_rent_month_year")),
+        "ending_rent": _int_or_none(row.get("ending_rent")),
+        "ending_rent_month_year": _date_or_none(row.get("ending_rent_month_year")),
+    }
+
+
+def _int_or_none(value) -> int | None:
+    return int(value) if value not in (None, "") else None
+
+
+def _date_or_none(value) -> date | None:
+    return date.fromisoformat(value) if value else None
+
+
+def _read_rows(file, input_format: str):
+    if input_format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Counted as skipped by _import_batch
+                    yield None
+
+
+def _read_checkpoint(checkpoint: str) -> int:
+    try:
+        with open(checkpoint, encoding="utf-8") as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+    except ValueError as e:
+        raise CommandError(f"Unreadable checkpoint {checkpoint}: {e}") from e
+
+
+def _write_checkpoint(checkpoint: str, done: int):
+    # Write then rename so a crash never leaves a half written checkpoint
+    with open(f"{checkpoint}.tmp", "w", encoding="utf-8") as file:
+        file.write(str(done))
+    os.replace(f"{checkpoint}.tmp", checkpoint)
@@ -0,0 +1,42 @@
+"""
+Print archived log records by time window, level or request id.
+
+Only the archived hours whose index allows a match are decompressed.
+Times without an offset are taken as the server's local time.
+"""
+import os
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from main.utils.log_archive_utils import LEVELS, days_ago, query
+
+
+class Command(BaseCommand):
+    help = "Search the log archives by time window, minimum level or request id"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=_time, help="ISO time, e.g. 2023-04-01T13:00")
+        parser.add_argument("--until", type=_time, help="ISO time, e.g. 2023-04-01T14:30")
+        parser.add_argument("--level", choices=LEVELS, help="Minimum level")
+        parser.add_argument("--request-id")
+        parser.add_argument("--days", type=int, default=settings.LOG_RETENTION_DAYS, help="Archived days to search")
+        parser.add_argument("--archive-dir", default=settings.LOG_ARCHIVE_DIR)
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options["archive_dir"]):
+            raise CommandError(f"No log archive at {options['archive_dir']}")
+        levels = LEVELS[LEVELS.index(options["level"]):] if options["level"] else None
+        for line in query(
+            options["archive_dir"],
+            os.path.basename(settings.LOG_FILE),
+            since=options["since"],
+            until=options["until"],
+            levels=levels,
+            request_id=options["request_id"],
+            first_day=days_ago(options["days"]),
+        ):
+            self.stdout.write(line)
+
+
+def _time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
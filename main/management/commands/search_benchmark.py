@@ -0,0 +1,171 @@
+"""
+Measure review search latency as the review table grows.
+
+Seeds a throwaway country with generated reviews up to each requested size,
+plants a fixed number of reviews that match a rare term, and times the first
+page and a deep page of results at every size, for the rare term and for a
+common word that a large share of the reviews contain. The seeded rows are
+removed afterwards unless --keep is given. Postgres only.
+"""
+import statistics
+import time
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from main.models import City, Country, State
+from main.utils.database_utils import asearch_reviews
+
+BENCHMARK_COUNTRY = "search-benchmark"
+MATCH_TERM = "zanzibarite"
+# One of WORDS, its matches grow with the table
+COMMON_TERM = "landlord"
+WORDS = [
+    "quiet", "noisy", "landlord", "repair", "kitchen", "parking", "neighbors",
+    "heating", "leak", "deposit", "friendly", "pests", "laundry", "view",
+    "management", "maintenance", "spacious", "cramped", "rent", "lease",
+]
+
+REVIEWS_PER_ADDRESS = 10
+
+SEED_ADDRESSES_SQL = """
+INSERT INTO main_address (full_address, city_id, slug, canonical_key)
+SELECT n || ' Benchmark Way', %(city_id)s, '', %(country)s || ' ' || n
+FROM generate_series(%(start)s, %(stop)s) AS n
+ON CONFLICT (canonical_key) DO NOTHING
+"""
+
+SEED_REVIEWS_SQL = """
+INSERT INTO main_review (address_id, city_id, title, comment, rating, pub_date)
+SELECT
+    a.id,
+    %(city_id)s,
+    w[1 + (n * 7) %% 20] || ' ' || w[1 + (n * 13) %% 20],
+    w[1 + n %% 20] || ' ' || w[1 + (n * 3) %% 20] || ' '
+        || w[1 + (n * 11) %% 20] || ' ' || w[1 + (n * 17) %% 20]
+        || CASE WHEN n <= %(matches)s THEN ' ' || %(term)s ELSE '' END,
+    n %% 6,
+    now() - make_interval(secs => n)
+FROM generate_series(%(start)s, %(stop)s) AS n
+JOIN (
+    SELECT id, row_number() OVER (ORDER BY id) - 1 AS idx
+    FROM main_address WHERE city_id = %(city_id)s
+) AS a ON a.idx = n %% %(address_count)s
+CROSS JOIN CAST(%(words)s AS text[]) AS w
+"""
+
+
+class Command(BaseCommand):
+    help = "Benchmark review search latency against a seeded table of growing size"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[100_000, 1_000_000, 3_000_000],
+            help="Seeded review counts to measure at, in increasing order",
+        )
+        parser.add_argument(
+            "--matches",
+            type=int,
+            default=500,
+            help="Number of seeded reviews matching the query, the same at every size",
+        )
+        parser.add_argument("--runs", type=int, default=20)
+        parser.add_argument("--deep-page", type=int, default=10)
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded reviews")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Full-text search is only available on Postgres")
+        sizes = sorted(options["sizes"])
+        city = self._benchmark_city()
+        try:
+            seeded = 0
+            self.stdout.write(
+                f"reviews    term          first page p50/p99 ms    page {options['deep_page']} p50/p99 ms"
+            )
+            for size in sizes:
+                self._seed(city.pk, seeded + 1, size, options["matches"])
+                seeded = size
+                for term in (MATCH_TERM, COMMON_TERM):
+                    first = self._time_page(term, 1, options["runs"])
+                    deep = self._time_page(term, options["deep_page"], options["runs"])
+                    self.stdout.write(
+                        f"{size:>9,}    {term:<12}  {first[0]:>8.2f} / {first[1]:<8.2f}       "
+                        f"{deep[0]:>8.2f} / {deep[1]:<8.2f}"
+                    )
+        finally:
+            if not options["keep"]:
+                self._cleanup(city)
+
+    def _benchmark_city(self) -> City:
+        country = Country.objects.get_or_create(name=BENCHMARK_COUNTRY)[0]
+        state = State.objects.get_or_create(country=country, name="bench")[0]
+        return City.objects.get_or_create(state=state, name="bench")[0]
+
+    def _seed(self, city_id: int, start: int, stop: int, matches: int):
+        """
+        Add reviews start..stop, spread over new addresses in the benchmark city
+        """
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SEED_ADDRESSES_SQL,
+                {
+                    "city_id": city_id,
+                    "country": BENCHMARK_COUNTRY,
+                    "start": start // REVIEWS_PER_ADDRESS,
+                    "stop": stop // REVIEWS_PER_ADDRESS,
+                },
+            )
+            cursor.execute(
+                "SELECT count(*) FROM main_address WHERE city_id = %s", [city_id]
+            )
+            address_count = cursor.fetchone()[0]
+            cursor.execute(
+                SEED_REVIEWS_SQL,
+                {
+                    "city_id": city_id,
+                    "address_count": address_count,
+                    "words": WORDS,
+                    "matches": matches,
+                    "term": MATCH_TERM,
+                    "start": start,
+                    "stop": stop,
+                },
+            )
+            cursor.execute("ANALYZE main_address")
+            cursor.execute("ANALYZE main_review")
+        self.stdout.write(
+            f"seeded reviews {start:,}..{stop:,} in {time.monotonic() - started:.1f}s",
+            style_func=self.style.NOTICE,
+        )
+
+    def _time_page(self, term: str, page: int, runs: int) -> tuple[float, float]:
+        """
+        Return the p50 and p99 latency in ms of fetching the given results page for `term`
+        """
+        search = async_to_sync(asearch_reviews)
+        cursor = None
+        for _ in range(page - 1):
+            _, cursor = search(term, country=BENCHMARK_COUNTRY, cursor=cursor)
+
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            search(term, country=BENCHMARK_COUNTRY, cursor=cursor)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+    def _cleanup(self, city: City):
+        # Plain SQL, the ORM cascade would load every seeded row into memory first
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM main_review WHERE address_id IN "
+                "(SELECT id FROM main_address WHERE city_id = %s)",
+                [city.pk],
+            )
+            cursor.execute("DELETE FROM main_address WHERE city_id = %s", [city.pk])
+        Country.objects.filter(name=BENCHMARK_COUNTRY).delete()
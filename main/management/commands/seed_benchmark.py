@@ -0,0 +1,279 @@
+"""
+Seed a synthetic dataset for the load benchmark.
+
+Countries, states, cities, addresses, users and reviews are generated from a
+fixed random seed, so the same options always produce the same data. Traffic
+to real rental sites is lopsided, and so is the data: addresses are spread
+over cities, reviews over addresses and reviews over users by a Zipf-like
+distribution, so a few big cities, busy buildings and prolific reviewers
+account for most of the rows. Works on SQLite and Postgres.
+"""
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from main.models import Address, City, Country, Review, State
+from main.utils.address_utils import get_address_key, get_address_slug
+from main.utils.cache_utils import (
+    ADDRESSES_SCOPE,
+    COUNTRIES_SCOPE,
+    GEOGRAPHY_SCOPE,
+    city_scope,
+    country_scope,
+    reset_generations,
+    state_scope,
+)
+from main.utils.database_utils import rebuild_address_summaries
+
+BENCHMARK_COUNTRY_PREFIX = "benchland"
+BENCHMARK_USER_PREFIX = "bench-user-"
+# Every generated user logs in with this password
+BENCHMARK_PASSWORD = "benchmark-password"
+
+STREET_NAMES = [
+    "Oak", "Maple", "Cedar", "Pine", "Elm", "Main", "Lake", "Hill", "Park", "Church",
+    "Mill", "River", "Spring", "Walnut", "Sunset", "Washington", "Highland", "Meadow",
+]
+STREET_SUFFIXES = ["Street", "Avenue", "Lane", "Drive", "Court", "Road", "Way", "Boulevard"]
+SYLLABLES = ["ash", "bel", "cor", "dun", "el", "fair", "glen", "har", "iver", "kings", "lor", "mar"]
+WORDS = [
+    "quiet", "noisy", "landlord", "repair", "kitchen", "parking", "neighbors",
+    "heating", "leak", "deposit", "friendly", "pests", "laundry", "view",
+    "management", "maintenance", "spacious", "cramped", "rent", "lease",
+]
+# Most reviews are glowing or scathing
+RATING_WEIGHTS = [8, 14, 8, 12, 26, 32]
+
+SEEDED_ADDRESS_IDS = """
+SELECT id FROM main_address WHERE city_id IN (
+    SELECT id FROM main_city WHERE state_id IN (
+        SELECT id FROM main_state WHERE country_id IN (
+            SELECT id FROM main_country WHERE name LIKE %s
+        )
+    )
+)
+"""
+CLEAR_TABLES = [
+    ("main_review", "address_id"),
+    ("main_addresssummary", "address_id"),
+    ("main_address", "id"),
+]
+
+
+def zipf_weights(count: int, skew: float) -> list[float]:
+    """
+    Cumulative weights of `count` ranks where rank r is picked in proportion to 1 / r ** skew
+    """
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def _state_code(index: int) -> str:
+    # Letters only, so the state never reads as part of the postal code
+    return "".join(chr(ord("A") + (index // 26 ** power) % 26) for power in (1, 0))
+
+
+def _city_name(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+
+
+class Command(BaseCommand):
+    help = "Seed a reproducible, skewed synthetic dataset for the load benchmark"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--countries", type=int, default=2)
+        parser.add_argument("--states", type=int, default=10, help="States per country")
+        parser.add_argument("--cities", type=int, default=20, help="Cities per state")
+        parser.add_argument("--addresses", type=int, default=20_000)
+        parser.add_argument("--users", type=int, default=2_000)
+        parser.add_argument("--reviews", type=int, default=100_000)
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.1,
+            help="Zipf exponent of how addresses, reviews and reviewers are spread, 0 for uniform",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Remove previously seeded benchmark data first",
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            self._clear()
+        rng = random.Random(options["seed"])
+        started = time.monotonic()
+        cities = self._seed_geography(rng, options["countries"], options["states"], options["cities"])
+        addresses = self._seed_addresses(rng, cities, options)
+        users = self._seed_users(options["users"], options["batch_size"])
+        self._seed_reviews(rng, addresses, users, options)
+
+        reset_generations(
+            [COUNTRIES_SCOPE, GEOGRAPHY_SCOPE, ADDRESSES_SCOPE]
+            + [scope for city in cities for scope in self._city_scopes(city)]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(cities)} cities, {len(addresses)} addresses, {len(users)} users "
+                f"and {options['reviews']} reviews in {time.monotonic() - started:.1f}s"
+            )
+        )
+
+    def _clear(self):
+        # Plain SQL, the ORM cascade would load every seeded review to send its signals
+        like = f"{BENCHMARK_COUNTRY_PREFIX}%"
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, column in CLEAR_TABLES:
+                cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({SEEDED_ADDRESS_IDS})", [like])
+            Country.objects.filter(name__startswith=BENCHMARK_COUNTRY_PREFIX).delete()
+            User.objects.filter(username__startswith=BENCHMARK_USER_PREFIX).delete()
+
+    def _seed_geography(self, rng: random.Random, countries: int, states: int, cities: int) -> list:
+        country_objs = Country.objects.bulk_create(
+            Country(name=f"{BENCHMARK_COUNTRY_PREFIX}-{i}") for i in range(countries)
+        )
+        state_objs = State.objects.bulk_create(
+            State(country=country, name=_state_code(i).lower())
+            for country in country_objs
+            for i in range(states)
+        )
+        city_objs = []
+        for state in state_objs:
+            names = set()
+            while len(names) < cities:
+                names.add(_city_name(rng))
+            city_objs.extend(City(state=state, name=name) for name in sorted(names))
+        City.objects.bulk_create(city_objs)
+        # Reloaded with the state and country names the addresses are written with
+        return list(
+            City.objects.filter(state__country__in=country_objs)
+            .select_related("state__country")
+            .order_by("id")
+        )
+
+    def _seed_addresses(self, rng: random.Random, cities: list, options: dict) -> list:
+        """
+        Spread addresses over the cities, the first cities getting the most
+        """
+        city_weights = zipf_weights(len(cities), options["skew"])
+        postal_codes = {city.pk: f"{10000 + index * 7:05d}" for index, city in enumerate(cities)}
+        used = set()
+        addresses = []
+        while len(addresses) < options["addresses"]:
+            city = rng.choices(cities, cum_weights=city_weights)[0]
+            full_address = (
+                f"{rng.randint(1, 9999)} {rng.choice(STREET_NAMES)} {rng.choice(STREET_SUFFIXES)}, "
+                f"{city.name.title()}, {city.state.name.upper()} {postal_codes[city.pk]}, "
+                f"{city.state.country.name.title()}"
+            )
+            key = get_address_key(full_address)
+            if key in used:
+                continue
+            used.add(key)
+            addresses.append(
+                Address(
+                    full_address=full_address,
+                    city=city,
+                    slug=get_address_slug(full_address),
+                    canonical_key=key,
+                )
+            )
+        for batch in _batches(addresses, options["batch_size"]):
+            Address.objects.bulk_create(batch)
+        return list(
+            Address.objects.filter(canonical_key__in=used).order_by("id").values_list("id", "city_id")
+        )
+
+    def _seed_users(self, count: int, batch_size: int) -> list:
+        # Hashed once, a hash per user would take longer than the rest of the seeding
+        password = make_password(BENCHMARK_PASSWORD)
+        users = [
+            User(
+                username=f"{BENCHMARK_USER_PREFIX}{i}",
+                email=f"{BENCHMARK_USER_PREFIX}{i}@example.com",
+                password=password,
+            )
+            for i in range(count)
+        ]
+        for batch in _batches(users, batch_size):
+            User.objects.bulk_create(batch)
+        return list(
+            User.objects.filter(username__startswith=BENCHMARK_USER_PREFIX)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def _seed_reviews(self, rng: random.Random, addresses: list, users: list, options: dict):
+        """
+        Spread reviews over addresses and users, the first of each getting the most.
+        Reviews are dated over the last five years in no particular id order. No
+        review has an ending date, so none can clash on the unique constraint.
+        """
+        address_weights = zipf_weights(len(addresses), options["skew"])
+        # Shuffled so the busiest addresses aren't all in the busiest city
+        addresses = addresses[:]
+        rng.shuffle(addresses)
+        user_weights = zipf_weights(len(users), options["skew"])
+        now = timezone.now()
+        remaining = options["reviews"]
+        while remaining > 0:
+            count = min(remaining, options["batch_size"])
+            reviews = []
+            for _ in range(count):
+                address_id, city_id = rng.choices(addresses, cum_weights=address_weights)[0]
+                reviews.append(self._review(rng, address_id, city_id, users, user_weights, now))
+            with transaction.atomic(), _keep_pub_dates():
+                Review.objects.bulk_create(reviews)
+                rebuild_address_summaries({review.address_id for review in reviews})
+            remaining -= count
+            self.stdout.write(f"{options['reviews'] - remaining} reviews seeded")
+
+    @staticmethod
+    def _review(rng: random.Random, address_id, city_id, users, user_weights, now) -> Review:
+        starting_rent = None
+        starting_date = None
+        if rng.random() < 0.6:
+            starting_rent = int(rng.lognormvariate(7.3, 0.35))
+            starting_date = date(2015, 1, 1) + timedelta(days=rng.randint(0, 3000))
+        words = rng.choices(WORDS, k=rng.randint(6, 40))
+        review = Review(
+            address_id=address_id,
+            city_id=city_id,
+            user_id=rng.choices(users, cum_weights=user_weights)[0],
+            title=" ".join(rng.choices(WORDS, k=3)),
+            comment=" ".join(words),
+            rating=rng.choices(range(6), weights=RATING_WEIGHTS)[0],
+            starting_rent=starting_rent,
+            starting_rent_month_year=starting_date,
+        )
+        review.pub_date = now - timedelta(seconds=rng.randint(0, 5 * 365 * 24 * 3600))
+        return review
+
+    @staticmethod
+    def _city_scopes(city: City) -> list:
+        state, country = city.state.name, city.state.country.name
+        return [city_scope(city.name, state, country), state_scope(state, country), country_scope(country)]
+
+
+@contextmanager
+def _keep_pub_dates():
+    # Otherwise auto_now_add stamps every generated review with the time it was seeded
+    field = Review._meta.get_field("pub_date")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def _batches(rows: list, size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
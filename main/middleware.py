@@ -0,0 +1,283 @@
+"""
+Middleware
+"""
+import asyncio
+import re
+import uuid
+from contextvars import ContextVar
+from hashlib import md5
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.middleware.cache import FetchFromCacheMiddleware, UpdateCacheMiddleware
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import http_date
+from whitenoise.middleware import WhiteNoiseMiddleware
+from main.utils.cache_utils import (
+    ADDRESSES_SCOPE,
+    COUNTRIES_SCOPE,
+    city_scope,
+    country_scope,
+    get_version,
+    state_scope,
+)
+from main.utils.logging_utils import request_id
+from main.utils import replica_utils
+from main.utils.metrics_utils import finish_request, start_request
+
+_page_key_prefix: ContextVar[str] = ContextVar('page_key_prefix', default='')
+# An id passed in by a proxy is kept if it looks like one
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+def get_page_scope(request) -> tuple:
+    """
+    Return the cache scope whose data a page renders, so a write to that scope
+    also retires the cached page
+    """
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return COUNTRIES_SCOPE
+    kwargs = match.kwargs
+    if 'city' in kwargs:
+        return city_scope(kwargs['city'], kwargs['state'], kwargs['country'])
+    if match.url_name == 'get_states_list':
+        return country_scope(request.GET.get('country'))
+    if match.url_name == 'get_cities_list':
+        return state_scope(request.GET.get('state'), request.GET.get('country'))
+    if match.url_name == 'suggest_addresses':
+        return ADDRESSES_SCOPE
+    return COUNTRIES_SCOPE
+
+
+def get_page_version(request) -> tuple[int, float | None]:
+    """
+    Return the generation of the page's scope and when it last changed, read once per request
+    """
+    if not hasattr(request, '_page_version'):
+        request._page_version = get_version(get_page_scope(request))
+    return request._page_version
+
+
+class _GenerationalKeyPrefix:
+    """
+    Swap the cache middleware's fixed key_prefix for one that carries the
+    generation of the page's scope. The prefix is worked out once per request
+    and kept on the request, the context var only hands it to the parent class.
+    """
+
+    @property
+    def key_prefix(self) -> str:
+        return _page_key_prefix.get()
+
+    @key_prefix.setter
+    def key_prefix(self, value):
+        pass
+
+    def _use_request_prefix(self, request):
+        if not hasattr(request, '_page_key_prefix'):
+            generation, _ = get_page_version(request)
+            request._page_key_prefix = f'{settings.CACHE_MIDDLEWARE_KEY_PREFIX}.{generation}'
+        _page_key_prefix.set(request._page_key_prefix)
+
+
+class GenerationalUpdateCacheMiddleware(_GenerationalKeyPrefix, UpdateCacheMiddleware):
+    def process_response(self, request, response):
+        if self._should_update_cache(request, response):
+            self._use_request_prefix(request)
+        return super().process_response(request, response)
+
+
+class GenerationalFetchFromCacheMiddleware(_GenerationalKeyPrefix, FetchFromCacheMiddleware):
+    def process_request(self, request):
+        if request.method in ('GET', 'HEAD'):
+            self._use_request_prefix(request)
+        return super().process_request(request)
+
+
+class ConditionalPageMiddleware(MiddlewareMixin):
+    """
+    Answer repeat requests for review pages and the dropdown lists with a 304
+    before the view, or the page cache, runs. The page's scope generation moves
+    on every write the page shows, so it makes a validator without touching the
+    reviews. The pages greet the logged in user and carry a CSRF token, so the
+    ETag also covers the session and CSRF cookies, and Last-Modified is only
+    sent to visitors without a session.
+    """
+    pages = {'list_reviews', 'list_reviews_by_city', 'get_states_list', 'get_cities_list'}
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD') or not self._is_conditional_page(request):
+            return None
+        # Errors are shown once, a page carrying them must be sent in full
+        if request.COOKIES.get(settings.SESSION_COOKIE_NAME) and request.session.get('errors'):
+            return None
+        generation, modified = get_page_version(request)
+        validator = '|'.join([
+            str(generation),
+            request.get_full_path(),
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME, ''),
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        ])
+        request._page_etag = f'W/"{md5(validator.encode()).hexdigest()}"'
+        request._page_last_modified = None
+        if modified is not None and not request.COOKIES.get(settings.SESSION_COOKIE_NAME):
+            request._page_last_modified = int(modified)
+        return get_conditional_response(
+            request, etag=request._page_etag, last_modified=request._page_last_modified
+        )
+
+    def process_response(self, request, response):
+        etag = getattr(request, '_page_etag', None)
+        if etag and response.status_code == 200:
+            # Overwrite, a page from the page cache carries the validators of whoever stored it
+            response.headers['ETag'] = etag
+            if request._page_last_modified is not None:
+                response.headers['Last-Modified'] = http_date(request._page_last_modified)
+            else:
+                response.headers.pop('Last-Modified', None)
+        return response
+
+    def _is_conditional_page(self, request) -> bool:
+        try:
+            return resolve(request.path_info).url_name in self.pages
+        except Resolver404:
+            return False
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise only ships a sync middleware, which makes Django run every async
+    view below it on a thread. Looking up a static file doesn't block, so in
+    async mode the same lookup is done inline and the request is awaited.
+    """
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class RequestIdMiddleware:
+    """
+    Give each request an id, taken from an X-Request-ID header or made up,
+    which every log record of the request carries and the response echoes
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = request_id.set(_request_id(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id.reset(token)
+        response.headers['X-Request-ID'] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        token = request_id.set(_request_id(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id.reset(token)
+        response.headers['X-Request-ID'] = request.request_id
+        return response
+
+
+def _request_id(request) -> str:
+    given = request.headers.get('X-Request-ID', '')
+    request.request_id = given if _REQUEST_ID.fullmatch(given) else uuid.uuid4().hex
+    return request.request_id
+
+
+class RequestMetricsMiddleware:
+    """
+    Record each request's wall time, SQL queries, cache lookups and template
+    time under the name of the view that served it. First in MIDDLEWARE, so
+    pages served from the page cache are counted too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics, token = start_request()
+        response = self.get_response(request)
+        finish_request(metrics, token, _view_name(request), request.method, response.status_code)
+        return response
+
+    async def __acall__(self, request):
+        metrics, token = start_request()
+        response = await self.get_response(request)
+        finish_request(metrics, token, _view_name(request), request.method, response.status_code)
+        return response
+
+
+class PrimaryPinningMiddleware:
+    """
+    Route the request's reads to the primary database if its browser wrote
+    recently, and pin the browser when the request writes
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        routing, token = replica_utils.start_request(request)
+        response = self.get_response(request)
+        replica_utils.finish_request(routing, token, response)
+        return response
+
+    async def __acall__(self, request):
+        routing, token = replica_utils.start_request(request)
+        response = await self.get_response(request)
+        replica_utils.finish_request(routing, token, response)
+        return response
+
+
+def _view_name(request) -> str:
+    match = request.resolver_match
+    if match is None:
+        # Answered before URL resolution, by the page cache or a 304
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unmatched'
+    return match.view_name
@@ -0,0 +1,84 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:35
+
+from itertools import groupby
+from statistics import median
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def _rent_stats(rents):
+    # Frozen copy of the summary calculation as of this migration
+    values = sorted(rent for rent in rents if rent is not None)
+    if not values:
+        return None, None, None
+    return values[0], values[-1], float(median(values))
+
+
+def _summary_fields(rows):
+    starting_min, starting_max, starting_median = _rent_stats(row[1] for row in rows)
+    ending_min, ending_max, ending_median = _rent_stats(row[2] for row in rows)
+    return {
+        "review_count": len(rows),
+        "rating_sum": sum(row[0] for row in rows),
+        "starting_rent_min": starting_min,
+        "starting_rent_max": starting_max,
+        "starting_rent_median": starting_median,
+        "ending_rent_min": ending_min,
+        "ending_rent_max": ending_max,
+        "ending_rent_median": ending_median,
+    }
+
+
+def build_summaries(apps, schema_editor):
+    Review = apps.get_model("main", "Review")
+    AddressSummary = apps.get_model("main", "AddressSummary")
+    # Streamed in address order, so only one address's reviews and one batch of summaries are held at a time
+    rows = (
+        Review.objects.order_by("address_id")
+        .values_list("address_id", "rating", "starting_rent", "ending_rent")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batch = []
+    for address_id, address_rows in groupby(rows, key=lambda row: row[0]):
+        batch.append(
+            AddressSummary(address_id=address_id, **_summary_fields([row[1:] for row in address_rows]))
+        )
+        if len(batch) >= BATCH_SIZE:
+            AddressSummary.objects.bulk_create(batch)
+            batch = []
+    AddressSummary.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0003_country_state_country"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AddressSummary",
+            fields=[
+                (
+                    "address",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="main.address",
+                    ),
+                ),
+                ("review_count", models.IntegerField(default=0)),
+                ("rating_sum", models.IntegerField(default=0)),
+                ("starting_rent_min", models.IntegerField(blank=True, null=True)),
+                ("starting_rent_max", models.IntegerField(blank=True, null=True)),
+                ("starting_rent_median", models.FloatField(blank=True, null=True)),
+                ("ending_rent_min", models.IntegerField(blank=True, null=True)),
+                ("ending_rent_max", models.IntegerField(blank=True, null=True)),
+                ("ending_rent_median", models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:40
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def _merge_duplicates(model, group_fields, child_model, child_field):
+    """
+    Point children of duplicate rows at the oldest row of each group, then drop the rest
+    """
+    duplicates = (
+        model.objects.values(*group_fields)
+        .annotate(keep_id=Min("id"), rows=Count("id"))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        keep_id = duplicate.pop("keep_id")
+        duplicate.pop("rows")
+        extra_ids = list(
+            model.objects.filter(**duplicate)
+            .exclude(id=keep_id)
+            .values_list("id", flat=True)
+        )
+        child_model.objects.filter(**{f"{child_field}__in": extra_ids}).update(
+            **{f"{child_field}_id": keep_id}
+        )
+        model.objects.filter(id__in=extra_ids).delete()
+
+
+def merge_duplicate_geography(apps, schema_editor):
+    Country = apps.get_model("main", "Country")
+    State = apps.get_model("main", "State")
+    City = apps.get_model("main", "City")
+    Address = apps.get_model("main", "Address")
+    # Parents first, merging countries can turn states into duplicates and so on
+    _merge_duplicates(Country, ["name"], State, "country")
+    _merge_duplicates(State, ["country", "name"], City, "state")
+    _merge_duplicates(City, ["state", "name"], Address, "city")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0004_addresssummary"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_geography, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0005_merge_duplicate_geography"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="address",
+            name="full_address",
+            field=models.CharField(db_index=True, max_length=300),
+        ),
+        migrations.AlterField(
+            model_name="country",
+            name="name",
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name="city",
+            unique_together={("state", "name")},
+        ),
+        migrations.AlterUniqueTogether(
+            name="state",
+            unique_together={("country", "name")},
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["user", "-pub_date"], name="review_user_pub_date_idx"
+            ),
+        ),
+    ]
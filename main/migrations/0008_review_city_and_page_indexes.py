@@ -0,0 +1,58 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_address_cities(apps, schema_editor):
+    Address = apps.get_model("main", "Address")
+    Review = apps.get_model("main", "Review")
+    Review.objects.update(
+        city_id=models.Subquery(
+            Address.objects.filter(pk=models.OuterRef("address_id")).values("city_id")
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0007_review_search_vector"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="review",
+            name="review_user_pub_date_idx",
+        ),
+        migrations.AddField(
+            model_name="review",
+            name="city",
+            field=models.ForeignKey(
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="main.city",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["user", "-pub_date", "-id"], name="review_user_pub_date_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["city", "-pub_date", "-id"], name="review_city_pub_date_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["address", "-pub_date", "-id"],
+                name="review_address_pub_date_id_idx",
+            ),
+        ),
+        migrations.RunPython(copy_address_cities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def _address_slug(address):
+    # Frozen copy of the slug of a full address as of this migration
+    address_fields = [f.replace(" ", "-").lower() for f in address.split(", ")]
+    try:
+        address_fields = address_fields[:-1] + address_fields[2].split("-")
+        street, city, state, country = (address_fields[i] for i in (0, 1, 2, 4))
+    except IndexError:
+        return ""
+    return "/".join((country, state, city, street))
+
+
+def fill_address_slugs(apps, schema_editor):
+    Address = apps.get_model("main", "Address")
+    batch = []
+    for address in Address.objects.only("id", "full_address").iterator(chunk_size=BATCH_SIZE):
+        address.slug = _address_slug(address.full_address)
+        batch.append(address)
+        if len(batch) == BATCH_SIZE:
+            Address.objects.bulk_update(batch, ["slug"])
+            batch = []
+    Address.objects.bulk_update(batch, ["slug"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0008_review_city_and_page_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="slug",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=300
+            ),
+        ),
+        migrations.RunPython(fill_address_slugs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:27
+
+import re
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+# Frozen copy of the address key as of this migration
+STREET_ABBREVIATIONS = {
+    "avenue": "ave",
+    "av": "ave",
+    "boulevard": "blvd",
+    "circle": "cir",
+    "court": "ct",
+    "drive": "dr",
+    "expressway": "expy",
+    "freeway": "fwy",
+    "highway": "hwy",
+    "lane": "ln",
+    "parkway": "pkwy",
+    "place": "pl",
+    "road": "rd",
+    "square": "sq",
+    "street": "st",
+    "terrace": "ter",
+    "trail": "trl",
+    "north": "n",
+    "south": "s",
+    "east": "e",
+    "west": "w",
+    "northeast": "ne",
+    "northwest": "nw",
+    "southeast": "se",
+    "southwest": "sw",
+}
+COUNTRY_ALIASES = {
+    "us": "usa",
+    "united states": "usa",
+    "united states of america": "usa",
+}
+_ADDRESS = re.compile(r"^\s*([^,]+?)\s*,\s*([^,]+?)\s*,\s*([^,]+?)\s*(?:,\s*([^,]+?)\s*)?,?\s*$")
+_STREET = re.compile(r"^(\d[\w-]*)\s+(.+)$")
+_REGION = re.compile(r"^(\D*?)\s*(\w*\d[\w -]*)?$")
+_ZIP_PLUS_FOUR = re.compile(r"^(\d{5})-\d{4}$")
+_DROPPED = re.compile(r"[.'’]")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def _normalize_words(text, aliases=None):
+    words = _SEPARATORS.sub(" ", _DROPPED.sub("", text.casefold())).split()
+    if aliases:
+        words = [aliases.get(word, word) for word in words]
+    return " ".join(words)
+
+
+def _address_key(address):
+    match = _ADDRESS.match(address)
+    street_match = match and _STREET.match(match.group(1))
+    if not street_match:
+        return _normalize_words(address)
+    _, city, region, country = match.groups()
+    state, postal_code = _REGION.match(region).groups()
+    postal_code = postal_code or ""
+    zip_match = _ZIP_PLUS_FOUR.match(postal_code)
+    if zip_match:
+        postal_code = zip_match.group(1)
+    country = _normalize_words(country or "")
+    return "|".join(
+        (
+            street_match.group(1).casefold(),
+            _normalize_words(street_match.group(2), STREET_ABBREVIATIONS),
+            _normalize_words(city),
+            _normalize_words(state),
+            _SEPARATORS.sub("", postal_code).casefold(),
+            COUNTRY_ALIASES.get(country, country),
+        )
+    )
+
+
+def fill_canonical_keys(apps, schema_editor):
+    # Duplicates are left in place, 0012 merges them
+    Address = apps.get_model("main", "Address")
+    batch = []
+    for address in Address.objects.only("id", "full_address").iterator(chunk_size=BATCH_SIZE):
+        address.canonical_key = _address_key(address.full_address)
+        batch.append(address)
+        if len(batch) == BATCH_SIZE:
+            Address.objects.bulk_update(batch, ["canonical_key"])
+            batch = []
+    Address.objects.bulk_update(batch, ["canonical_key"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0009_address_slug"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="canonical_key",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=300
+            ),
+        ),
+        migrations.RunPython(fill_canonical_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.1.7 on 2026-10-18 21:05
+
+from statistics import median
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def _rent_stats(rents):
+    # Frozen copy of the summary calculation as of this migration
+    values = sorted(rent for rent in rents if rent is not None)
+    if not values:
+        return None, None, None
+    return values[0], values[-1], float(median(values))
+
+
+def _summary_fields(rows):
+    rows = list(rows)
+    starting_min, starting_max, starting_median = _rent_stats(row[1] for row in rows)
+    ending_min, ending_max, ending_median = _rent_stats(row[2] for row in rows)
+    return {
+        "review_count": len(rows),
+        "rating_sum": sum(row[0] for row in rows),
+        "starting_rent_min": starting_min,
+        "starting_rent_max": starting_max,
+        "starting_rent_median": starting_median,
+        "ending_rent_min": ending_min,
+        "ending_rent_max": ending_max,
+        "ending_rent_median": ending_median,
+    }
+
+
+def merge_duplicate_addresses(apps, schema_editor):
+    """
+    Merge addresses that share a canonical key into the oldest of each group.
+    A moved review that clashes with one the kept address already has from the
+    same user for the same rental dates is dropped.
+    """
+    Address = apps.get_model("main", "Address")
+    Review = apps.get_model("main", "Review")
+    AddressSummary = apps.get_model("main", "AddressSummary")
+    groups = (
+        Address.objects.values("canonical_key")
+        .annotate(keep_id=Min("id"), rows=Count("id"))
+        .filter(rows__gt=1)
+        .values_list("canonical_key", "keep_id")
+    )
+    for key, keep_id in list(groups):
+        duplicate_ids = list(
+            Address.objects.filter(canonical_key=key).exclude(id=keep_id).values_list("id", flat=True)
+        )
+        keep_city_id = Address.objects.filter(id=keep_id).values_list("city_id", flat=True).get()
+        taken = set(
+            Review.objects.filter(address_id=keep_id).values_list(
+                "user_id", "starting_rent_month_year", "ending_rent_month_year"
+            )
+        )
+        move_ids = []
+        drop_ids = []
+        reviews = Review.objects.filter(address_id__in=duplicate_ids).order_by("-pub_date").values_list(
+            "id", "user_id", "starting_rent_month_year", "ending_rent_month_year"
+        )
+        for review_id, *rental in reviews:
+            rental = tuple(rental)
+            if rental[0] is not None and rental in taken:
+                drop_ids.append(review_id)
+            else:
+                taken.add(rental)
+                move_ids.append(review_id)
+        Review.objects.filter(id__in=move_ids).update(address_id=keep_id, city_id=keep_city_id)
+        Review.objects.filter(id__in=drop_ids).delete()
+        Address.objects.filter(id__in=duplicate_ids).delete()
+        rows = Review.objects.filter(address_id=keep_id).values_list("rating", "starting_rent", "ending_rent")
+        AddressSummary.objects.update_or_create(address_id=keep_id, defaults=_summary_fields(rows))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0011_outboxemail"),
+    ]
+
+    # The unique constraint is added by 0013. Postgres won't alter a table that
+    # still has deferred foreign key checks pending from these deletes.
+    operations = [
+        migrations.RunPython(merge_duplicate_addresses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("main", "0012_merge_duplicate_addresses"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="address",
+            name="canonical_key",
+            field=models.CharField(default="", editable=False, max_length=300, unique=True),
+        ),
+    ]
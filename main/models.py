@@ -3,14 +3,18 @@ Models
 """
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator
+from django.utils import timezone
+from main.utils.address_utils import get_address_key, get_address_slug
 
 
 ###############################################################################
 # MODELS
 ###############################################################################
 class Country(models.Model):
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, unique=True)
 
     def __str__(self):
         return self.name
@@ -20,6 +24,9 @@ class State(models.Model):
     name = models.CharField(max_length=100)
     country = models.ForeignKey(Country, on_delete=models.CASCADE)
 
+    class Meta:
+        unique_together = ("country", "name")
+
     def __str__(self):
         return self.name
 
@@ -28,13 +35,27 @@ class City(models.Model):
     name = models.CharField(max_length=100)
     state = models.ForeignKey(State, on_delete=models.CASCADE)
 
+    class Meta:
+        unique_together = ("state", "name")
+
     def __str__(self):
         return f"{self.name}, {self.state}"
 
 
 class Address(models.Model):
-    full_address = models.CharField(max_length=300)
+    full_address = models.CharField(max_length=300, db_index=True)
     city = models.ForeignKey(City, on_delete=models.CASCADE)
+    # The country/state/city/street path of the address's review URL
+    slug = models.CharField(max_length=300, db_index=True, default="", editable=False)
+    # Spellings of the same address share one key, every lookup by address goes through it
+    canonical_key = models.CharField(max_length=300, unique=True, default="", editable=False)
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = get_address_slug(self.full_address)
+        if not self.canonical_key:
+            self.canonical_key = get_address_key(self.full_address)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.full_address
@@ -51,6 +72,10 @@ class Review(models.Model):
     ]
 
     address = models.ForeignKey(Address, on_delete=models.CASCADE)
+    # Copied from the address so a city's reviews can be paged by date on one index
+    city = models.ForeignKey(
+        City, on_delete=models.CASCADE, null=True, editable=False, db_index=False
+    )
     title = models.CharField(default='', max_length=100)
     comment = models.CharField(max_length=3000)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -64,6 +89,20 @@ class Review(models.Model):
     )
     ending_rent_month_year = models.DateField(blank=True, null=True)
     pub_date = models.DateTimeField(auto_now_add=True)
+    # Weighted title and comment lexemes, kept up to date by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the rating as loaded so an edit can apply only the difference to the summary
+        instance._loaded_rating = dict(zip(field_names, values)).get("rating")
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.city_id is None and self.address_id is not None:
+            self.city_id = self.address.city_id
+        super().save(*args, **kwargs)
 
     class Meta:
         unique_together = (
@@ -72,10 +111,83 @@ class Review(models.Model):
             "starting_rent_month_year",
             "ending_rent_month_year",
         )
+        indexes = [
+            # Review pages run newest first and are keyed on (pub_date, id),
+            # one index for each way reviews are listed
+            models.Index(fields=["user", "-pub_date", "-id"], name="review_user_pub_date_id_idx"),
+            models.Index(fields=["city", "-pub_date", "-id"], name="review_city_pub_date_id_idx"),
+            models.Index(
+                fields=["address", "-pub_date", "-id"], name="review_address_pub_date_id_idx"
+            ),
+            GinIndex(fields=["search_vector"], name="review_search_vector_idx"),
+        ]
 
     def __str__(self):
         return (
             f"address: {self.address}"
             f" - user: {self.user}"
         )
-    
\ No newline at end of file
+
+
+class AddressSummary(models.Model):
+    """
+    Denormalized review aggregates for an address, maintained on every review write
+    """
+    address = models.OneToOneField(
+        Address, on_delete=models.CASCADE, primary_key=True, related_name="summary"
+    )
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    starting_rent_min = models.IntegerField(blank=True, null=True)
+    starting_rent_max = models.IntegerField(blank=True, null=True)
+    starting_rent_median = models.FloatField(blank=True, null=True)
+    ending_rent_min = models.IntegerField(blank=True, null=True)
+    ending_rent_max = models.IntegerField(blank=True, null=True)
+    ending_rent_median = models.FloatField(blank=True, null=True)
+
+    @property
+    def rating_average(self) -> float:
+        if self.review_count > 0:
+            return round(self.rating_sum / self.review_count, 1)
+        return 0.0
+
+    def __str__(self):
+        return (
+            f"address: {self.address_id}"
+            f" - reviews: {self.review_count}"
+        )
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be delivered by the outbox worker. Delivered emails are deleted,
+    ones that ran out of attempts stay as failed.
+    """
+    PENDING = "pending"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (FAILED, "Failed")]
+
+    subject = models.TextField()
+    body = models.TextField(blank=True)
+    # (content, mimetype) pairs, like an html version of the body
+    alternatives = models.JSONField(default=list)
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    headers = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Also pushed forward while a worker holds the email, so no other worker takes it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - to: {', '.join(self.to)}"
@@ -0,0 +1,79 @@
+from rest_framework import serializers
+from ...models import AddressSummary, Review
+
+# Columns each serializer reads, passed to .only() so a page fetches nothing else
+REVIEW_COLUMNS = [
+    "id",
+    "title",
+    "comment",
+    "rating",
+    "starting_rent",
+    "starting_rent_month_year",
+    "ending_rent",
+    "ending_rent_month_year",
+    "pub_date",
+    "user__username",
+]
+CITY_REVIEW_COLUMNS = REVIEW_COLUMNS + ["address__full_address"]
+SUMMARY_COLUMNS = [
+    "address__full_address",
+    "review_count",
+    "rating_sum",
+    "starting_rent_min",
+    "starting_rent_max",
+    "starting_rent_median",
+    "ending_rent_min",
+    "ending_rent_max",
+    "ending_rent_median",
+]
+
+
+class ReviewSerializer(serializers.ModelSerializer):
+    user = serializers.CharField(source="user.username", default=None)
+
+    class Meta:
+        model = Review
+        fields = [
+            "id",
+            "title",
+            "comment",
+            "rating",
+            "starting_rent",
+            "starting_rent_month_year",
+            "ending_rent",
+            "ending_rent_month_year",
+            "pub_date",
+            "user",
+        ]
+        read_only_fields = fields
+
+
+class CityReviewSerializer(ReviewSerializer):
+    address_id = serializers.IntegerField()
+    address = serializers.CharField(source="address.full_address")
+
+    class Meta(ReviewSerializer.Meta):
+        fields = ReviewSerializer.Meta.fields + ["address_id", "address"]
+        read_only_fields = fields
+
+
+class AddressSummarySerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source="address_id")
+    full_address = serializers.CharField(source="address.full_address")
+    rating_average = serializers.FloatField()
+
+    class Meta:
+        model = AddressSummary
+        fields = [
+            "id",
+            "full_address",
+            "review_count",
+            "rating_average",
+            "starting_rent_min",
+            "starting_rent_max",
+            "starting_rent_median",
+            "ending_rent_min",
+            "ending_rent_max",
+            "ending_rent_median",
+        ]
+        read_only_fields = fields
@@ -0,0 +1,59 @@
+"""
+Signal receivers
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from main.models import Address, Review
+from main.utils.database_utils import (
+    index_address,
+    invalidate_address_caches,
+    invalidate_address_id,
+    invalidate_user_caches,
+    rebuild_address_summary,
+    unindex_address,
+    update_address_summary,
+)
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance: Review, created: bool, **kwargs):
+    """
+    Keep the address summary and caches in step with a created or edited review
+    """
+    invalidate_address_caches(instance.address_id)
+    if created:
+        invalidate_user_caches(instance.user_id)
+        review_delta, rating_delta = 1, instance.rating
+    else:
+        loaded_rating = getattr(instance, '_loaded_rating', None)
+        if loaded_rating is None:
+            rebuild_address_summary(instance.address_id)
+            return
+        review_delta, rating_delta = 0, instance.rating - loaded_rating
+    if not update_address_summary(instance.address_id, review_delta, rating_delta):
+        rebuild_address_summary(instance.address_id)
+    instance._loaded_rating = instance.rating
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance: Review, **kwargs):
+    """
+    Remove a deleted review from its address summary.
+    When the address itself is being deleted the summary goes with it.
+    """
+    invalidate_address_caches(instance.address_id)
+    invalidate_user_caches(instance.user_id)
+    update_address_summary(instance.address_id, -1, -instance.rating)
+
+
+@receiver(post_save, sender=Address)
+def address_saved(sender, instance: Address, created: bool, **kwargs):
+    if created:
+        index_address(instance.full_address)
+        invalidate_address_id(instance.pk)
+
+
+@receiver(post_delete, sender=Address)
+def address_deleted(sender, instance: Address, **kwargs):
+    unindex_address(instance.full_address)
+    invalidate_address_id(instance.pk)
@@ -1,3 +1,1620 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import logging
+import os
+import socketserver
+import tempfile
+import threading
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, transaction
+from django.conf import settings
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.mail import send_mail
+from django.utils import timezone
+from django.urls import reverse
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from main.urls import urlpatterns
+from main.management.commands import collect_geography
+from main.models import Address, AddressSummary, OutboxEmail, Review, State, City, Country
+from main.utils import (
+    address_utils,
+    cache_utils,
+    connection_pool_utils,
+    database_utils,
+    email_utils,
+    log_archive_utils,
+    logging_utils,
+    metrics_utils,
+    pagination_utils,
+    replica_utils,
+)
+from main.utils.pagination_utils import NEXT, encode_cursor
+from main.utils.geography_utils import GeographySnapshot
+from main.utils.suggest_utils import AddressIndex
+from main.views.reviews import view as review_views
 
-# Create your tests here.
+
+def _create_city(name="anderson", state="ca", country="usa") -> City:
+    country_obj = Country.objects.get_or_create(name=country)[0]
+    state_obj = State.objects.get_or_create(country=country_obj, name=state)[0]
+    city = City.objects.get_or_create(state=state_obj, name=name)[0]
+    # Written straight through the ORM, so the geography snapshot has to be told
+    database_utils.geography_store.expire()
+    return city
+
+
+def _create_review(
+    city: City, full_address: str, user: User, rating: int = 3, **fields
+) -> Review:
+    address = Address.objects.get_or_create(full_address=full_address, city=city)[0]
+    return Review.objects.create(
+        address=address, user=user, title="title", comment="comment", rating=rating, **fields
+    )
+
+
+class CityReviewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.user = User.objects.create_user("renter", "renter@example.com", "pw")
+
+    def _add_addresses(self, start, count):
+        for i in range(start, start + count):
+            _create_review(self.city, f"{i} Main Street, Anderson, CA 96007, USA", self.user)
+
+    def test_reviews_grouped_by_address(self):
+        self._add_addresses(0, 3)
+        reviews, _, _ = database_utils.get_city_reviews("anderson", "ca", "usa")
+        self.assertEqual(len(reviews), 3)
+        for full_address, address_reviews in reviews.items():
+            self.assertEqual(address_reviews[0].address.full_address, full_address)
+
+    def test_query_count_is_constant(self):
+        self._add_addresses(0, 2)
+        with self.assertNumQueries(1):
+            reviews, _, _ = database_utils.get_city_reviews("anderson", "ca", "usa")
+            [review.user.username for r in reviews.values() for review in r]
+
+        cache.clear()
+        self._add_addresses(2, 20)
+        with self.assertNumQueries(1):
+            reviews, _, _ = database_utils.get_city_reviews("anderson", "ca", "usa", page_size=30)
+            [review.user.username for r in reviews.values() for review in r]
+        self.assertEqual(len(reviews), 22)
+
+    def test_pages_walk_forwards_and_back(self):
+        self._add_addresses(0, 5)
+        pages = []
+        cursor = None
+        while True:
+            reviews, cursor, previous = database_utils.get_city_reviews(
+                "anderson", "ca", "usa", cursor, page_size=2
+            )
+            pages.append(list(reviews))
+            if not cursor:
+                break
+        # Newest first, every review exactly once
+        self.assertEqual(sum(pages, []), [f"{i} Main Street, Anderson, CA 96007, USA" for i in range(4, -1, -1)])
+
+        reviews, _, previous = database_utils.get_city_reviews("anderson", "ca", "usa", previous, page_size=2)
+        self.assertEqual(list(reviews), pages[-2])
+        reviews, _, previous = database_utils.get_city_reviews("anderson", "ca", "usa", previous, page_size=2)
+        self.assertEqual(list(reviews), pages[0])
+        self.assertIsNone(previous)
+
+    def test_address_spanning_pages_is_grouped_on_each(self):
+        other = User.objects.create_user("renter2", "renter2@example.com", "pw")
+        full_address = "1 Main Street, Anderson, CA 96007, USA"
+        for user in (self.user, other):
+            _create_review(self.city, full_address, user)
+        first, cursor, _ = database_utils.get_city_reviews("anderson", "ca", "usa", page_size=1)
+        second, _, _ = database_utils.get_city_reviews("anderson", "ca", "usa", cursor, page_size=1)
+        self.assertEqual(list(first), [full_address])
+        self.assertEqual(list(second), [full_address])
+        self.assertNotEqual(first[full_address], second[full_address])
+
+    def test_city_page_links_to_older_reviews(self):
+        self._add_addresses(0, 3)
+        response = self.client.get("/review/list/usa/ca/anderson", {"page_size": 2})
+        self.assertContains(response, "Older reviews")
+        self.assertNotContains(response, "0 Main Street")
+        cursor = response.context["next_cursor"]
+        response = self.client.get("/review/list/usa/ca/anderson", {"page_size": 2, "cursor": cursor})
+        self.assertContains(response, "0 Main Street")
+        self.assertContains(response, "Newer reviews")
+
+
+class UserProfileTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        city = _create_city()
+        self.user = User.objects.create_user("renter", "renter@example.com", "pw")
+        for i in range(3):
+            _create_review(city, f"{i} Main Street, Anderson, CA 96007, USA", self.user)
+        self.client.force_login(self.user)
+
+    def test_profile_is_paged(self):
+        response = self.client.get(reverse("user_profile"), {"page_size": 2})
+        self.assertEqual(
+            [review.address.full_address for review in response.context["user_reviews"]],
+            ["2 Main Street, Anderson, CA 96007, USA", "1 Main Street, Anderson, CA 96007, USA"],
+        )
+        response = self.client.get(
+            reverse("user_profile"), {"page_size": 2, "cursor": response.context["next_cursor"]}
+        )
+        self.assertEqual(len(response.context["user_reviews"]), 1)
+        self.assertIsNone(response.context["next_cursor"])
+        self.assertIsNotNone(response.context["previous_cursor"])
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        for cursor in ("not-a-cursor", encode_cursor(NEXT, "yesterday", 1)):
+            response = self.client.get(reverse("user_profile"), {"cursor": cursor})
+            self.assertEqual(len(response.context["user_reviews"]), 3)
+
+
+class AddressSummaryTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.users = [
+            User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw")
+            for i in range(3)
+        ]
+
+    def _summary(self) -> AddressSummary:
+        return AddressSummary.objects.get(address__full_address=self.full_address)
+
+    def test_create_edit_delete(self):
+        _create_review(self.city, self.full_address, self.users[0], 5, starting_rent=1000)
+        _create_review(self.city, self.full_address, self.users[1], 2, starting_rent=1400)
+        summary = self._summary()
+        self.assertEqual((summary.review_count, summary.rating_sum), (2, 7))
+        self.assertEqual(summary.rating_average, 3.5)
+        self.assertEqual(summary.starting_rent_median, 1200.0)
+        self.assertIsNone(summary.ending_rent_median)
+
+        review = Review.objects.get(user=self.users[1])
+        review.rating = 4
+        review.save()
+        self.assertEqual(self._summary().rating_sum, 9)
+
+        database_utils.delete_user_review(Review.objects.get(user=self.users[0]))
+        summary = self._summary()
+        self.assertEqual((summary.review_count, summary.rating_sum), (1, 4))
+        self.assertEqual(summary.starting_rent_max, 1400)
+
+        database_utils.delete_user_review(Review.objects.get(user=self.users[1]))
+        self.assertFalse(AddressSummary.objects.exists())
+
+    def test_command_rebuilds_summaries(self):
+        _create_review(self.city, self.full_address, self.users[0], 5)
+        AddressSummary.objects.update(review_count=10)
+
+        out = StringIO()
+        call_command("address_summaries", "--verify", stdout=out)
+        self.assertIn("Found 1 mismatched", out.getvalue())
+        self.assertEqual(self._summary().review_count, 10)
+
+        call_command("address_summaries", stdout=StringIO())
+        self.assertEqual(self._summary().review_count, 1)
+
+    def test_migration_backfill_matches_the_live_summary(self):
+        _create_review(self.city, self.full_address, self.users[0], 5, starting_rent=1000, ending_rent=1100)
+        _create_review(self.city, self.full_address, self.users[1], 2, starting_rent=1400)
+        _create_review(self.city, "1 Other Street, Anderson, CA 96007, USA", self.users[2], 4)
+        expected = {summary.pk: summary.__dict__ for summary in AddressSummary.objects.all()}
+        AddressSummary.objects.all().delete()
+
+        migration = importlib.import_module("main.migrations.0004_addresssummary")
+        # One summary per batch
+        migration.BATCH_SIZE, batch_size = 1, migration.BATCH_SIZE
+        try:
+            migration.build_summaries(apps, None)
+        finally:
+            migration.BATCH_SIZE = batch_size
+        rebuilt = {summary.pk: summary.__dict__ for summary in AddressSummary.objects.all()}
+        for fields in (*expected.values(), *rebuilt.values()):
+            fields.pop("_state")
+        self.assertEqual(rebuilt, expected)
+
+
+class CacheInvalidationTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.users = [
+            User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw")
+            for i in range(2)
+        ]
+
+    def _address_reviews(self, address) -> list:
+        reviews, _, _ = async_to_sync(database_utils.aget_reviews_page)(address, None, 20)
+        return reviews
+
+    def test_review_writes_invalidate_address_and_city(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[0])
+        address = database_utils.get_address(self.full_address)
+        self.assertEqual(len(self._address_reviews(address)), 1)
+        self.assertEqual(len(database_utils.get_city_reviews("anderson", "ca", "usa")[0]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[1])
+        self.assertEqual(len(self._address_reviews(address)), 2)
+        city_reviews, _, _ = database_utils.get_city_reviews("anderson", "ca", "usa")
+        self.assertEqual(len(city_reviews[self.full_address]), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            database_utils.delete_user_review(Review.objects.get(user=self.users[0]))
+        self.assertEqual(len(self._address_reviews(address)), 1)
+
+    def test_new_geography_invalidates_dropdowns(self):
+        self.assertEqual(list(database_utils.get_states("usa")), ["ca"])
+        with self.captureOnCommitCallbacks(execute=True):
+            database_utils.save_state(Country.objects.get(name="usa"), "or")
+        self.assertEqual(sorted(database_utils.get_states("usa")), ["ca", "or"])
+
+    def test_review_write_retires_cached_city_page(self):
+        url = "/review/list/usa/ca/anderson"
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[0])
+        self.assertNotContains(self.client.get(url), "renter1")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[1])
+        self.assertContains(self.client.get(url), "renter1")
+
+
+class GeographySnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        _create_city("anderson", "ca", "usa")
+        _create_city("redding", "ca", "usa")
+        _create_city("portland", "or", "usa")
+
+    def test_snapshot_lists_children_in_creation_order(self):
+        snapshot = GeographySnapshot.build(
+            [(1, "usa"), (2, "canada")],
+            [(10, 1, "ca"), (11, 2, "bc"), (12, 3, "created after the countries were read")],
+            [(10, "anderson"), (11, "victoria"), (10, "redding"), (13, "orphan")],
+            generation=1,
+        )
+        self.assertEqual(snapshot.countries, ("usa", "canada"))
+        self.assertEqual(snapshot.states("usa"), ("ca",))
+        self.assertEqual(snapshot.cities("ca", "usa"), ("anderson", "redding"))
+        self.assertEqual(snapshot.states("mexico"), ())
+        self.assertEqual(
+            json.loads(gzip.decompress(snapshot.json)),
+            {"usa": {"ca": ["anderson", "redding"]}, "canada": {"bc": ["victoria"]}},
+        )
+
+    def test_dropdowns_are_served_from_memory(self):
+        self.client.get(reverse("get_cities_list"), {"country": "usa", "state": "ca"})
+        cache.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("get_cities_list"), {"country": "usa", "state": "ca"})
+        self.assertEqual(response.json(), ["anderson", "redding"])
+
+    def test_new_city_swaps_in_a_new_snapshot(self):
+        old = database_utils.get_geography()
+        with self.captureOnCommitCallbacks(execute=True):
+            database_utils.save_city(State.objects.get(name="or"), "salem")
+        self.assertEqual(database_utils.get_cities("or", "usa"), ["portland", "salem"])
+        # A reader holding the old snapshot still sees a consistent old version
+        self.assertEqual(old.cities("or", "usa"), ("portland",))
+
+    def test_whole_geography_with_etag(self):
+        response = self.client.get(reverse("geography"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content)),
+            {"usa": {"ca": ["anderson", "redding"], "or": ["portland"]}},
+        )
+        etag = response["ETag"]
+        response = self.client.get(reverse("geography"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            database_utils.save_city(State.objects.get(name="or"), "salem")
+        response = self.client.get(reverse("geography"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.json()["usa"]["or"], ["portland", "salem"])
+
+
+class CollectGeographyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("renter", "renter@example.com", "pw")
+        _create_review(_create_city("anderson", "ca", "usa"), "3616 Stingy Lane, Anderson, CA 96007, USA", user)
+        _create_review(_create_city("seattle", "wa", "usa"), "1 Pike Street, Seattle, WA 98101, USA", user)
+        # Left behind by deleted addresses
+        _create_city("redding", "ca", "usa")
+        _create_city("portland", "or", "usa")
+        _create_city("toronto", "on", "canada")
+
+    def test_dry_run_only_reports(self):
+        out = StringIO()
+        call_command("collect_geography", "--dry-run", stdout=out)
+        self.assertIn("Would delete 3 cities, 2 states, 1 countries.", out.getvalue())
+        self.assertEqual(City.objects.count(), 5)
+
+    def test_orphans_are_deleted_in_batches_and_their_dropdowns_retired(self):
+        scopes = {
+            "ca": cache_utils.state_scope("ca", "usa"),
+            "wa": cache_utils.state_scope("wa", "usa"),
+            "usa": cache_utils.country_scope("usa"),
+            "countries": cache_utils.COUNTRIES_SCOPE,
+        }
+        generations = {name: cache_utils.get_generation(scope) for name, scope in scopes.items()}
+        out = StringIO()
+        call_command("collect_geography", "--batch-size", "1", stdout=out)
+        self.assertIn("Deleted 3 cities, 2 states, 1 countries.", out.getvalue())
+        self.assertEqual(sorted(City.objects.values_list("name", flat=True)), ["anderson", "seattle"])
+        self.assertEqual(sorted(State.objects.values_list("name", flat=True)), ["ca", "wa"])
+        self.assertEqual(list(Country.objects.values_list("name", flat=True)), ["usa"])
+        changed = {
+            name for name, scope in scopes.items() if cache_utils.get_generation(scope) != generations[name]
+        }
+        self.assertEqual(changed, {"ca", "usa", "countries"})
+
+        call_command("collect_geography", stdout=out)
+        self.assertIn("Deleted 0 cities, 0 states, 0 countries.", out.getvalue())
+
+    def test_a_city_used_again_after_selection_is_kept(self):
+        redding = City.objects.get(name="redding")
+        calls = []
+
+        def orphans():
+            # The batch is selected on the first call and deleted on the second
+            if len(calls) == 1:
+                Address.objects.create(
+                    full_address="1 Oak Street, Redding, CA 96001, USA", city=redding, canonical_key="redding"
+                )
+            calls.append(1)
+            return collect_geography.orphaned_cities()
+
+        _, _, names, scope = collect_geography.LEVELS[0]
+        with CaptureQueriesContext(connection) as queries:
+            deleted = collect_geography.Command()._collect(orphans, names, scope, 10)
+        self.assertEqual(deleted, 2)
+        self.assertEqual(sorted(City.objects.values_list("name", flat=True)), ["anderson", "redding", "seattle"])
+        self.assertTrue(Address.objects.filter(city=redding).exists())
+        # One DELETE per batch, nothing collected to cascade to
+        self.assertEqual(sum(query["sql"].startswith("DELETE") for query in queries), 1)
+        self.assertFalse([query for query in queries if query["sql"].startswith('SELECT "main_address"')])
+
+
+class CacheAsideTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_misses_and_empty_results_are_cached(self):
+        _create_city()
+        with self.assertNumQueries(2):
+            self.assertIsNone(database_utils.get_address("1 Nowhere Road, Anderson, CA 96007, USA"))
+            self.assertEqual(database_utils.get_city_reviews("anderson", "ca", "usa")[0], {})
+        with self.assertNumQueries(0):
+            self.assertIsNone(database_utils.get_address("1 Nowhere Road, Anderson, CA 96007, USA"))
+            self.assertEqual(database_utils.get_city_reviews("anderson", "ca", "usa")[0], {})
+
+    def test_loader_runs_once_until_invalidated(self):
+        calls = []
+        loader = lambda: calls.append(1) or len(calls)
+        scope = cache_utils.country_scope("usa")
+        self.assertEqual(cache_utils.cache_aside("test", scope, loader), 1)
+        self.assertEqual(cache_utils.cache_aside("test", scope, loader), 1)
+        cache_utils.bump_generation(scope)
+        self.assertEqual(cache_utils.cache_aside("test", scope, loader), 2)
+
+    def test_stale_value_served_while_another_request_rebuilds(self):
+        scope = cache_utils.country_scope("usa")
+        cache_utils.cache_aside("test", scope, lambda: "stale", timeout=-1)
+        entry_key = cache_utils._entry_key("test", scope)
+        cache.add(f"lock:{entry_key}", 1)
+        self.assertEqual(cache_utils.cache_aside("test", scope, lambda: "fresh"), "stale")
+        cache.delete(f"lock:{entry_key}")
+        self.assertEqual(cache_utils.cache_aside("test", scope, lambda: "fresh"), "fresh")
+
+
+class AsyncReadViewsTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.user = User.objects.create_user("renter", "renter@example.com", "pw")
+        _create_review(self.city, self.full_address, self.user, 4)
+
+    async def test_dropdown_lists(self):
+        response = await self.async_client.get(reverse("get_states_list"), {"country": "usa"})
+        self.assertEqual(response.json(), ["ca"])
+        response = await self.async_client.get(
+            reverse("get_cities_list"), {"country": "usa", "state": "ca"}
+        )
+        self.assertEqual(response.json(), ["anderson"])
+
+    async def test_review_pages(self):
+        response = await self.async_client.get("/review/list/usa/ca/anderson")
+        self.assertContains(response, self.full_address)
+        self.assertContains(response, "User: renter")
+
+    def test_address_lookup_redirects_to_reviews(self):
+        response = self.client.post("/", {"address": self.full_address})
+        self.assertEqual(response.status_code, 302)
+        self.assertContains(self.client.get(response.url), "Average Rating: 4.0")
+
+
+class AddressUrlTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+    url = "/review/list/96007/ca-96007/anderson/3616-stingy-lane"
+
+    def setUp(self):
+        cache.clear()
+        # The geography get_address_dict gives the address, as the review form saves it
+        self.city = _create_city("anderson", "ca-96007", "96007")
+        self.user = User.objects.create_user("renter", "renter@example.com", "pw")
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.user, 4)
+
+    def test_deep_link_without_a_session(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, f"Reviews for {self.full_address}")
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        # Anonymous visitors share one cached copy of the page
+        with self.assertNumQueries(0):
+            self.assertContains(Client().get(self.url), self.full_address)
+
+    def test_unknown_address_is_not_found(self):
+        response = self.client.get("/review/list/96007/ca-96007/anderson/1-nowhere-lane")
+        self.assertEqual(response.status_code, 404)
+
+    def test_create_review_for_a_new_address(self):
+        full_address = "3620 Stingy Lane, Anderson, CA 96007, USA"
+        url = "/review/create/96007/ca-96007/anderson/3620-stingy-lane"
+        self.client.force_login(self.user)
+        response = self.client.get(url, {"address": "1 Other Street, Anderson, CA 96007, USA"})
+        self.assertEqual(response.status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"{url}?address={full_address}", {"title": "title", "comment": "comment", "rating": 5}
+            )
+        self.assertRedirects(response, "/review/list/96007/ca-96007/anderson/3620-stingy-lane")
+        self.assertEqual(
+            Address.objects.get(full_address=full_address).slug,
+            "96007/ca-96007/anderson/3620-stingy-lane",
+        )
+        self.assertContains(self.client.get(response.url), "Average Rating: 5.0")
+
+
+    def test_other_spellings_redirect_to_the_stored_address(self):
+        response = self.client.post("/", {"address": "3616 Stingy Ln, Anderson, CA 96007, USA"})
+        self.assertRedirects(response, self.url)
+        self.assertContains(self.client.get(response.url), f"Reviews for {self.full_address}")
+
+        other = User.objects.create_user("renter2", "renter2@example.com", "pw")
+        self.client.force_login(other)
+        url = "/review/create/96007/ca-96007/anderson/3616-stingy-ln?address=3616 Stingy Ln, Anderson, CA 96007, USA"
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"title": "title", "comment": "comment", "rating": 2})
+        self.assertRedirects(response, self.url)
+        self.assertContains(self.client.get(response.url), "Average Rating: 3.0")
+
+        self.client.force_login(self.user)
+        self.assertRedirects(self.client.get(url), self.url, fetch_redirect_response=False)
+
+class ReviewedAddressesTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+    url = "/review/list/96007/ca-96007/anderson/3616-stingy-lane"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city("anderson", "ca-96007", "96007")
+        self.users = [User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw") for i in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.review = _create_review(self.city, self.full_address, self.users[0])
+
+    def test_set_is_cached_until_a_review_is_created_or_deleted(self):
+        address_id = self.review.address_id
+        self.assertEqual(database_utils.get_reviewed_address_ids(self.users[0].pk), {address_id})
+        database_utils.get_address(self.full_address)
+        with self.assertNumQueries(0):
+            self.assertTrue(database_utils.user_reviewed_address(self.users[0].pk, self.full_address))
+        self.assertFalse(database_utils.user_reviewed_address(self.users[1].pk, self.full_address))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[1])
+        self.assertTrue(database_utils.user_reviewed_address(self.users[1].pk, self.full_address))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.review.delete()
+        self.assertEqual(database_utils.get_reviewed_address_ids(self.users[0].pk), frozenset())
+
+    def test_create_form_redirects_a_user_who_reviewed_the_address(self):
+        self.client.force_login(self.users[0])
+        response = self.client.get("/review/create/96007/ca-96007/anderson/3616-stingy-lane")
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertContains(self.client.get(response.url), "User has already reviewed address")
+
+        self.client.force_login(self.users[1])
+        response = self.client.get("/review/create/96007/ca-96007/anderson/3616-stingy-lane")
+        self.assertEqual(response.status_code, 200)
+
+    def test_refused_reviews(self):
+        url = "/review/create/96007/ca-96007/anderson/3616-stingy-lane"
+        rented = {"starting_rent_month_year": "2023-01-01", "ending_rent_month_year": "2023-12-01"}
+        form = {"title": "title", "comment": "comment", "rating": 4, **rented}
+        self.client.force_login(self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, form)
+
+        # The same rental dates again
+        response = self.client.post(url, form)
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        self.assertContains(self.client.get(response.url), "User has already reviewed address")
+
+        # Any other refusal keeps the form
+        def refuse(review, full_address):
+            raise IntegrityError("refused")
+
+        save_new_review = review_views.save_new_review
+        review_views.save_new_review = refuse
+        try:
+            response = self.client.post(url, {**form, "starting_rent_month_year": "2024-01-01"})
+        finally:
+            review_views.save_new_review = save_new_review
+        self.assertContains(response, "The review could not be saved")
+        self.assertEqual(Review.objects.filter(user=self.users[1]).count(), 1)
+
+    def test_listing_pages_show_reviewed_addresses(self):
+        self.client.force_login(self.users[0])
+        response = self.client.get(self.url)
+        self.assertContains(response, "You have reviewed this address")
+        self.assertNotContains(response, "Add Review")
+        self.assertContains(
+            self.client.get("/review/list/96007/ca-96007/anderson"), "You have reviewed this address"
+        )
+
+        self.client.force_login(self.users[1])
+        response = self.client.get(self.url)
+        self.assertNotContains(response, "You have reviewed this address")
+        self.assertContains(response, "Add Review")
+
+class AddressKeyTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+    other_spelling = "3616 stingy ln., anderson, ca 96007-1234, United States"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.users = [
+            User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw") for i in range(2)
+        ]
+
+    def test_spellings_share_one_key(self):
+        self.assertEqual(
+            address_utils.get_address_key(self.full_address), "3616|stingy ln|anderson|ca|96007|usa"
+        )
+        self.assertEqual(
+            address_utils.get_address_key(self.other_spelling),
+            address_utils.get_address_key(self.full_address),
+        )
+        self.assertNotEqual(
+            address_utils.get_address_key("3618 Stingy Lane, Anderson, CA 96007, USA"),
+            address_utils.get_address_key(self.full_address),
+        )
+        self.assertEqual(
+            address_utils.parse_address("12 N. Queen Street, Toronto, ON M5V 2T6, Canada"),
+            ("12", "n queen st", "toronto", "on", "m5v2t6", "canada"),
+        )
+        self.assertIsNone(address_utils.parse_address("Somewhere"))
+        self.assertEqual(address_utils.get_address_key("Somewhere, "), "somewhere")
+
+    def test_lookups_find_any_spelling(self):
+        review = _create_review(self.city, self.full_address, self.users[0])
+        self.assertEqual(database_utils.get_address(self.other_spelling), review.address)
+        self.assertEqual(database_utils.get_user_review("renter0", self.other_spelling), review)
+
+    def test_new_review_reuses_the_address_of_any_spelling(self):
+        first = database_utils.save_new_review(
+            Review(user=self.users[0], title="title", comment="comment", rating=5), self.full_address
+        )
+        second = database_utils.save_new_review(
+            Review(user=self.users[1], title="title", comment="comment", rating=1), self.other_spelling
+        )
+        self.assertEqual(second.address_id, first.address_id)
+        self.assertEqual(second.city_id, first.address.city_id)
+        self.assertEqual(Address.objects.get().full_address, self.full_address)
+        summary = AddressSummary.objects.get(address_id=first.address_id)
+        self.assertEqual((summary.review_count, summary.rating_sum), (2, 6))
+
+        # The same user and rental dates again
+        rented = {"starting_rent_month_year": "2023-01-01", "ending_rent_month_year": "2023-12-01"}
+        database_utils.save_new_review(
+            Review(user=self.users[0], title="title", comment="comment", rating=2, **rented), self.full_address
+        )
+        with self.assertRaises(IntegrityError):
+            database_utils.save_new_review(
+                Review(user=self.users[0], title="again", comment="comment", rating=2, **rented),
+                self.other_spelling,
+            )
+        self.assertEqual(Review.objects.count(), 3)
+
+
+class SaveReviewRaceTest(TransactionTestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+    other_spelling = "3616 stingy ln., anderson, ca 96007-1234, United States"
+
+    @skipUnless(connection.vendor == "postgresql", "Needs concurrent writers")
+    def test_concurrent_reviews_of_a_new_address_share_it(self):
+        users = [User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw") for i in range(2)]
+        ready = threading.Barrier(2)
+        errors = []
+
+        def review(user, full_address):
+            try:
+                ready.wait()
+                database_utils.save_new_review(
+                    Review(user=user, title="title", comment="comment", rating=3), full_address
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=review, args=(user, full_address))
+            for user, full_address in zip(users, [self.full_address, self.other_spelling])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Address.objects.count(), 1)
+        self.assertEqual((Country.objects.count(), State.objects.count(), City.objects.count()), (1, 1, 1))
+        self.assertEqual(Review.objects.filter(address=Address.objects.get()).count(), 2)
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans are checked against Postgres")
+class QueryPlanTest(TestCase):
+    """
+    Every hot lookup must be able to use an index. Sequential scans are priced
+    out so the planner only picks one when there is no usable index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        countries = Country.objects.bulk_create(Country(name=f"country{i}") for i in range(20))
+        states = State.objects.bulk_create(
+            State(country=country, name=f"state{i}") for country in countries for i in range(10)
+        )
+        cities = City.objects.bulk_create(
+            City(state=state, name=f"city{i}") for state in states for i in range(5)
+        )
+        full_addresses = [
+            (city, f"{i} Main Street, {city.name}, ST 00000, {city.pk}") for city in cities for i in range(5)
+        ]
+        addresses = Address.objects.bulk_create(
+            Address(city=city, full_address=full_address, canonical_key=address_utils.get_address_key(full_address))
+            for city, full_address in full_addresses
+        )
+        users = User.objects.bulk_create(User(username=f"renter{i}") for i in range(50))
+        Review.objects.bulk_create(
+            Review(
+                address=address,
+                city_id=address.city_id,
+                user=users[i % len(users)],
+                comment="comment",
+                rating=3,
+            )
+            for i, address in enumerate(addresses)
+        )
+        cls.address = addresses[-1]
+        cls.city = cities[-1]
+        cls.user = users[-1]
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertIndexed(self, queryset):
+        plan = queryset.explain()
+        self.assertNotIn("Seq Scan", plan, plan)
+
+    def test_address_lookup(self):
+        self.assertIndexed(Address.objects.filter(full_address=self.address.full_address))
+        self.assertIndexed(database_utils._address_query(self.address.full_address))
+        self.assertIndexed(Address.objects.filter(slug=self.address.slug))
+
+    def test_geography_lookups(self):
+        state = self.city.state
+        self.assertIndexed(Country.objects.filter(name=state.country.name))
+        self.assertIndexed(State.objects.filter(country=state.country, name=state.name))
+        self.assertIndexed(City.objects.filter(state=state, name=self.city.name))
+        self.assertIndexed(City.objects.filter(state=state))
+
+    def test_review_lookups(self):
+        self.assertIndexed(Review.objects.filter(user=self.user).order_by("-pub_date"))
+        self.assertIndexed(Review.objects.filter(address=self.address))
+
+    def test_review_pages_read_one_index_range(self):
+        state = self.city.state
+        queries = {
+            "review_city_pub_date_id_idx": database_utils.city_reviews_query(
+                self.city.name, state.name, state.country.name
+            ),
+            "review_address_pub_date_id_idx": Review.objects.filter(address=self.address),
+            "review_user_pub_date_id_idx": Review.objects.filter(user=self.user),
+        }
+        # On tables this small a sort after the scan can be priced cheaper, price it out
+        # like sequential scans so a Sort only shows when the index can't give the order
+        with connection.cursor() as db_cursor:
+            db_cursor.execute("SET LOCAL enable_sort = off")
+        cursor = encode_cursor(NEXT, "2023-01-01T00:00:00+00:00", 10)
+        for index, queryset in queries.items():
+            for page_cursor in (None, cursor):
+                query, _, _ = pagination_utils._page_query(queryset, page_cursor, 20)
+                plan = query.explain()
+                self.assertNotIn("Seq Scan", plan, plan)
+                self.assertNotIn("Sort", plan, plan)
+                self.assertIn(index, plan, plan)
+
+
+class ImportReviewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user("renter", "renter@example.com", "pw")
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def _write(self, name: str, content: str) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def test_import_jsonl(self):
+        rows = [
+            {"full_address": f"{i} Main Street, Anderson, CA 96007, USA", "rating": i % 6,
+             "comment": "ok", "starting_rent": 1000 + i}
+            for i in range(7)
+        ]
+        rows.append({"full_address": "3616 Stingy Lane, Redding, CA 96001, USA",
+                     "rating": 5, "comment": "ok", "username": "renter"})
+        lines = [json.dumps(row) for row in rows] + ["not json", json.dumps({"rating": 1})]
+        path = self._write("reviews.jsonl", "\n".join(lines))
+
+        out = StringIO()
+        call_command("import_reviews", path, "--batch-size", "3", stdout=out)
+        self.assertIn("Imported 8 reviews", out.getvalue())
+        self.assertEqual(Review.objects.count(), 8)
+        self.assertEqual(list(City.objects.order_by("name").values_list("name", flat=True)),
+                         ["anderson", "redding"])
+        self.assertEqual(Review.objects.get(user__username="renter").address.city.name, "redding")
+        self.assertEqual(AddressSummary.objects.count(), 8)
+        self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+    def test_rows_the_database_would_reject_are_skipped(self):
+        ok = {"full_address": "1 Main Street, Anderson, CA 96007, USA", "rating": 3, "comment": "ok"}
+        rented = {
+            "username": "renter", "starting_rent_month_year": "2023-01-01", "ending_rent_month_year": "2023-12-01"
+        }
+        rows = [
+            ok,
+            {**ok, "comment": "x" * 3001},
+            {**ok, "rating": 9},
+            {**ok, "full_address": f"2 Main Street, {'a' * 101}, CA 96007, USA"},
+            {**ok, "comment": ""},
+            {**ok, **rented},
+            # The same user and rental dates again
+            {**ok, **rented, "comment": "again"},
+        ]
+        path = self._write("reviews.jsonl", "\n".join(json.dumps(row) for row in rows))
+        # Known under another spelling
+        Address.objects.create(
+            full_address="1 Main St, Anderson, CA 96007, USA", city=_create_city("anderson", "ca-96007", "96007")
+        )
+
+        out = StringIO()
+        call_command("import_reviews", path, stdout=out)
+        self.assertIn("7 rows read, 2 imported, 5 skipped", out.getvalue())
+        self.assertEqual(Review.objects.count(), 2)
+        self.assertEqual(
+            list(Address.objects.values_list("full_address", flat=True)), ["1 Main St, Anderson, CA 96007, USA"]
+        )
+        self.assertEqual(AddressSummary.objects.get().review_count, 2)
+
+    def test_resume_from_checkpoint(self):
+        lines = ["full_address,rating,comment"] + [
+            f'"{i} Main Street, Anderson, CA 96007, USA",3,ok' for i in range(1, 4)
+        ]
+        path = self._write("reviews.csv", "\n".join(lines))
+        self._write("reviews.csv.checkpoint", "2")
+        call_command("import_reviews", path, "--resume", stdout=StringIO())
+        self.assertEqual(
+            list(Address.objects.values_list("full_address", flat=True)),
+            ["3 Main Street, Anderson, CA 96007, USA"],
+        )
+
+
+# The benchmark drives the ASGI handler, which closes the connection after each
+# request, so it can't run inside a TestCase transaction. One request at a time,
+# the in-memory test database locks tables against concurrent writers
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class BenchmarkTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        call_command(
+            "seed_benchmark", "--countries", "1", "--states", "2", "--cities", "3",
+            "--addresses", "40", "--users", "10", "--reviews", "120", stdout=StringIO(),
+        )
+
+    def test_seeded_data_is_skewed(self):
+        self.assertEqual(City.objects.count(), 6)
+        self.assertEqual(Address.objects.count(), 40)
+        self.assertEqual(Review.objects.count(), 120)
+        busiest = AddressSummary.objects.order_by("-review_count").first()
+        self.assertGreater(busiest.review_count, 120 / 40 * 2)
+
+    def test_every_route_runs(self):
+        out = StringIO()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "benchmark", "--requests", "3", "--warmup", "0", "--concurrency", "1",
+                "--label", "test", "--output", output.name, stdout=out, stderr=out,
+            )
+            report = json.load(output)
+        self.assertNotIn("No benchmark for", out.getvalue())
+        self.assertEqual(
+            {label.split(":")[0] for label in report["routes"]},
+            {pattern.name for pattern in urlpatterns},
+        )
+        self.assertEqual(report["total"]["errors"], 0)
+        self.assertEqual(report["total"]["requests"], 3 * len(report["routes"]))
+        self.assertEqual(report["dataset"]["addresses"], 40)
+        self.assertGreater(report["routes"]["list_reviews"]["queries_per_request"], 0)
+
+
+class SearchReviewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("renter", "renter@example.com", "pw")
+        anderson = _create_city()
+        redding = _create_city("redding")
+        for i in range(5):
+            _create_review(anderson, f"{i} Main Street, Anderson, CA 96007, USA", user)
+        Review.objects.filter(address__full_address__startswith="1 ").update(
+            title="Black mold everywhere", comment="Mold in the bathroom"
+        )
+        Review.objects.filter(address__full_address__startswith="3 ").update(
+            comment="Some mold under the sink"
+        )
+        _create_review(redding, "9 Oak Street, Redding, CA 96001, USA", user)
+        Review.objects.filter(address__city=redding).update(comment="mold")
+
+    async def test_search_ranks_and_scopes(self):
+        reviews, _ = await database_utils.asearch_reviews("mold")
+        self.assertEqual(len(reviews), 3)
+        if connection.vendor == "postgresql":
+            # A title match outranks a comment match
+            self.assertEqual(reviews[0].title, "Black mold everywhere")
+
+        reviews, _ = await database_utils.asearch_reviews("mold", city="redding")
+        self.assertEqual([r.address.full_address for r in reviews], ["9 Oak Street, Redding, CA 96001, USA"])
+
+    async def test_cursor_pages_through_every_result(self):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = await database_utils.asearch_reviews("mold", cursor=cursor, page_size=1)
+            seen.extend(review.pk for review in page)
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(len(set(seen)), 3)
+
+    async def test_only_the_newest_matches_are_ranked(self):
+        newest = await sync_to_async(list)(Review.objects.filter(comment__icontains="mold").order_by("-id")[:2])
+        max_ranked = database_utils.SEARCH_MAX_RANKED
+        database_utils.SEARCH_MAX_RANKED = 2
+        try:
+            reviews, cursor = await database_utils.asearch_reviews("mold")
+        finally:
+            database_utils.SEARCH_MAX_RANKED = max_ranked
+        self.assertEqual({review.pk for review in reviews}, {review.pk for review in newest})
+        self.assertIsNone(cursor)
+
+    def test_search_page(self):
+        response = self.client.get(reverse("search_reviews"), {"q": "mold", "state": "ca"})
+        self.assertContains(response, "9 Oak Street")
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+
+class AddressSuggestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # The index lives for the whole process, start each test from an unbuilt one
+        database_utils.address_index = AddressIndex()
+        self.city = _create_city()
+        for street in ["3616 Stingy Lane", "3620 Stingy Lane", "12 Main Street"]:
+            Address.objects.create(full_address=f"{street}, Anderson, CA 96007, USA", city=self.city)
+
+    def test_prefix_matches_ignore_case_and_punctuation(self):
+        response = self.client.get(reverse("suggest_addresses"), {"q": "36"})
+        self.assertEqual(
+            response.json(),
+            ["3616 Stingy Lane, Anderson, CA 96007, USA", "3620 Stingy Lane, Anderson, CA 96007, USA"],
+        )
+        response = self.client.get(reverse("suggest_addresses"), {"q": "3616 stingy lane anderson"})
+        # The prefix match comes first, near matches top up the rest
+        self.assertEqual(response.json()[0], "3616 Stingy Lane, Anderson, CA 96007, USA")
+        self.assertIn("max-age=60", response["Cache-Control"])
+
+    def test_fuzzy_fallback_catches_typos(self):
+        index = AddressIndex()
+        index.build(enumerate(Address.objects.values_list("full_address", flat=True)), 1)
+        self.assertEqual(index.suggest("main stret", 5), ["12 Main Street, Anderson, CA 96007, USA"])
+        self.assertEqual(AddressIndex(fuzzy=False).suggest("main stret", 5), [])
+
+    def test_index_follows_created_and_deleted_addresses(self):
+        self.assertEqual(len(async_to_sync(database_utils.asuggest_addresses)("36", 10)), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Address.objects.create(full_address="3630 Stingy Lane, Anderson, CA 96007, USA", city=self.city)
+            Address.objects.filter(full_address__startswith="3616").delete()
+        self.assertEqual(
+            async_to_sync(database_utils.asuggest_addresses)("36", 10),
+            [
+                "3620 Stingy Lane, Anderson, CA 96007, USA",
+                "3630 Stingy Lane, Anderson, CA 96007, USA",
+            ],
+        )
+
+    def test_catch_up_reads_addresses_created_elsewhere(self):
+        async_to_sync(database_utils.asuggest_addresses)("36", 10)
+        # Written by another process: no local update, only the generation moves
+        Address.objects.bulk_create(
+            [Address(full_address="3640 Stingy Lane, Anderson, CA 96007, USA", city=self.city)]
+        )
+        cache_utils.bump_generation(cache_utils.ADDRESSES_SCOPE)
+        self.assertIn(
+            "3640 Stingy Lane, Anderson, CA 96007, USA",
+            async_to_sync(database_utils.asuggest_addresses)("3640", 10),
+        )
+
+    def test_catch_up_drops_addresses_deleted_elsewhere(self):
+        suggest = async_to_sync(database_utils.asuggest_addresses)
+        self.assertEqual(len(suggest("36", 10)), 2)
+        index = database_utils.address_index
+        # Deleted by another process, which logs the address and moves the generation
+        Address.objects.filter(full_address__startswith="3616").delete()
+        cache_utils.append_log(database_utils.ADDRESS_REMOVALS_LOG, "3616 Stingy Lane, Anderson, CA 96007, USA")
+        cache_utils.bump_generation(cache_utils.ADDRESSES_SCOPE)
+        self.assertEqual(suggest("36", 10), ["3620 Stingy Lane, Anderson, CA 96007, USA"])
+        self.assertIs(database_utils.address_index, index)
+
+        # A log evicted from the cache can't be caught up on, the index is built again
+        Address.objects.filter(full_address__startswith="3620").delete()
+        cache.delete(cache_utils._log_key(database_utils.ADDRESS_REMOVALS_LOG))
+        cache_utils.bump_generation(cache_utils.ADDRESSES_SCOPE)
+        self.assertEqual(suggest("36", 10), [])
+        self.assertIsNot(database_utils.address_index, index)
+
+    def test_changes_wait_for_a_catch_up_in_progress(self):
+        index = AddressIndex()
+        index.build([], 1)
+        with index.lock:
+            thread = threading.Thread(target=index.add, args=("1 Main Street, Anderson, CA 96007, USA",))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(index.suggest("1 main", 5), ["1 Main Street, Anderson, CA 96007, USA"])
+
+
+class MetricsTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.user = User.objects.create_user("renter", "renter@example.com", "pw")
+        _create_review(self.city, self.full_address, self.user)
+
+    @staticmethod
+    def _count(metric, *label_values):
+        with metric.lock:
+            value = metric.values.get(label_values)
+        if isinstance(metric, metrics_utils.Histogram):
+            return value[2] if value else 0
+        return value or 0
+
+    def test_request_is_recorded_under_its_view(self):
+        requests = self._count(metrics_utils.REQUESTS, "list_reviews", "GET", "200")
+        queries = self._count(metrics_utils.QUERIES, "list_reviews")
+        templates = self._count(metrics_utils.TEMPLATE_SECONDS, "list_reviews")
+        misses = self._count(metrics_utils.CACHE_OPERATIONS, "list_reviews", "miss")
+        self.client.get("/review/list/96007/ca-96007/anderson/3616-stingy-lane")
+
+        self.assertEqual(self._count(metrics_utils.REQUESTS, "list_reviews", "GET", "200"), requests + 1)
+        self.assertEqual(self._count(metrics_utils.QUERIES, "list_reviews"), queries + 1)
+        with metrics_utils.QUERIES.lock:
+            self.assertGreater(metrics_utils.QUERIES.values[("list_reviews",)][1], 0)
+        self.assertEqual(self._count(metrics_utils.TEMPLATE_SECONDS, "list_reviews"), templates + 1)
+        self.assertGreater(self._count(metrics_utils.CACHE_OPERATIONS, "list_reviews", "miss"), misses)
+
+        # Served from the page cache, before URL resolution
+        self.client.get("/review/list/96007/ca-96007/anderson/3616-stingy-lane")
+        self.assertEqual(self._count(metrics_utils.REQUESTS, "list_reviews", "GET", "200"), requests + 2)
+
+    def test_prometheus_text_format(self):
+        histogram = metrics_utils.Histogram("test_seconds", "Test.", ("view",), (0.1, 1.0))
+        histogram.observe(0.05, 'say "hi"')
+        histogram.observe(0.5, 'say "hi"')
+        histogram.observe(5, 'say "hi"')
+        self.assertEqual(
+            histogram.render(),
+            [
+                "# HELP test_seconds Test.",
+                "# TYPE test_seconds histogram",
+                'test_seconds_bucket{view="say \\"hi\\"",le="0.1"} 1',
+                'test_seconds_bucket{view="say \\"hi\\"",le="1.0"} 2',
+                'test_seconds_bucket{view="say \\"hi\\"",le="+Inf"} 3',
+                'test_seconds_sum{view="say \\"hi\\""} 5.55',
+                'test_seconds_count{view="say \\"hi\\""} 3',
+            ],
+        )
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=True)
+    def test_metrics_endpoint(self):
+        self.client.get("/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('http_requests_total{view="index",method="GET",status="200"}', response.content.decode())
+        with self.settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=False)
+    def test_metrics_are_hidden_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+
+class LoggingTest(TestCase):
+    def _handler(self, **kwargs) -> logging_utils.QueueingHandler:
+        handler = logging_utils.QueueingHandler(
+            "logging.handlers.BufferingHandler", capacity=100, **kwargs
+        )
+        handler.addFilter(logging_utils.RequestIdFilter())
+        handler.setFormatter(logging_utils.JsonFormatter())
+        self.addCleanup(handler.close)
+        return handler
+
+    def _record(self, message: str, *args) -> logging.LogRecord:
+        return logging.LogRecord("test", logging.INFO, __file__, 1, message, args, None)
+
+    def test_records_are_written_as_json_by_the_listener(self):
+        handler = self._handler()
+        token = logging_utils.request_id.set("abc123")
+        try:
+            handler.handle(self._record("review %s saved", 7))
+        finally:
+            logging_utils.request_id.reset(token)
+        handler.queue.join()
+        [record] = handler.target.buffer
+        entry = json.loads(handler.target.format(record))
+        self.assertEqual(entry["message"], "review 7 saved")
+        self.assertEqual(entry["request_id"], "abc123")
+        self.assertEqual(entry["level"], "INFO")
+
+    def test_full_queue_drops_records(self):
+        handler = self._handler(queue_size=2)
+        # Nothing drains the queue once the listener has stopped
+        handler.stop()
+        for i in range(5):
+            handler.handle(self._record("message %s", i))
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(handler.queue.qsize(), 2)
+
+    def test_unknown_full_policy(self):
+        with self.assertRaises(ValueError):
+            logging_utils.QueueingHandler("logging.NullHandler", full_policy="wait")
+
+    def test_request_id_header(self):
+        response = self.client.get("/metrics", HTTP_X_REQUEST_ID="proxy-id.1")
+        self.assertEqual(response["X-Request-ID"], "proxy-id.1")
+        response = self.client.get("/metrics", HTTP_X_REQUEST_ID="bad id; drop table")
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+
+
+class LogArchiveTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.archive_dir = os.path.join(self.dir.name, "archive")
+        self.files = {
+            "application.log.2023-04-01_13": (
+                "2023-04-01 13:05:00,123 [INFO][pid:1][request:aaa][view:10] listed reviews\n"
+                "2023-04-01 13:06:00,123 [ERROR][pid:1][request:bbb][view:20] failed\n"
+                "Traceback (most recent call last):\n"
+                "ValueError: boom\n"
+            ),
+            "application.log.2023-04-01_14": json.dumps(
+                {"time": "2023-04-01T14:10:00.000+00:00", "level": "WARNING", "request_id": "ccc",
+                 "message": "slow"}
+            ) + "\n",
+            "application.log.2023-04-02_00": (
+                "2023-04-02 00:01:00,000 [INFO][pid:1][thread:2][view.py:3] old format\n"
+            ),
+            "other.log.2023-04-01_13": "not ours\n",
+        }
+        for name, content in self.files.items():
+            with open(os.path.join(self.dir.name, name), "w") as file:
+                file.write(content)
+
+    def _archive(self):
+        call_command(
+            "archive_logs", "--log-dir", self.dir.name, "--archive-dir", self.archive_dir,
+            "--workers", "2", "--retention-days", "100000", stdout=StringIO(),
+        )
+
+    def _query(self, *args) -> list[str]:
+        out = StringIO()
+        call_command("query_logs", "--archive-dir", self.archive_dir, "--days", "100000", *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_catches_up_on_every_day(self):
+        self._archive()
+        self.assertEqual(
+            sorted(os.listdir(self.dir.name)), ["archive", "other.log.2023-04-01_13"]
+        )
+        with gzip.open(os.path.join(self.archive_dir, "application.log.2023-04-01.gz"), "rt") as archive:
+            self.assertEqual(
+                archive.read(),
+                self.files["application.log.2023-04-01_13"] + self.files["application.log.2023-04-01_14"],
+            )
+        with open(os.path.join(self.archive_dir, "application.log.2023-04-01.index.json")) as file:
+            index = json.load(file)
+        self.assertEqual([hour["hour"] for hour in index["hours"]], ["13", "14"])
+        self.assertEqual(index["hours"][0]["levels"], {"INFO": 1, "ERROR": 1})
+
+        # A late file for an archived day is appended
+        with open(os.path.join(self.dir.name, "application.log.2023-04-01_15"), "w") as file:
+            file.write("2023-04-01 15:00:00,000 [INFO][pid:1][request:ddd][view:1] late\n")
+        self._archive()
+        self.assertEqual(
+            self._query("--request-id", "ddd"),
+            ["2023-04-01 15:00:00,000 [INFO][pid:1][request:ddd][view:1] late"],
+        )
+        self.assertEqual(len(self._query("--request-id", "aaa")), 1)
+
+    def test_query(self):
+        self._archive()
+        self.assertEqual(
+            self._query("--level", "ERROR"),
+            [
+                "2023-04-01 13:06:00,123 [ERROR][pid:1][request:bbb][view:20] failed",
+                "Traceback (most recent call last):",
+                "ValueError: boom",
+            ],
+        )
+        self.assertEqual(
+            self._query("--request-id", "ccc"), [self.files["application.log.2023-04-01_14"].strip()]
+        )
+        self.assertEqual(self._query("--request-id", "zzz"), [])
+        self.assertEqual(
+            self._query("--since", "2023-04-01T13:05:30", "--until", "2023-04-01T13:59:59")[0],
+            "2023-04-01 13:06:00,123 [ERROR][pid:1][request:bbb][view:20] failed",
+        )
+        self.assertEqual(self._query("--since", "2023-04-02T00:00:00", "--level", "INFO"),
+                         ["2023-04-02 00:01:00,000 [INFO][pid:1][thread:2][view.py:3] old format"])
+
+    def test_expired_days_are_removed_with_their_legacy_archives(self):
+        self._archive()
+        # Left by bin/log_handling.py
+        for day in ("2023-03-31", "2023-04-01"):
+            with open(os.path.join(self.archive_dir, f"application.log.{day}.tar.gz"), "wb") as file:
+                file.write(b"legacy")
+        removed = log_archive_utils.remove_expired(self.archive_dir, "application.log", date(2023, 4, 2))
+        self.assertEqual(removed, ["2023-03-31", "2023-04-01"])
+        self.assertEqual(
+            sorted(os.listdir(self.archive_dir)),
+            ["application.log.2023-04-02.gz", "application.log.2023-04-02.index.json"],
+        )
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = log_archive_utils.BloomFilter.for_capacity(1000)
+        ids = [f"request-{i}" for i in range(1000)]
+        for request_id in ids:
+            bloom.add(request_id)
+        restored = log_archive_utils.BloomFilter.from_dict(bloom.to_dict())
+        self.assertTrue(all(request_id in restored for request_id in ids))
+        false_positives = sum(f"other-{i}" in restored for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self._reply("220 localhost")
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == "RCPT":
+                address = command.split(":", 1)[1].strip("<> ")
+                self._reply("550 No such user" if address in self.server.reject else "250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (data_line := self.rfile.readline()) not in (b".\r\n", b""):
+                    data.append(data_line)
+                self.server.messages.append(b"".join(data).decode())
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("250 localhost")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    Just enough of an SMTP server on localhost to accept, or refuse, mail
+    """
+    daemon_threads = True
+
+    def __init__(self, reject=()):
+        super().__init__(("127.0.0.1", 0), _SmtpHandler)
+        self.reject = set(reject)
+        self.messages = []
+        self.connections = 0
+
+
+@override_settings(
+    EMAIL_BACKEND="main.utils.email_utils.OutboxEmailBackend",
+    EMAIL_OUTBOX_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+    EMAIL_HOST="127.0.0.1",
+    EMAIL_HOST_USER="",
+    EMAIL_HOST_PASSWORD="",
+    EMAIL_USE_TLS=False,
+)
+class EmailOutboxTest(TestCase):
+    def setUp(self):
+        self.smtp = SmtpStandIn(reject={"nobody@example.com"})
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.addCleanup(self.smtp.server_close)
+        self.addCleanup(self.smtp.shutdown)
+        override = self.settings(EMAIL_PORT=self.smtp.server_address[1])
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user("renter", "renter@example.com", "pw")
+
+    def test_request_only_queues_the_email(self):
+        response = self.client.post(reverse("forgot_username"), {"email": "renter@example.com"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        self.assertEqual(self.smtp.messages, [])
+
+        self.assertEqual(email_utils.deliver_batch(), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 0)
+        [message] = self.smtp.messages
+        self.assertIn("Rentalranter Username", message)
+        self.assertIn("text/html", message)
+
+    def test_batch_shares_one_connection(self):
+        for i in range(3):
+            send_mail(f"subject {i}", "body", "from@example.com", ["renter@example.com"])
+        send_mail("refused", "body", "from@example.com", ["nobody@example.com"])
+        self.assertEqual(email_utils.deliver_batch(), 4)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(self.smtp.connections, 1)
+        # A refused recipient won't be accepted on a retry either
+        refused = OutboxEmail.objects.get()
+        self.assertEqual(refused.status, OutboxEmail.FAILED)
+        self.assertIn("SMTPRecipientsRefused", refused.last_error)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        send_mail("subject", "body", "from@example.com", ["renter@example.com"])
+        self.smtp.shutdown()
+        self.smtp.server_close()
+        email_utils.deliver_batch()
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=20))
+        # Not due yet
+        self.assertEqual(email_utils.deliver_batch(), 0)
+
+        OutboxEmail.objects.update(
+            attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS - 1, next_attempt_at=timezone.now()
+        )
+        email_utils.deliver_batch()
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.FAILED)
+
+    def test_retry_delay_doubles(self):
+        self.assertLess(email_utils.retry_delay(1), email_utils.retry_delay(3))
+        self.assertLessEqual(email_utils.retry_delay(50), email_utils.RETRY_MAX_SECONDS * 1.25)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(TestCase):
+    def _pool(self, **kwargs) -> connection_pool_utils.ConnectionPool:
+        options = {"check": lambda connection: True, "reset": lambda connection: not connection.closed, **kwargs}
+        return connection_pool_utils.ConnectionPool("test", **options)
+
+    @staticmethod
+    def _gauge(state):
+        with metrics_utils.DB_POOL_CONNECTIONS.lock:
+            return metrics_utils.DB_POOL_CONNECTIONS.values[("test", state)]
+
+    def test_returned_connection_is_reused(self):
+        pool = self._pool()
+        first = pool.acquire(FakeConnection)
+        self.assertEqual((self._gauge("in_use"), self._gauge("idle")), (1, 0))
+        pool.release(first)
+        self.assertEqual((self._gauge("in_use"), self._gauge("idle")), (0, 1))
+        self.assertIs(pool.acquire(FakeConnection), first)
+
+        # One it can't clean up is closed instead
+        pool.release(first)
+        broken = pool.acquire(FakeConnection)
+        broken.closed = True
+        pool.release(broken)
+        self.assertEqual(self._gauge("idle"), 0)
+
+    def test_full_pool_waits_then_times_out(self):
+        pool = self._pool(max_size=1, timeout=5)
+        first = pool.acquire(FakeConnection)
+        timer = threading.Timer(0.05, pool.release, [first])
+        timer.start()
+        self.assertIs(pool.acquire(FakeConnection), first)
+        timer.join()
+
+        timeouts = metrics_utils.DB_POOL_TIMEOUTS.values.get(("test",), 0)
+        pool.timeout = 0.01
+        with self.assertRaises(connection_pool_utils.PoolTimeout):
+            pool.acquire(FakeConnection)
+        self.assertEqual(metrics_utils.DB_POOL_TIMEOUTS.values[("test",)], timeouts + 1)
+        self.assertEqual(self._gauge("in_use"), 1)
+
+    def test_stale_connections_are_replaced(self):
+        pool = self._pool(check=lambda connection: False, check_after=0)
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+        second = pool.acquire(FakeConnection)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+        pool.max_idle = 0
+        pool.release(second)
+        self.assertIsNot(pool.acquire(FakeConnection), second)
+        self.assertTrue(second.closed)
+
+    @skipUnless(connection.vendor == "postgresql", "Needs Postgres")
+    def test_pooled_backend_reuses_closed_connections(self):
+        from main.backends.postgresql_pool.base import DatabaseWrapper
+
+        self.addCleanup(connection_pool_utils.close_pools)
+        settings_dict = {**connection.settings_dict, "POOL": {"MAX_SIZE": 2}}
+        opened = []
+        for _ in range(2):
+            wrapper = DatabaseWrapper(settings_dict, alias=connection.alias)
+            wrapper.ensure_connection()
+            opened.append(wrapper.connection)
+            # Left in a transaction, rolled back on the way into the pool
+            wrapper.connection.autocommit = False
+            with wrapper.connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            wrapper.close()
+        self.assertIs(opened[0], opened[1])
+        self.assertFalse(opened[0].closed)
+        self.assertEqual(opened[0].get_transaction_status(), 0)
+
+
+class ReplicaRoutingTest(TransactionTestCase):
+    """
+    A second test database stands in for a replica that replication never reaches.
+    It is set up after the test case so queries to it are allowed, nothing writes to it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        primary = connections.settings[DEFAULT_DB_ALIAS]
+        test_name = None if connection.vendor == "sqlite" else f"{primary['NAME']}_replica"
+        connections.settings["replica"] = {**primary, "TEST": {**primary["TEST"], "NAME": test_name, "MIRROR": None}}
+        connections["replica"].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        cls.replicas = override_settings(DATABASE_REPLICAS=["replica"])
+        cls.replicas.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.replicas.disable()
+        connections["replica"].creation.destroy_test_db(connections["replica"].settings_dict["NAME"], verbosity=0)
+        del connections["replica"]
+        del connections.settings["replica"]
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        user = User.objects.create_user("renter", "renter@example.com", "pw")
+        _create_review(_create_city(), "3616 Stingy Lane, Anderson, CA 96007, USA", user)
+        self.assertEqual(Review.objects.using("default").count(), 1)
+        self.assertEqual(Review.objects.count(), 0)
+        with transaction.atomic():
+            self.assertEqual(Review.objects.count(), 1)
+        with replica_utils.reading_primary():
+            self.assertEqual(Review.objects.count(), 1)
+
+    def test_writing_browser_reads_from_the_primary(self):
+        response = self.client.post(
+            reverse("register"),
+            {
+                "username": "renter",
+                "email": "renter@example.com",
+                "password1": "a-long-passphrase",
+                "password2": "a-long-passphrase",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(replica_utils.PIN_COOKIE, response.cookies)
+        self.assertFalse(User.objects.using("replica").exists())
+        # The session and the user are only on the primary
+        self.assertEqual(self.client.get(reverse("user_profile")).status_code, 200)
+
+        self.client.cookies[replica_utils.PIN_COOKIE] = "0"
+        self.assertEqual(self.client.get(reverse("user_profile")).status_code, 302)
+
+    def test_recently_written_scope_is_cached_from_the_primary(self):
+        scope = cache_utils.city_scope("anderson", "ca", "usa")
+        _create_city()
+        self.assertEqual(cache_utils.cache_aside("cities", scope, City.objects.count), 0)
+
+        cache_utils.bump_generation(scope)
+        self.assertEqual(cache_utils.cache_aside("cities", scope, City.objects.count), 1)
+
+
+class ApiTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.users = [
+            User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw") for i in range(4)
+        ]
+        for i, user in enumerate(self.users[:3]):
+            _create_review(self.city, self.full_address, user, rating=i + 2, starting_rent=1000)
+        self.address = Address.objects.get(full_address=self.full_address)
+
+    def test_geography(self):
+        self.assertEqual(self.client.get("/api/v1/countries").json(), ["usa"])
+        self.assertEqual(self.client.get("/api/v1/countries/usa/states").json(), ["ca"])
+        self.assertEqual(self.client.get("/api/v1/countries/usa/states/ca/cities").json(), ["anderson"])
+        self.assertEqual(self.client.get("/api/v2/countries").status_code, 404)
+
+    def test_address_summary(self):
+        response = self.client.get(f"/api/v1/addresses/{self.address.pk}")
+        self.assertEqual(
+            response.json(),
+            {
+                "id": self.address.pk,
+                "full_address": self.full_address,
+                "review_count": 3,
+                "rating_average": 3.0,
+                "starting_rent_min": 1000,
+                "starting_rent_max": 1000,
+                "starting_rent_median": 1000.0,
+            },
+        )
+        self.assertEqual(self.client.get("/api/v1/addresses/0").status_code, 404)
+
+    def test_deleted_address_is_not_found(self):
+        self.assertEqual(self.client.get(f"/api/v1/addresses/{self.address.pk}").status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            for review in Review.objects.filter(address=self.address):
+                database_utils.delete_user_review(review)
+        self.assertFalse(Address.objects.exists())
+        self.assertEqual(self.client.get(f"/api/v1/addresses/{self.address.pk}").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/v1/addresses/{self.address.pk}/reviews").status_code, 404)
+
+    def test_review_pages_are_projected_and_cached(self):
+        url = f"/api/v1/addresses/{self.address.pk}/reviews"
+        # One query for the address, one for the page with its users joined in
+        with self.assertNumQueries(2):
+            page = self.client.get(url, {"page_size": 2}).json()
+        self.assertEqual([review["user"] for review in page["results"]], ["renter2", "renter1"])
+        self.assertNotIn("ending_rent", page["results"][0])
+        self.assertIsNone(page.get("previous"))
+        with self.assertNumQueries(0):
+            self.client.get(url, {"page_size": 2})
+
+        page = self.client.get(page["next"]).json()
+        self.assertEqual([review["user"] for review in page["results"]], ["renter0"])
+        self.assertIn("cursor=", page["previous"])
+
+    def test_review_write_retires_cached_pages(self):
+        city_url = "/api/v1/countries/usa/states/ca/cities/anderson/reviews"
+        self.assertEqual(len(self.client.get(city_url).json()["results"]), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[3])
+        results = self.client.get(city_url).json()["results"]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]["address"], self.full_address)
+        self.assertEqual(
+            self.client.get(f"/api/v1/addresses/{self.address.pk}").json()["review_count"], 4
+        )
+
+
+class ConditionalGetTest(TestCase):
+    full_address = "3616 Stingy Lane, Anderson, CA 96007, USA"
+
+    def setUp(self):
+        cache.clear()
+        self.city = _create_city()
+        self.users = [
+            User.objects.create_user(f"renter{i}", f"renter{i}@example.com", "pw") for i in range(2)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[0])
+
+    def test_repeat_request_gets_304_without_queries(self):
+        url = "/review/list/usa/ca/anderson"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _create_review(self.city, self.full_address, self.users[1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_modified_since_for_visitors_without_a_session(self):
+        url = reverse("get_states_list")
+        response = self.client.get(url, {"country": "usa"})
+        last_modified = response["Last-Modified"]
+        response = self.client.get(url, {"country": "usa"}, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(self.users[0])
+        response = self.client.get(url, {"country": "usa"})
+        self.assertNotIn("Last-Modified", response)
+
+    def test_etag_changes_with_the_logged_in_user(self):
+        url = "/review/list/usa/ca/anderson"
+        etag = self.client.get(url)["ETag"]
+        self.client.force_login(self.users[0])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "renter0")
@@ -2,6 +2,8 @@ from django.urls import path
 from main.views.home_page import view as home_page
 from main.views.profile import view as profile
 from main.views.reviews import view as reviews
+from main.views.api import view as api
+from main.views.metrics import view as metrics
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
@@ -27,6 +29,24 @@ urlpatterns = [
     path("review/delete", reviews.delete_review, name="delete_review"),
     path("review/list/<country>/<state>/<city>/<street>", reviews.list_reviews, name="list_reviews"),
     path("review/list/<country>/<state>/<city>", reviews.list_reviews_by_city, name="list_reviews_by_city"),
+    path("review/search", reviews.search_reviews, name="search_reviews"),
+    path("geography", home_page.geography, name="geography"),
+    path("address/suggest", home_page.suggest_addresses, name="suggest_addresses"),
+    path("api/<version>/countries", api.countries, name="api_countries"),
+    path("api/<version>/countries/<country>/states", api.states, name="api_states"),
+    path("api/<version>/countries/<country>/states/<state>/cities", api.cities, name="api_cities"),
+    path(
+        "api/<version>/countries/<country>/states/<state>/cities/<city>/reviews",
+        api.city_reviews,
+        name="api_city_reviews",
+    ),
+    path("api/<version>/addresses/<int:address_id>", api.address_summary, name="api_address"),
+    path(
+        "api/<version>/addresses/<int:address_id>/reviews",
+        api.address_reviews,
+        name="api_address_reviews",
+    ),
+    path("metrics", metrics.metrics, name="metrics"),
     path("/get_states_list", home_page.get_states_list, name="get_states_list"),
     path("/get_cities_list", home_page.get_cities_list, name="get_cities_list")
 ]
\ No newline at end of file
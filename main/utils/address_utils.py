@@ -1,6 +1,63 @@
-from typing import Tuple, List
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Tuple
 from django.core.validators import RegexValidator
 
+# Street suffixes and directions, abbreviated the way the USPS does
+STREET_ABBREVIATIONS = {
+    "avenue": "ave",
+    "av": "ave",
+    "boulevard": "blvd",
+    "circle": "cir",
+    "court": "ct",
+    "drive": "dr",
+    "expressway": "expy",
+    "freeway": "fwy",
+    "highway": "hwy",
+    "lane": "ln",
+    "parkway": "pkwy",
+    "place": "pl",
+    "road": "rd",
+    "square": "sq",
+    "street": "st",
+    "terrace": "ter",
+    "trail": "trl",
+    "north": "n",
+    "south": "s",
+    "east": "e",
+    "west": "w",
+    "northeast": "ne",
+    "northwest": "nw",
+    "southeast": "se",
+    "southwest": "sw",
+}
+COUNTRY_ALIASES = {
+    "us": "usa",
+    "united states": "usa",
+    "united states of america": "usa",
+}
+# Parsed addresses kept per process, the same few addresses are looked up over and over
+PARSE_CACHE_SIZE = 65536
+
+# "<street>, <city>, <state and postal code>[, <country>]"
+_ADDRESS = re.compile(r"^\s*([^,]+?)\s*,\s*([^,]+?)\s*,\s*([^,]+?)\s*(?:,\s*([^,]+?)\s*)?,?\s*$")
+# "123 Main St", "12-14 Main St", "12b Main St"
+_STREET = re.compile(r"^(\d[\w-]*)\s+(.+)$")
+# The state is everything before the first word with a digit in it, "CA 96007", "ON M5V 2T6"
+_REGION = re.compile(r"^(\D*?)\s*(\w*\d[\w -]*)?$")
+_ZIP_PLUS_FOUR = re.compile(r"^(\d{5})-\d{4}$")
+_DROPPED = re.compile(r"[.'’]")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+class ParsedAddress(NamedTuple):
+    street_number: str
+    street_name: str
+    city: str
+    state: str
+    postal_code: str
+    country: str
+
 
 def get_address_regex_validator() -> RegexValidator:
     """
@@ -36,16 +93,104 @@ def get_address_dict(address: str) -> dict[str, str]:
     """
     Split address into a map of address fields
     """
+    return dict(_address_dict_items(address))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _address_dict_items(address: str) -> tuple:
     address_fields = address.split(", ")
     address_fields = [f.replace(" ", "-").lower() for f in address_fields]
     street_number, street_name = split_street(address_fields[0])
     # ['3616-stingy-lane', 'anderson', 'ca', '96007', 'usa']
     address_fields = address_fields[:-1] + address_fields[2].split('-')
-    return {
-        "street": address_fields[0],
-        "city": address_fields[1],
-        "state": address_fields[2],
-        "country": address_fields[4],
-        "street_number": street_number,
-        "street_name": street_name,
-    }
+    return (
+        ("street", address_fields[0]),
+        ("city", address_fields[1]),
+        ("state", address_fields[2]),
+        ("country", address_fields[4]),
+        ("street_number", street_number),
+        ("street_name", street_name),
+    )
+
+
+def get_url_slug(street: str, city: str, state: str, country: str) -> str:
+    """
+    Join the parts of a review URL into the canonical slug of the address it names
+    """
+    return "/".join(part.lower() for part in (country, state, city, street))
+
+
+def get_slug_parts(slug: str) -> dict[str, str]:
+    """
+    Split a slug back into the country, state, city and street parts of its review URL
+    """
+    country, state, city, street = slug.split("/")
+    return {"country": country, "state": state, "city": city, "street": street}
+
+
+def get_address_slug(address: str) -> str:
+    """
+    The canonical slug of a full address, the same one its review URL resolves to.
+    Empty for an address that doesn't split into address fields.
+    """
+    try:
+        address_dict = get_address_dict(address)
+    except IndexError:
+        return ""
+    return get_url_slug(
+        address_dict["street"], address_dict["city"], address_dict["state"], address_dict["country"]
+    )
+
+
+def _normalize_words(text: str, aliases: dict | None = None) -> str:
+    words = _SEPARATORS.sub(" ", _DROPPED.sub("", text.casefold())).split()
+    if aliases:
+        words = [aliases.get(word, word) for word in words]
+    return " ".join(words)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_address(address: str) -> ParsedAddress | None:
+    """
+    Parse a "<number> <street>, <city>, <state> <postal code>, <country>" address
+    into normalized fields, or None when it doesn't have that shape. The postal
+    code and country may be missing.
+    """
+    match = _ADDRESS.match(address)
+    if match is None:
+        return None
+    street, city, region, country = match.groups()
+    street_match = _STREET.match(street)
+    if street_match is None:
+        return None
+    state, postal_code = _REGION.match(region).groups()
+    postal_code = postal_code or ""
+    # A ZIP+4 code names the same address as its five digit ZIP code
+    zip_match = _ZIP_PLUS_FOUR.match(postal_code)
+    if zip_match:
+        postal_code = zip_match.group(1)
+    return ParsedAddress(
+        street_number=street_match.group(1).casefold(),
+        street_name=_normalize_words(street_match.group(2), STREET_ABBREVIATIONS),
+        city=_normalize_words(city),
+        state=_normalize_words(state),
+        postal_code=_SEPARATORS.sub("", postal_code).casefold(),
+        country=_normalize_country(country or ""),
+    )
+
+
+def _normalize_country(country: str) -> str:
+    country = _normalize_words(country)
+    return COUNTRY_ALIASES.get(country, country)
+
+
+def get_address_key(address: str) -> str:
+    """
+    The canonical key of an address. Spellings of the same address, "123 Main St."
+    and "123 main street", share one key. An address that doesn't parse is keyed
+    on its normalized words.
+    """
+    parsed = parse_address(address)
+    if parsed is None:
+        return _normalize_words(address)
+    return "|".join(parsed)
@@ -0,0 +1,85 @@
+"""
+Helpers for the read-only JSON API
+"""
+from django.utils.cache import patch_cache_control
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from common import MAX_REVIEWS_PAGE_SIZE, REVIEWS_PAGE_SIZE
+from main.utils.cache_utils import cache_aside, page_name
+from main.utils.pagination_utils import get_page_size, keyset_page
+
+
+class CompactJSONRenderer(JSONRenderer):
+    """
+    JSON without the keys whose value is null. Most reviews leave the rent
+    fields empty, which otherwise make up a good part of every page.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(_drop_nulls(data), accepted_media_type, renderer_context)
+
+
+def _drop_nulls(data):
+    if isinstance(data, dict):
+        return {key: _drop_nulls(value) for key, value in data.items() if value is not None}
+    if isinstance(data, list):
+        return [_drop_nulls(value) for value in data]
+    return data
+
+
+def api_response(data, status: int = 200) -> Response:
+    """
+    The page cache can't tell which address an API URL belongs to, so API
+    responses are kept out of it and cached as data under the right scope instead
+    """
+    response = Response(data, status=status)
+    patch_cache_control(response, max_age=0)
+    return response
+
+
+def not_found() -> Response:
+    return api_response({"detail": "Not found."}, status=404)
+
+
+def cached_response(name: str, scope: tuple, loader) -> Response:
+    """
+    Respond with the serialized data `loader` builds, cached under `scope` so the
+    writes that retire the HTML pages retire the API responses too
+    """
+    data = cache_aside(name, scope, loader)
+    if data is None:
+        return not_found()
+    return api_response(data)
+
+
+def cached_review_page(request, name: str, scope: tuple, queryset, serializer_class) -> Response:
+    """
+    Respond with one newest first page of reviews, cached per cursor and page size.
+    The next and previous links carry the same cursors the HTML pages use.
+    """
+    cursor = request.query_params.get("cursor")
+    page_size = get_page_size(request, REVIEWS_PAGE_SIZE, MAX_REVIEWS_PAGE_SIZE)
+
+    def load_page() -> dict:
+        reviews, next_cursor, previous_cursor = keyset_page(queryset, cursor, page_size)
+        return {
+            "results": [dict(row) for row in serializer_class(reviews, many=True).data],
+            "next": next_cursor,
+            "previous": previous_cursor,
+        }
+
+    page = cache_aside(page_name(name, cursor, page_size), scope, load_page)
+    return api_response(
+        {
+            "next": _page_url(request, page["next"]),
+            "previous": _page_url(request, page["previous"]),
+            "results": page["results"],
+        }
+    )
+
+
+def _page_url(request, cursor: str | None) -> str | None:
+    if cursor is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), "cursor", cursor)
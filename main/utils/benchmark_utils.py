@@ -0,0 +1,183 @@
+"""
+Pieces of the load benchmark: an in-process ASGI driver, per-request query and
+cache counters, and latency summaries.
+
+Counters are attributed through a context variable, which sync_to_async
+copies into the thread a view's database and cache calls run on, so
+concurrent requests each count only their own work.
+"""
+import asyncio
+import statistics
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from urllib.parse import unquote
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_current_request: ContextVar['RequestStats | None'] = ContextVar('benchmark_request', default=None)
+_MISSING = object()
+
+
+@dataclass
+class RequestStats:
+    status: int = 0
+    duration_ms: float = 0.0
+    queries: int = 0
+    cache_gets: int = 0
+    cache_hits: int = 0
+
+
+@dataclass
+class Response:
+    status: int
+    headers: list = field(default_factory=list)
+    body: bytes = b''
+
+    def header(self, name: str) -> str | None:
+        name = name.lower().encode()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value.decode()
+        return None
+
+
+class AsgiDriver:
+    """
+    Send HTTP requests straight to an ASGI application, with no server or socket in between.
+    Paths are given as they appear in a URL, percent-encoded.
+    """
+
+    def __init__(self, application, host: str = 'localhost'):
+        self.application = application
+        self.host = host
+
+    async def request(
+        self, method: str, path: str, query_string: str = '', headers=(), body: bytes = b''
+    ) -> tuple[Response, RequestStats]:
+        stats = RequestStats()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode(),
+            'query_string': query_string.encode(),
+            'root_path': '',
+            'headers': [
+                (b'host', self.host.encode()),
+                (b'content-length', str(len(body)).encode()),
+                *((name.lower().encode(), value.encode()) for name, value in headers),
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': (self.host, 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        response = Response(status=0)
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client never disconnects, an app listening for it just waits
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response.status = message['status']
+                response.headers = message.get('headers', [])
+            elif message['type'] == 'http.response.body':
+                response.body += message.get('body', b'')
+
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            stats.duration_ms = (time.perf_counter() - started) * 1000
+            _current_request.reset(token)
+        stats.status = response.status
+        return response, stats
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current_request.get()
+    if stats is not None:
+        stats.queries += 1
+    return execute(sql, params, many, context)
+
+
+def _watch_connection(sender, connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+@contextmanager
+def count_requests():
+    """
+    Count the queries and cache lookups each driven request makes. Cache
+    lookups are counted on the default backend's class, every async cache call
+    ends up in its get or get_many.
+    """
+    backend = type(caches['default'])
+    original_get, original_get_many = backend.get, backend.get_many
+
+    def get(self, key, default=None, version=None):
+        value = original_get(self, key, _MISSING, version)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.cache_gets += 1
+            stats.cache_hits += value is not _MISSING
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = original_get_many(self, keys, version)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.cache_gets += len(keys)
+            stats.cache_hits += len(found)
+        return found
+
+    backend.get, backend.get_many = get, get_many
+    connection_created.connect(_watch_connection)
+    for connection in connections.all(initialized_only=True):
+        _watch_connection(None, connection)
+    try:
+        yield
+    finally:
+        backend.get, backend.get_many = original_get, original_get_many
+        connection_created.disconnect(_watch_connection)
+        for connection in connections.all(initialized_only=True):
+            if _count_query in connection.execute_wrappers:
+                connection.execute_wrappers.remove(_count_query)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(results: list[RequestStats], elapsed: float) -> dict:
+    """
+    Latency percentiles, throughput and per-request query and cache counts of one route
+    """
+    durations = sorted(stats.duration_ms for stats in results)
+    count = len(results)
+    cache_gets = sum(stats.cache_gets for stats in results)
+    return {
+        'requests': count,
+        'errors': sum(stats.status >= 500 for stats in results),
+        'statuses': sorted({stats.status for stats in results}),
+        'p50_ms': round(statistics.median(durations), 3) if durations else 0.0,
+        'p99_ms': round(percentile(durations, 0.99), 3),
+        'mean_ms': round(statistics.fmean(durations), 3) if durations else 0.0,
+        'requests_per_second': round(count / elapsed, 1) if elapsed else 0.0,
+        'queries_per_request': round(sum(stats.queries for stats in results) / count, 2) if count else 0.0,
+        'cache_gets_per_request': round(cache_gets / count, 2) if count else 0.0,
+        'cache_hit_rate': round(sum(stats.cache_hits for stats in results) / cache_gets, 3) if cache_gets else None,
+    }
@@ -0,0 +1,341 @@
+"""
+Generation-namespaced cache-aside.
+Every cached value lives under a scope (an address, city, state, country, user
+or the country list). Writes bump the generation of the scopes they touch, which retires
+every entry stored under the old generation in every process sharing the cache.
+"""
+import asyncio
+import time
+from hashlib import md5
+from typing import Any, Awaitable, Callable
+from django.conf import settings
+from django.core.cache import cache
+from main.utils.address_utils import get_address_key
+from main.utils.metrics_utils import record_cache
+from main.utils.replica_utils import reading_primary, written_recently
+
+COUNTRIES_SCOPE = ('countries',)
+# Bumped whenever an address is created or deleted
+ADDRESSES_SCOPE = ('addresses',)
+# Bumped whenever a country, state or city is created or deleted
+GEOGRAPHY_SCOPE = ('geography',)
+
+# A value older than its timeout is still served for this long while one request rebuilds it
+STALE_GRACE = 60
+# Misses are cached too, for less time than hits
+NEGATIVE_TIMEOUT = 60
+# How long a rebuild may hold the lock, and how long other requests wait for it
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+# How long a log entry is kept, a process that reads a log less often starts over
+LOG_TIMEOUT = 24 * 3600
+# Catching up on more entries than this costs more than starting over
+LOG_MAX_READ = 1000
+
+
+def address_scope(full_address: str) -> tuple:
+    # Keyed on the canonical key, so every spelling of an address shares its entries
+    return ('address', get_address_key(str(full_address)))
+
+
+def address_id_scope(address_id: int) -> tuple:
+    # Lookups of an address by id, which outlive any one spelling's scope
+    return ('address_id', address_id)
+
+
+def country_scope(country: str) -> tuple:
+    return ('country', country)
+
+
+def state_scope(state: str, country: str) -> tuple:
+    return ('state', country, state)
+
+
+def city_scope(city: str, state: str, country: str) -> tuple:
+    return ('city', country, state, city)
+
+
+def user_scope(user_id: int) -> tuple:
+    return ('user', user_id)
+
+
+def _digest(parts) -> str:
+    # Addresses contain spaces and commas, which memcached doesn't allow in keys
+    return md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _generation_key(scope: tuple) -> str:
+    return f'gen:{_digest(scope)}'
+
+
+def _modified_key(scope: tuple) -> str:
+    return f'modified:{_digest(scope)}'
+
+
+def get_generation(scope: tuple) -> int:
+    """
+    Return the current generation of a scope, starting a new one if it was never set or evicted
+    """
+    key = _generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so an evicted generation never restarts at a value already used
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+async def aget_generation(scope: tuple) -> int:
+    """
+    Async version of get_generation
+    """
+    key = _generation_key(scope)
+    generation = await cache.aget(key)
+    if generation is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        generation = await cache.aget(key)
+    return generation
+
+
+def get_version(scope: tuple) -> tuple[int, float | None]:
+    """
+    Return the generation of a scope and when it last changed, in one round trip.
+    The time is None until the scope is first bumped.
+    """
+    generation_key = _generation_key(scope)
+    modified_key = _modified_key(scope)
+    found = cache.get_many([generation_key, modified_key])
+    generation = found.get(generation_key)
+    if generation is None:
+        generation = get_generation(scope)
+    return generation, found.get(modified_key)
+
+
+def bump_generation(*scopes: tuple):
+    """
+    Move each scope to a new generation, invalidating every key built from it
+    """
+    for scope in scopes:
+        key = _generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+    modified = time.time()
+    cache.set_many({_modified_key(scope): modified for scope in scopes}, timeout=None)
+
+
+def reset_generations(scopes):
+    """
+    Move many scopes to a new generation in one round trip, for bulk writes.
+    The clock is ahead of any generation reached by incrementing from an older seed.
+    """
+    generation = time.time_ns()
+    modified = time.time()
+    values = {}
+    for scope in scopes:
+        values[_generation_key(scope)] = generation
+        values[_modified_key(scope)] = modified
+    cache.set_many(values, timeout=None)
+
+
+def _log_key(name: str) -> str:
+    return f'log:{_digest([name])}'
+
+
+def log_position(name: str) -> int:
+    """
+    Return the position of the newest entry of a log shared through the cache,
+    starting the log if it was never written or was evicted
+    """
+    key = _log_key(name)
+    position = cache.get(key)
+    if position is None:
+        # Seeded from the clock like generations, so a restarted log never reuses a position
+        cache.add(key, time.time_ns(), timeout=None)
+        position = cache.get(key)
+    return position
+
+
+def append_log(name: str, value):
+    """
+    Append a value to a log every process reads through the cache
+    """
+    key = _log_key(name)
+    try:
+        position = cache.incr(key)
+    except ValueError:
+        log_position(name)
+        position = cache.incr(key)
+    cache.set(f'{key}:{position}', value, LOG_TIMEOUT)
+
+
+def read_log(name: str, after: int) -> tuple[int, list | None]:
+    """
+    Return the position of a log's newest entry and the values appended after
+    position `after`. The values are None when some of them are gone from the
+    cache, and the reader has to start over.
+    """
+    position = log_position(name)
+    if position == after:
+        return position, []
+    if position < after or position - after > LOG_MAX_READ:
+        return position, None
+    keys = [f'{_log_key(name)}:{number}' for number in range(after + 1, position + 1)]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return position, None
+    return position, [found[key] for key in keys]
+
+
+def _replica_may_lag(scope: tuple) -> bool:
+    # Only asked on a miss, which is about to query the database anyway
+    return bool(settings.DATABASE_REPLICAS) and written_recently(cache.get(_modified_key(scope)))
+
+
+async def _areplica_may_lag(scope: tuple) -> bool:
+    return bool(settings.DATABASE_REPLICAS) and written_recently(await cache.aget(_modified_key(scope)))
+
+
+def _entry_key(name: str, scope: tuple) -> str:
+    return f'{name}:{_digest(scope)}'
+
+
+def page_name(name: str, cursor: str | None, page_size: int) -> str:
+    """
+    Name one page of a cached list. Cursors come from the URL, so they are digested
+    to keep the key short and free of characters memcached rejects.
+    """
+    return f'{name}:{page_size}:{_digest([cursor or ""])}'
+
+
+def keyed_name(name: str, key: str) -> str:
+    """
+    Name one of many entries of the same kind under a scope, digested like page_name
+    """
+    return f'{name}:{_digest([key])}'
+
+
+def _unpack(entry, generation) -> tuple[bool, bool, Any]:
+    """
+    Return (usable, fresh, value) for a cached (generation, fresh_until, value) entry
+    """
+    if entry is None or entry[0] != generation:
+        return False, False, None
+    return True, entry[1] > time.time(), entry[2]
+
+
+def cache_aside(name: str, scope: tuple, loader: Callable[[], Any], timeout: int | None = None):
+    """
+    Return the cached value of `name` in `scope`, calling `loader` to build it on a miss.
+
+    The generation and the entry are read in one round trip. `None` results are
+    cached like any other value, so a missing row doesn't reach the database on
+    every request. Only one caller rebuilds an entry at a time: the others serve
+    the stale value if there is one, or wait briefly for the rebuild. An entry
+    of a scope written to moments ago is rebuilt from the primary database,
+    which the replicas may still be behind.
+    `loader` must return a materialized value (a list, not a QuerySet).
+    """
+    generation_key = _generation_key(scope)
+    entry_key = _entry_key(name, scope)
+    found = cache.get_many([generation_key, entry_key])
+    generation = found.get(generation_key)
+    if generation is None:
+        generation = get_generation(scope)
+    usable, fresh, value = _unpack(found.get(entry_key), generation)
+    if fresh:
+        record_cache(hit=True)
+        return value
+
+    lock_key = f'lock:{entry_key}'
+    locked = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+    if not locked:
+        if usable:
+            record_cache(hit=True)
+            return value
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            usable, fresh, value = _unpack(cache.get(entry_key), generation)
+            if usable:
+                record_cache(hit=True)
+                return value
+        # The rebuild is taking too long, load it without the lock
+
+    try:
+        if _replica_may_lag(scope):
+            with reading_primary():
+                value = loader()
+        else:
+            value = loader()
+        if timeout is None:
+            timeout = NEGATIVE_TIMEOUT if value is None else cache.default_timeout
+        cache.set(entry_key, (generation, time.time() + timeout, value), timeout + STALE_GRACE)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    record_cache(hit=False, stored=True)
+    return value
+
+
+async def acache_aside(
+    name: str, scope: tuple, loader: Callable[[], Awaitable[Any]], timeout: int | None = None
+):
+    """
+    Async version of cache_aside, `loader` is awaited to build the value on a miss
+    """
+    generation_key = _generation_key(scope)
+    entry_key = _entry_key(name, scope)
+    found = await cache.aget_many([generation_key, entry_key])
+    generation = found.get(generation_key)
+    if generation is None:
+        generation = await aget_generation(scope)
+    usable, fresh, value = _unpack(found.get(entry_key), generation)
+    if fresh:
+        record_cache(hit=True)
+        return value
+
+    lock_key = f'lock:{entry_key}'
+    locked = await cache.aadd(lock_key, 1, timeout=LOCK_TIMEOUT)
+    if not locked:
+        if usable:
+            record_cache(hit=True)
+            return value
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            usable, fresh, value = _unpack(await cache.aget(entry_key), generation)
+            if usable:
+                record_cache(hit=True)
+                return value
+
+    try:
+        if await _areplica_may_lag(scope):
+            with reading_primary():
+                value = await loader()
+        else:
+            value = await loader()
+        if timeout is None:
+            timeout = NEGATIVE_TIMEOUT if value is None else cache.default_timeout
+        await cache.aset(
+            entry_key, (generation, time.time() + timeout, value), timeout + STALE_GRACE
+        )
+    finally:
+        if locked:
+            await cache.adelete(lock_key)
+    record_cache(hit=False, stored=True)
+    return value
+
+
+def invalidate_address(full_address: str, city: str, state: str, country: str):
+    """
+    Invalidate everything cached for an address and the geography it belongs to
+    """
+    bump_generation(
+        address_scope(full_address),
+        city_scope(city, state, country),
+        state_scope(state, country),
+        country_scope(country),
+    )
@@ -1,4 +1,6 @@
+from asgiref.sync import sync_to_async
 from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import render
 import logging
 
 logger = logging.getLogger()
@@ -8,3 +10,32 @@ def add_error_to_session_cookie(error: str, request: ASGIRequest):
         request.session['errors'] += error
     else:
         request.session['errors'] = [error]
+
+
+def pop_session_errors(request: ASGIRequest) -> list:
+    errors = []
+    if 'errors' in request.session:
+        errors.append(request.session['errors'])
+        request.session.pop('errors', None)
+    return errors
+
+
+async def apop_session_errors(request: ASGIRequest) -> list:
+    return await sync_to_async(pop_session_errors)(request)
+
+
+async def auser_id(request: ASGIRequest) -> int | None:
+    """
+    The id of the logged in user, or None. The user loads lazily from the
+    database, so from an async view it is read on the sync thread.
+    """
+    return await sync_to_async(lambda: request.user.pk if request.user.is_authenticated else None)()
+
+
+async def arender(request: ASGIRequest, template_name: str, context: dict | None = None):
+    """
+    Render from an async view.
+    The session and request.user load lazily from the database, which Django
+    only allows from sync code, so the template runs on the sync thread.
+    """
+    return await sync_to_async(render)(request, template_name=template_name, context=context)
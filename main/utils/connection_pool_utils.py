@@ -0,0 +1,179 @@
+"""
+Database connection pool shared by every thread of a process.
+
+Under ASGI each request's database calls run on a thread of their own, which
+lives only as long as the request, so Django's persistent connections
+(CONN_MAX_AGE) are never reused there. The pooled backend hands each
+thread a connection from a ConnectionPool when it first needs one and takes
+it back when Django closes the connection at the end of the request. Waiting
+for a free connection blocks that thread, never the event loop.
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable
+from django.db import OperationalError
+from main.utils.metrics_utils import (
+    DB_CONNECTION_ACQUIRE_SECONDS,
+    DB_POOL_CONNECTIONS,
+    DB_POOL_TIMEOUTS,
+    DB_POOL_WAITS,
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Up to `max_size` connections. A checkout takes the most recently returned
+    idle connection, opens a new one with its `connect` while under `max_size`,
+    or waits up to `timeout` seconds for one to come back. Connections idle for
+    more than `max_idle` seconds are closed, and ones idle for more than
+    `check_after` seconds must pass `check` before they are handed out again.
+    `reset` cleans up a returned connection and says whether it can be reused.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        check: Callable,
+        reset: Callable,
+        max_size: int = 10,
+        timeout: float = 10.0,
+        max_idle: float = 300.0,
+        check_after: float = 30.0,
+    ):
+        self.name = name
+        self.check = check
+        self.reset = reset
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        # (connection, returned at) with the most recently returned last
+        self.idle = deque()
+        # Checked out, or being opened
+        self.in_use = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self._report()
+
+    def acquire(self, connect: Callable):
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        expired = []
+        connection = returned_at = None
+        with self.condition:
+            while True:
+                expired.extend(self._take_expired())
+                if self.idle:
+                    connection, returned_at = self.idle.pop()
+                    break
+                if self.in_use < self.max_size:
+                    break
+                if not waited:
+                    waited = True
+                    DB_POOL_WAITS.inc(self.name)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            acquired = connection is not None or self.in_use < self.max_size
+            if acquired:
+                self.in_use += 1
+        for stale in expired:
+            _close_quietly(stale)
+        if not acquired:
+            DB_POOL_TIMEOUTS.inc(self.name)
+            self._report()
+            raise PoolTimeout(f'No database connection free after {self.timeout}s, all {self.max_size} are in use')
+        try:
+            if connection is not None and time.monotonic() - returned_at > self.check_after:
+                if not self.check(connection):
+                    _close_quietly(connection)
+                    connection = None
+            source = 'reused'
+            if connection is None:
+                connection = connect()
+                source = 'opened'
+        except BaseException:
+            with self.condition:
+                self.in_use -= 1
+                self.condition.notify()
+            self._report()
+            raise
+        DB_CONNECTION_ACQUIRE_SECONDS.observe(time.perf_counter() - started, self.name, source)
+        self._report()
+        return connection
+
+    def release(self, connection):
+        keep = self.reset(connection)
+        with self.condition:
+            self.in_use -= 1
+            keep = keep and not self.closed
+            if keep:
+                self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+        if not keep:
+            _close_quietly(connection)
+        self._report()
+
+    def close(self):
+        """
+        Close the idle connections, and the checked out ones as they come back
+        """
+        with self.condition:
+            self.closed = True
+            idle = [connection for connection, _ in self.idle]
+            self.idle.clear()
+        for connection in idle:
+            _close_quietly(connection)
+        self._report()
+
+    def _take_expired(self) -> list:
+        # Called with the condition held, the oldest are first
+        expired = []
+        limit = time.monotonic() - self.max_idle
+        while self.idle and self.idle[0][1] < limit:
+            expired.append(self.idle.popleft()[0])
+        return expired
+
+    def _report(self):
+        DB_POOL_CONNECTIONS.set(self.in_use, self.name, 'in_use')
+        DB_POOL_CONNECTIONS.set(len(self.idle), self.name, 'idle')
+        DB_POOL_CONNECTIONS.set(self.max_size, self.name, 'max')
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def get_pool(key, factory: Callable[[], ConnectionPool]) -> ConnectionPool:
+    """
+    The pool for `key`, made by `factory` the first time it is asked for
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = factory()
+        return pool
+
+
+def close_pools():
+    """
+    Close every pool, the next checkout starts a new one
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
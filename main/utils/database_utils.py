@@ -1,45 +1,348 @@
 from collections import defaultdict
-from main.models import Address, Review, State, City, Country
-from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from common import REVIEWS_PAGE_SIZE, SEARCH_MAX_RANKED
+from main.models import Address, AddressSummary, Review, State, City, Country
 from django.contrib.auth.models import User
-from main.utils.address_utils import get_address_dict
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Q, Subquery, Value
+from django.db.models.functions import Cast
+from main.utils.address_utils import get_address_dict, get_address_key, get_address_slug, get_url_slug
+from main.utils.review_utils import get_rent_stats, get_summary_fields
+from main.utils.pagination_utils import akeyset_page, decode_cursor, encode_cursor, keyset_page
+from main.utils.suggest_utils import AddressIndex
+from main.utils.geography_utils import GeographySnapshot, GeographyStore
+from main.utils.cache_utils import (
+    ADDRESSES_SCOPE,
+    COUNTRIES_SCOPE,
+    GEOGRAPHY_SCOPE,
+    acache_aside,
+    address_id_scope,
+    address_scope,
+    aget_generation,
+    append_log,
+    bump_generation,
+    cache_aside,
+    city_scope,
+    get_generation,
+    country_scope,
+    invalidate_address,
+    keyed_name,
+    log_position,
+    page_name,
+    read_log,
+    state_scope,
+    user_scope,
+)
 
 
 import logging
 
 logger = logging.getLogger()
 
+# One per process, built when the server starts
+address_index = AddressIndex(fuzzy=settings.ADDRESS_SUGGEST_FUZZY)
+# One per process, a new snapshot is swapped in whenever the geography changes
+geography_store = GeographyStore()
+
 ###############################################################################
 # ADDRESS TABLE
 ###############################################################################
 def get_address(full_address):
     if full_address:
-        cached = cache.get(f'address_{full_address}')
-        if not cached:
-            try:
-                address_pk = Address.objects.get(full_address=full_address)
-            except Address.DoesNotExist:
-                return None
-            cache.set(f'address_{full_address}', address_pk)
-        return cache.get(f'address_{full_address}')
-
-
-def address_pk_exists(full_address) -> bool:
-    return Address.objects.filter(full_address=full_address).exists()
+        return cache_aside(
+            'address',
+            address_scope(full_address),
+            lambda: _address_query(full_address).first(),
+        )
+
+
+async def aget_address(full_address):
+    if full_address:
+        return await acache_aside(
+            'address',
+            address_scope(full_address),
+            lambda: _address_query(full_address).afirst(),
+        )
+
+
+def _address_query(full_address):
+    return Address.objects.filter(canonical_key=get_address_key(full_address))
+
+
+def get_address_by_slug(street, city, state, country):
+    """
+    Return the address a review URL names. The lookup is cached under the city,
+    whose generation moves when an address is added to it, so a miss is cached too.
+    """
+    slug = get_url_slug(street, city, state, country)
+    return cache_aside(
+        keyed_name('address_slug', slug),
+        city_scope(city, state, country),
+        lambda: Address.objects.filter(slug=slug).order_by('id').first(),
+    )
+
+
+async def aget_address_by_slug(street, city, state, country):
+    slug = get_url_slug(street, city, state, country)
+    return await acache_aside(
+        keyed_name('address_slug', slug),
+        city_scope(city, state, country),
+        lambda: Address.objects.filter(slug=slug).order_by('id').afirst(),
+    )
+
+
+def invalidate_address_caches(address_pk):
+    """
+    Bump the cache generations of an address and its city, state and country
+    once the current transaction commits
+    """
+    names = Address.objects.filter(pk=address_pk).values_list(
+        'full_address', 'city__name', 'city__state__name', 'city__state__country__name'
+    ).first()
+    if names:
+        transaction.on_commit(lambda: invalidate_address(*names))
+
+
+def invalidate_address_id(address_pk):
+    """
+    Retire the lookups of an address by id once the current transaction commits,
+    when it is created (a miss is cached) or deleted
+    """
+    transaction.on_commit(lambda: bump_generation(address_id_scope(address_pk)))
+
+
+# Rows just below the index's last id may belong to transactions that committed
+# after it read the table, so catching up re-reads this many ids back
+ADDRESS_INDEX_OVERLAP = 100
+# Deleted addresses, for every process to drop from its index
+ADDRESS_REMOVALS_LOG = 'address_removals'
+
+
+async def asuggest_addresses(query: str, limit: int) -> list[str]:
+    """
+    Return known addresses for the typeahead, bringing this process's index up to
+    date first when another process has created addresses since it last looked
+    """
+    if not address_index.built and address_index.lock.locked():
+        # Still warming up, suggest nothing rather than wait
+        return []
+    generation = await aget_generation(ADDRESSES_SCOPE)
+    if generation != address_index.generation:
+        await sync_to_async(_refresh_address_index)(generation)
+    return address_index.suggest(query, limit)
+
+
+def warm_address_index():
+    """
+    Build the typeahead index ahead of the first request, run from a thread at server start
+    """
+    try:
+        _refresh_address_index(get_generation(ADDRESSES_SCOPE))
+    finally:
+        connection.close()
+
+
+def _refresh_address_index(generation):
+    global address_index
+    index = address_index
+    with index.lock:
+        if generation == index.generation:
+            return
+        addresses = Address.objects.values_list('id', 'full_address')
+        if index.built:
+            position, removed = read_log(ADDRESS_REMOVALS_LOG, index.removals_seen)
+            if removed is not None:
+                index.catch_up(
+                    addresses.filter(id__gt=index.last_id - ADDRESS_INDEX_OVERLAP), generation, removed
+                )
+                index.removals_seen = position
+                return
+            # Deletions were missed, build a new index while this one keeps serving
+            index = AddressIndex(fuzzy=index.fuzzy)
+        # Read first, so deletions committed during the build are applied after it
+        position = log_position(ADDRESS_REMOVALS_LOG)
+        index.build(addresses.iterator(chunk_size=10000), generation)
+        index.removals_seen = position
+        address_index = index
+
+
+def index_address(full_address: str):
+    """
+    Add a new address to the typeahead once the current transaction commits
+    """
+    def on_commit():
+        address_index.add(full_address)
+        bump_generation(ADDRESSES_SCOPE)
+    transaction.on_commit(on_commit)
+
+
+def unindex_address(full_address: str):
+    """
+    Drop a deleted address from the typeahead once the current transaction commits,
+    and log it for the other processes to drop on their next catch-up
+    """
+    def on_commit():
+        address_index.remove(full_address)
+        append_log(ADDRESS_REMOVALS_LOG, full_address)
+        bump_generation(ADDRESSES_SCOPE)
+    transaction.on_commit(on_commit)
+###############################################################################
+# ADDRESS SUMMARY TABLE
+###############################################################################
+ADDRESS_SUMMARY_FIELDS = [
+    'review_count',
+    'rating_sum',
+    'starting_rent_min',
+    'starting_rent_max',
+    'starting_rent_median',
+    'ending_rent_min',
+    'ending_rent_max',
+    'ending_rent_median',
+]
+
+
+def get_address_summary(address_pk) -> AddressSummary | None:
+    return AddressSummary.objects.filter(address_id=address_pk).first()
+
+
+async def aget_address_summary(address_pk) -> AddressSummary | None:
+    return await AddressSummary.objects.filter(address_id=address_pk).afirst()
+
+
+def rebuild_address_summary(address_pk) -> AddressSummary:
+    """
+    Recalculate an address summary from all of its reviews
+    """
+    rows = Review.objects.filter(address_id=address_pk).values_list(
+        'rating', 'starting_rent', 'ending_rent'
+    )
+    return AddressSummary.objects.update_or_create(
+        address_id=address_pk, defaults=get_summary_fields(rows)
+    )[0]
+
+
+def rebuild_address_summaries(address_pks) -> int:
+    """
+    Recalculate the summaries of many addresses with one read and one upsert.
+    Return the number of summaries written
+    """
+    rows_by_address = defaultdict(list)
+    reviews = Review.objects.filter(address_id__in=address_pks).values_list(
+        'address_id', 'rating', 'starting_rent', 'ending_rent'
+    )
+    for address_id, *row in reviews:
+        rows_by_address[address_id].append(row)
+    summaries = [
+        AddressSummary(address_id=address_id, **get_summary_fields(rows))
+        for address_id, rows in rows_by_address.items()
+    ]
+    AddressSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['address'],
+        update_fields=ADDRESS_SUMMARY_FIELDS,
+    )
+    return len(summaries)
+
+
+def update_address_summary(address_pk, review_delta: int, rating_delta: int) -> bool:
+    """
+    Apply a review write to an address summary.
+    Count and rating sum are adjusted in place, the rent stats are recalculated
+    from the address's rents since a median can't be maintained by deltas.
+    Return False when the address has no summary row yet
+    """
+    rents = list(
+        Review.objects.filter(address_id=address_pk).values_list('starting_rent', 'ending_rent')
+    )
+    starting = get_rent_stats(rent[0] for rent in rents)
+    ending = get_rent_stats(rent[1] for rent in rents)
+    updated = AddressSummary.objects.filter(address_id=address_pk).update(
+        review_count=F('review_count') + review_delta,
+        rating_sum=F('rating_sum') + rating_delta,
+        starting_rent_min=starting['min'],
+        starting_rent_max=starting['max'],
+        starting_rent_median=starting['median'],
+        ending_rent_min=ending['min'],
+        ending_rent_max=ending['max'],
+        ending_rent_median=ending['median'],
+    )
+    return updated > 0
+###############################################################################
+# GEOGRAPHY SNAPSHOT
+###############################################################################
+def get_geography() -> GeographySnapshot:
+    """
+    Return this process's snapshot of the country, state and city names,
+    replacing it first when the geography has changed since it was built
+    """
+    if geography_store.needs_check():
+        generation = get_generation(GEOGRAPHY_SCOPE)
+        if generation != geography_store.snapshot.generation:
+            _refresh_geography(generation)
+        geography_store.checked()
+    return geography_store.snapshot
+
+
+async def aget_geography() -> GeographySnapshot:
+    if geography_store.needs_check():
+        generation = await aget_generation(GEOGRAPHY_SCOPE)
+        if generation != geography_store.snapshot.generation:
+            await sync_to_async(_refresh_geography)(generation)
+        geography_store.checked()
+    return geography_store.snapshot
+
+
+def warm_geography():
+    """
+    Build the geography snapshot ahead of the first request, run from a thread at server start
+    """
+    try:
+        get_geography()
+    finally:
+        connection.close()
+
+
+def _refresh_geography(generation):
+    with geography_store.lock:
+        if geography_store.snapshot.generation == generation:
+            return
+        geography_store.snapshot = GeographySnapshot.build(
+            Country.objects.order_by('id').values_list('id', 'name'),
+            State.objects.order_by('id').values_list('id', 'country_id', 'name'),
+            City.objects.order_by('id').values_list('state_id', 'name'),
+            generation,
+        )
+
+
+def _geography_changed(*scopes: tuple):
+    """
+    Retire the dropdown lists once the new row is committed, and make this
+    process swap in a new snapshot on its next request
+    """
+    def bump():
+        bump_generation(GEOGRAPHY_SCOPE, *scopes)
+        geography_store.expire()
+    transaction.on_commit(bump)
 ###############################################################################
 # COUNTRY TABLE
 ###############################################################################
 def save_country(country: str) -> Country | None:
     if country:
-        return Country.objects.get_or_create(name=country)[0]
+        country_obj, created = Country.objects.get_or_create(name=country)
+        if created:
+            _geography_changed(COUNTRIES_SCOPE)
+        return country_obj
 
 
 def get_countries():
-    cached = cache.get('countries')
-    if not cached:
-        countries = Country.objects.all().values_list('name', flat=True)
-        cache.set('countries', countries)
-    return cache.get('countries')
+    return list(get_geography().countries)
+
+
+async def aget_countries():
+    return list((await aget_geography()).countries)
 
 
 def get_country(country: str) -> Country:
@@ -49,18 +352,21 @@ def get_country(country: str) -> Country:
 ###############################################################################
 def save_state(country: Country, state: str) -> State | None:
     if country and state:
-        return State.objects.get_or_create(country=country, name=state)[0]
+        state_obj, created = State.objects.get_or_create(country=country, name=state)
+        if created:
+            _geography_changed(country_scope(country.name))
+        return state_obj
     return None
 
 
 def get_states(country: str):
     if country:
-        cached = cache.get(f'{country}_states')
-        if not cached:
-            country_obj = Country.objects.get(name=country)
-            states = State.objects.filter(country=country_obj).values_list('name', flat=True)
-            cache.set(f'{country}_states', states)
-        return cache.get(f'{country}_states')
+        return list(get_geography().states(country))
+
+
+async def aget_states(country: str):
+    if country:
+        return list((await aget_geography()).states(country))
 
 
 def get_state(state: str, country: Country) -> State:
@@ -70,18 +376,19 @@ def get_state(state: str, country: Country) -> State:
 ###############################################################################
 def save_city(state: State, city: str) -> City | None:
     if state and city:
-        return City.objects.get_or_create(state=state, name=city)[0]
+        city_obj, created = City.objects.get_or_create(state=state, name=city)
+        if created:
+            _geography_changed(state_scope(state.name, state.country.name))
+        return city_obj
     return None
 
 
 def get_cities(state: str, country: str):
-    cached = cache.get(f'{state}_{country}_cities')
-    if not cached:
-        country_obj = Country.objects.get(name=country)
-        state_obj = State.objects.get(name=state, country=country_obj)
-        cities = City.objects.filter(state=state_obj).values_list('name', flat=True)
-        cache.set(f'{state}_{country}_cities', cities)
-    return cache.get(f'{state}_{country}_cities')
+    return list(get_geography().cities(state, country))
+
+
+async def aget_cities(state: str, country: str):
+    return list((await aget_geography()).cities(state, country))
 
 
 def get_city(city: str, state: State) -> City:
@@ -89,51 +396,262 @@ def get_city(city: str, state: State) -> City:
 ###############################################################################
 # REVIEW TABLE
 ###############################################################################
+def save_new_review(review: Review, full_address: str) -> Review:
+    """
+    Save a new review of `full_address` in one transaction, creating the address
+    and its city, state and country if they don't exist yet. Missing rows are
+    inserted with ON CONFLICT DO NOTHING and read back, so concurrent reviews of
+    a new address share one row. Caches are invalidated once the transaction commits.
+    """
+    with transaction.atomic():
+        address = _address_query(full_address).only('id', 'city_id', 'slug').first()
+        if address is None:
+            address = _insert_address(full_address)
+        review.address = address
+        review.city_id = address.city_id
+        review.save()
+    return review
+
+
+def _insert_address(full_address: str) -> Address:
+    address_dict = get_address_dict(full_address)
+    savepoint = transaction.savepoint()
+    city_id = _insert_city(address_dict['city'], address_dict['state'], address_dict['country'])
+    key = get_address_key(full_address)
+    new_address = Address(
+        full_address=full_address, city_id=city_id, slug=get_address_slug(full_address), canonical_key=key
+    )
+    Address.objects.bulk_create([new_address], ignore_conflicts=True)
+    address = Address.objects.only('id', 'city_id', 'full_address', 'slug').get(canonical_key=key)
+    if address.city_id != city_id:
+        # Another writer added the address, spelled its own way, first. Drop
+        # the city, state and country only this spelling needed.
+        transaction.savepoint_rollback(savepoint)
+    else:
+        transaction.savepoint_commit(savepoint)
+    # bulk_create sends no post_save signal
+    index_address(address.full_address)
+    invalidate_address_id(address.pk)
+    return address
+
+
+def _insert_city(city: str, state: str, country: str) -> int:
+    """
+    Return the id of a city, inserting it, its state and its country if they are new
+    """
+    city_id = City.objects.filter(
+        name=city, state__name=state, state__country__name=country
+    ).values_list('id', flat=True).first()
+    if city_id is not None:
+        return city_id
+    country_id, created = _insert_ignore(Country, name=country)
+    if created:
+        _geography_changed(COUNTRIES_SCOPE)
+    state_id, created = _insert_ignore(State, country_id=country_id, name=state)
+    if created:
+        _geography_changed(country_scope(country))
+    city_id, created = _insert_ignore(City, state_id=state_id, name=city)
+    if created:
+        _geography_changed(state_scope(state, country))
+    return city_id
+
+
+def _insert_ignore(model, **fields) -> tuple[int, bool]:
+    """
+    Return the id of the row with `fields`, inserting it if it is missing, and
+    whether it was missing. A row another writer inserts meanwhile counts as missing.
+    """
+    rows = model.objects.filter(**fields).values_list('id', flat=True)
+    pk = rows.first()
+    if pk is not None:
+        return pk, False
+    model.objects.bulk_create([model(**fields)], ignore_conflicts=True)
+    return rows.get(), True
+
+
 def delete_user_review(cur_review: Review):
     cur_address = cur_review.address
+    # Deleting the review invalidates the address's cache entries, see main.signals
     cur_review.delete()
-    cache.delete(f'{cur_address}_reviews')
-    if not get_reviews(cur_address):
+    if not Review.objects.filter(address=cur_address).exists():
         cur_address.delete()
-        # todo: cascade delete https://github.com/sntnmjones/RentalApp/issues/45
+        # An emptied city, state or country is left to `manage.py collect_geography`
+
+
+def get_reviewed_address_ids(user_id) -> frozenset:
+    """
+    Ids of the addresses a user has reviewed
+    """
+    return cache_aside(
+        'reviewed_addresses',
+        user_scope(user_id),
+        lambda: frozenset(Review.objects.filter(user_id=user_id).values_list('address_id', flat=True)),
+    )
 
 
-def get_reviews(address_pk: Address):
-    cached = cache.get(f'{address_pk}_reviews')
-    if not cached:
-        reviews = Review.objects.filter(address_id=address_pk)
-        cache.set(f'{address_pk}_reviews', reviews)
-    return cache.get(f'{address_pk}_reviews')
+async def aget_reviewed_address_ids(user_id) -> frozenset:
+    if user_id is None:
+        return frozenset()
+    return await acache_aside(
+        'reviewed_addresses',
+        user_scope(user_id),
+        lambda: _afrozenset(Review.objects.filter(user_id=user_id).values_list('address_id', flat=True)),
+    )
 
 
-def get_city_reviews(city, state, country):
-    cached = cache.get(f'{city}_{state}_{country}_reviews')
-    if not cached:
-        country_obj = get_country(country)
-        state_obj = get_state(state, country_obj)
-        city_obj = get_city(city, state_obj)
-        addresses = Address.objects.filter(city=city_obj)
-        reviews = {}
-        for address in addresses:
-            address_reviews = get_reviews(address.pk)
-            if address_reviews:
-                reviews[address.full_address] = address_reviews
-        cache.set(f'{city}_{state}_{country}_reviews', reviews)
-    return cache.get(f'{city}_{state}_{country}_reviews')
+def user_reviewed_address(user_id, full_address) -> bool:
+    address = get_address(full_address)
+    return address is not None and address.pk in get_reviewed_address_ids(user_id)
 
 
-def get_user_reviews(username):
+def invalidate_user_caches(user_id):
     """
-    Return reviews that a user has created
+    Bump the cache generation of a user's reviews once the current transaction commits
     """
-    try:
-        user = User.objects.get(username=username)
-        return Review.objects.filter(user=user).order_by('-pub_date')
-    except User.DoesNotExist:
-        pass
+    if user_id is not None:
+        transaction.on_commit(lambda: bump_generation(user_scope(user_id)))
+
+
+async def aget_reviews_page(address_pk: Address, cursor: str | None, page_size: int):
+    """
+    Return one newest first page of an address's reviews and the next and previous page cursors
+    """
+    return await acache_aside(
+        page_name('reviews', cursor, page_size),
+        address_scope(address_pk),
+        lambda: akeyset_page(
+            Review.objects.filter(address_id=address_pk).select_related('user'), cursor, page_size
+        ),
+    )
+
+
+def get_city_reviews(city, state, country, cursor: str | None = None, page_size: int = REVIEWS_PAGE_SIZE):
+    """
+    Return one newest first page of a city's reviews as a map of full address to
+    reviews, with the next and previous page cursors. Each page is one indexed
+    range query with addresses and users joined in.
+    """
+    return cache_aside(
+        page_name('city_reviews', cursor, page_size),
+        city_scope(city, state, country),
+        lambda: _group_page(
+            keyset_page(city_reviews_query(city, state, country), cursor, page_size)
+        ),
+    )
+
+
+async def aget_city_reviews(city, state, country, cursor: str | None = None, page_size: int = REVIEWS_PAGE_SIZE):
+    return await acache_aside(
+        page_name('city_reviews', cursor, page_size),
+        city_scope(city, state, country),
+        lambda: _agroup_page(
+            akeyset_page(city_reviews_query(city, state, country), cursor, page_size)
+        ),
+    )
+
+
+def city_reviews_query(city, state, country):
+    # The city is resolved in a scalar subquery, so Postgres reads the page
+    # straight off the (city, pub_date, id) index instead of sorting the city
+    city_id = City.objects.filter(
+        name=city, state__name=state, state__country__name=country
+    ).values('id')[:1]
+    return Review.objects.filter(city_id=Subquery(city_id)).select_related('address', 'user')
+
+
+def _group_page(page: tuple) -> tuple:
+    reviews, next_cursor, previous_cursor = page
+    return _group_by_address(reviews), next_cursor, previous_cursor
+
+
+async def _agroup_page(page) -> tuple:
+    return _group_page(await page)
+
+
+def _group_by_address(reviews) -> dict:
+    """
+    Group a page of reviews under their addresses, in the order each address first
+    appears. An address whose reviews span pages is listed again on the next one.
+    """
+    grouped = defaultdict(list)
+    for review in reviews:
+        grouped[review.address.full_address].append(review)
+    # Plain dict, the template's `reviews.items` lookup would add a key to a defaultdict
+    return dict(grouped)
+
+
+async def asearch_reviews(
+    query: str, country=None, state=None, city=None, cursor=None, page_size=20
+) -> tuple[list, str | None]:
+    """
+    Full-text search over review titles and comments, best match first.
+    Results can be scoped to a country, state or city. Only the newest
+    SEARCH_MAX_RANKED matches are ranked and paged, keyed on (rank, id), so no
+    page costs more than ranking that many reviews however common the words are.
+    Return the page of reviews and the cursor of the next page
+    """
+    matches = Review.objects.all()
+    if country or state or city:
+        # Resolve the scope to city ids first. Filtering through the whole geography
+        # join hides a large city from the planner, which then skips the text index.
+        cities = City.objects.all()
+        if country:
+            cities = cities.filter(state__country__name=country)
+        if state:
+            cities = cities.filter(state__name=state)
+        if city:
+            cities = cities.filter(name=city)
+        city_ids = await _alist(cities.values_list('id', flat=True))
+        matches = matches.filter(address__city_id__in=city_ids)
+
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, search_type='websearch', config='english')
+        matches = matches.filter(search_vector=search_query)
+        # ts_rank is a float4, which reaches Python rounded and never compares equal
+        # to itself again. As a float8 the rank round-trips through the cursor exactly.
+        rank = Cast(SearchRank(F('search_vector'), search_query), FloatField())
+    else:
+        # No text index outside Postgres, match substrings so search still works in development
+        matches = matches.filter(Q(title__icontains=query) | Q(comment__icontains=query))
+        rank = Value(0.0, output_field=FloatField())
+
+    # The planner finds the newest matches of a common word walking the id index
+    # backwards, and those of a rare one through the text index
+    candidates = matches.order_by('-id').values('id')[:SEARCH_MAX_RANKED]
+    reviews = Review.objects.filter(id__in=candidates).select_related('address', 'user').annotate(rank=rank)
+
+    after = decode_cursor(cursor)
+    if after and len(after) == 2:
+        rank, review_id = after
+        if isinstance(rank, (int, float)) and isinstance(review_id, int):
+            reviews = reviews.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=review_id))
+    page = await _alist(reviews.order_by('-rank', '-id')[:page_size + 1])
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(page[-1].rank, page[-1].id)
+    return page, next_cursor
+
+
+def get_user_reviews_page(username, cursor: str | None, page_size: int):
+    """
+    Return one newest first page of a user's reviews and the next and previous page cursors
+    """
+    user_id = User.objects.filter(username=username).values('id')[:1]
+    reviews = Review.objects.filter(user_id=Subquery(user_id)).select_related('address')
+    return keyset_page(reviews, cursor, page_size)
 
 
 def get_user_review(username, full_address):
-    user = User.objects.get(username=username)
-    address = Address.objects.get(full_address=full_address)
-    return Review.objects.get(user=user, address=address)
+    return Review.objects.get(
+        user__username=username, address__canonical_key=get_address_key(full_address)
+    )
+
+
+async def _alist(queryset) -> list:
+    return [row async for row in queryset]
+
+
+async def _afrozenset(queryset) -> frozenset:
+    return frozenset(await _alist(queryset))
@@ -0,0 +1,214 @@
+"""
+Email outbox.
+
+OutboxEmailBackend is the EMAIL_BACKEND: send_mail and the password reset
+form write their emails to the OutboxEmail table, in the request's
+transaction, and return. OutboxWorker delivers them in the background
+through EMAIL_OUTBOX_BACKEND, a batch at a time over one connection.
+An email that fails is retried with exponential backoff until it runs out
+of attempts. Workers claim emails with SELECT ... FOR UPDATE SKIP LOCKED,
+so any number of them can run, in the web process or as
+`manage.py deliver_email`.
+"""
+import logging
+import random
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from main.models import OutboxEmail
+from main.utils.metrics_utils import EMAIL_DELIVERY_SECONDS, EMAIL_OUTBOX_PENDING, EMAILS
+
+logger = logging.getLogger()
+
+# How long a worker holds the emails it claimed before another worker may take them
+CLAIM_SECONDS = 300
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 6 * 3600
+# Retrying these can't help
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused,)
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    Queue emails in the outbox instead of sending them. SMTP credentials passed
+    by the caller are ignored, the worker sends with the configured ones.
+    """
+
+    def send_messages(self, email_messages) -> int:
+        rows = [_to_row(message) for message in email_messages if message.recipients()]
+        OutboxEmail.objects.bulk_create(rows)
+        if rows:
+            transaction.on_commit(wake_worker)
+        return len(rows)
+
+
+def _to_row(message) -> OutboxEmail:
+    if message.attachments:
+        raise ValueError("The email outbox doesn't store attachments")
+    return OutboxEmail(
+        subject=message.subject,
+        body=message.body,
+        alternatives=[list(alternative) for alternative in getattr(message, "alternatives", [])],
+        from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=message.extra_headers,
+    )
+
+
+def _to_message(email: OutboxEmail, connection) -> EmailMultiAlternatives:
+    return EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+        alternatives=[tuple(alternative) for alternative in email.alternatives],
+        connection=connection,
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Seconds to wait after the `attempts`-th failure, doubling each time, with jitter
+    """
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.75, 1.25)
+
+
+def claim_batch(batch_size: int) -> list[OutboxEmail]:
+    """
+    Take up to `batch_size` due emails, oldest first, and hide them from other
+    workers for CLAIM_SECONDS. A worker that dies leaves them due again after that.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        emails = list(due.order_by("next_attempt_at", "id")[:batch_size])
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    return emails
+
+
+def deliver_batch(batch_size: int | None = None) -> int:
+    """
+    Deliver one batch of due emails over a single connection, return how many were claimed
+    """
+    emails = claim_batch(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0
+    mail_connection = get_connection(settings.EMAIL_OUTBOX_BACKEND, fail_silently=False)
+    try:
+        mail_connection.open()
+    except Exception as e:
+        logger.warning("Could not connect to deliver %s emails: %s", len(emails), e)
+        for email in emails:
+            _failed(email, e)
+        return len(emails)
+    try:
+        for email in emails:
+            started = time.perf_counter()
+            try:
+                mail_connection.send_messages([_to_message(email, mail_connection)])
+            except Exception as e:
+                logger.warning("Could not deliver email %s: %s", email.id, e)
+                _failed(email, e)
+                if _connection_lost(e):
+                    _reconnect(mail_connection)
+            else:
+                EMAIL_DELIVERY_SECONDS.observe(time.perf_counter() - started)
+                EMAILS.inc("sent")
+                email.delete()
+    finally:
+        mail_connection.close()
+    return len(emails)
+
+
+def _connection_lost(error: Exception) -> bool:
+    # An SMTP error reply leaves the connection usable, a dropped connection or socket error doesn't
+    return isinstance(error, smtplib.SMTPServerDisconnected) or not isinstance(error, smtplib.SMTPException)
+
+
+def _reconnect(mail_connection):
+    mail_connection.close()
+    try:
+        mail_connection.open()
+    except Exception as e:
+        # Each remaining email then fails on its own and is retried later
+        logger.warning("Could not reconnect to deliver email: %s", e)
+
+
+def _failed(email: OutboxEmail, error: Exception):
+    email.attempts += 1
+    email.last_error = repr(error)[:2000]
+    if isinstance(error, PERMANENT_ERRORS) or email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+        EMAILS.inc("failed")
+    else:
+        email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+        EMAILS.inc("retried")
+    email.save(update_fields=["attempts", "last_error", "status", "next_attempt_at"])
+
+
+def pending_count() -> int:
+    return OutboxEmail.objects.filter(status=OutboxEmail.PENDING).count()
+
+
+class OutboxWorker:
+    """
+    Deliver the outbox until stopped. Waits EMAIL_OUTBOX_POLL_SECONDS between
+    empty polls, or until an email queued by this process is committed.
+    """
+
+    def __init__(self):
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                while deliver_batch() and not self.stopped.is_set():
+                    pass
+                EMAIL_OUTBOX_PENDING.set(pending_count())
+            except Exception:
+                logger.exception("Email outbox worker failed, retrying")
+            finally:
+                close_old_connections()
+            self.wake.wait(settings.EMAIL_OUTBOX_POLL_SECONDS)
+            self.wake.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+
+worker = OutboxWorker()
+
+
+def wake_worker():
+    worker.wake.set()
+
+
+def start_worker() -> threading.Thread | None:
+    """
+    Run the outbox worker on a daemon thread of this process, if EMAIL_OUTBOX_WORKER is on
+    """
+    if not settings.EMAIL_OUTBOX_WORKER:
+        return None
+    thread = threading.Thread(target=worker.run, name="email-outbox", daemon=True)
+    thread.start()
+    return thread
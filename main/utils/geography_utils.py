@@ -0,0 +1,109 @@
+"""
+In-memory snapshot of the country, state and city names behind the address dropdowns.
+
+A snapshot is built in one go from the three geography tables and never changed
+afterwards. When the geography changes a new snapshot is built and swapped in
+whole, so a reader only ever sees one consistent version of the hierarchy.
+"""
+import gzip
+import json
+import sys
+import threading
+import time
+from hashlib import md5
+from typing import Iterable
+
+# How often a process asks the cache whether another process changed the geography.
+# Changes made in this process are picked up on the next request.
+GEOGRAPHY_RECHECK_SECONDS = 5
+
+
+class GeographySnapshot:
+    """
+    Country -> state -> city names, with every list of children held as a tuple
+    of interned strings. `json` is the whole hierarchy as one gzipped JSON
+    document and `etag` identifies its content.
+    """
+    __slots__ = ('generation', 'countries', '_states', '_cities', 'json', 'etag')
+
+    def __init__(self, countries: tuple, states: dict, cities: dict, generation):
+        self.generation = generation
+        self.countries = countries
+        self._states = states
+        self._cities = cities
+        document = {
+            country: {state: list(cities[(country, state)]) for state in states[country]}
+            for country in countries
+        }
+        raw = json.dumps(document, separators=(',', ':')).encode()
+        # mtime=0 keeps the bytes, and so the ETag, the same in every process
+        self.json = gzip.compress(raw, mtime=0)
+        self.etag = f'"{md5(raw).hexdigest()}"'
+
+    @classmethod
+    def build(
+        cls,
+        country_rows: Iterable[tuple[int, str]],
+        state_rows: Iterable[tuple[int, int, str]],
+        city_rows: Iterable[tuple[int, str]],
+        generation,
+    ) -> 'GeographySnapshot':
+        """
+        Build a snapshot from (id, name) countries, (id, country_id, name) states
+        and (state_id, name) cities, each list in the order the dropdowns show it
+        """
+        country_names = {}
+        for pk, name in country_rows:
+            country_names[pk] = sys.intern(name)
+        states = {name: [] for name in country_names.values()}
+        state_keys = {}
+        # The tables are read one after another, so a row whose parent was created
+        # after its parent's table was read is left for the next snapshot
+        for pk, country_id, name in state_rows:
+            if country_id in country_names:
+                state_keys[pk] = country_names[country_id], sys.intern(name)
+                states[country_names[country_id]].append(state_keys[pk][1])
+        cities = {key: [] for key in state_keys.values()}
+        for state_id, name in city_rows:
+            if state_id in state_keys:
+                cities[state_keys[state_id]].append(sys.intern(name))
+        return cls(
+            tuple(country_names.values()),
+            {country: tuple(names) for country, names in states.items()},
+            {key: tuple(names) for key, names in cities.items()},
+            generation,
+        )
+
+    @classmethod
+    def empty(cls) -> 'GeographySnapshot':
+        return cls((), {}, {}, None)
+
+    def states(self, country: str) -> tuple:
+        return self._states.get(country, ())
+
+    def cities(self, state: str, country: str) -> tuple:
+        return self._cities.get((country, state), ())
+
+
+class GeographyStore:
+    """
+    Holds a process's current snapshot. `lock` serializes rebuilds, readers
+    never take it.
+    """
+
+    def __init__(self):
+        self.snapshot = GeographySnapshot.empty()
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+
+    def needs_check(self) -> bool:
+        return time.monotonic() - self.checked_at > GEOGRAPHY_RECHECK_SECONDS
+
+    def checked(self):
+        self.checked_at = time.monotonic()
+
+    def expire(self):
+        """
+        Make the next reader check the generation, after this process changed the geography
+        """
+        self.checked_at = 0.0
@@ -0,0 +1,320 @@
+"""
+Indexed archive of the hourly log files.
+
+Each day's hourly files are compressed in parallel, one gzip member per hour,
+and the members are concatenated into <log>.<day>.gz, which is still a plain
+gzip file that zcat reads whole. A sidecar <log>.<day>.index.json records,
+for each hour, where its member starts and ends in the archive, the time
+range it covers, how many records each level has and a Bloom filter of the
+request ids it mentions. A query decompresses only the hours that can match.
+The <log>.<day>.tar.gz archives bin/log_handling.py left behind aren't
+queried, but they expire like the others.
+"""
+import base64
+import gzip
+import json
+import math
+import os
+import re
+import shutil
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from hashlib import blake2b
+from typing import Iterable, Iterator
+
+HOURLY_SUFFIX = re.compile(r'\.(?P<day>\d{4}-\d{2}-\d{2})_(?P<hour>\d{2})$')
+VERBOSE_RECORD = re.compile(
+    r'(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ \[(?P<level>[A-Z]+)\]'
+    r'(?:\[pid:\d+\])?(?:\[thread:\d+\])?(?:\[request:(?P<request_id>[^\]]+)\])?'
+)
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+BLOOM_ERROR_RATE = 0.01
+
+
+@dataclass(frozen=True)
+class RecordHead:
+    """
+    What the first line of a log record says about it
+    """
+    time: datetime
+    level: str
+    request_id: str | None
+
+
+def parse_record(line: str) -> RecordHead | None:
+    """
+    Parse the first line of a record in either the JSON or the verbose format.
+    Lines that don't start a record, like the rest of a traceback, give None.
+    """
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            return RecordHead(datetime.fromisoformat(entry['time']), entry['level'], entry.get('request_id'))
+        except (ValueError, KeyError, TypeError):
+            return None
+    match = VERBOSE_RECORD.match(line)
+    if match is None:
+        return None
+    # asctime is the server's local time
+    time = datetime.strptime(match['time'], '%Y-%m-%d %H:%M:%S').astimezone()
+    return RecordHead(time, match['level'], match['request_id'])
+
+
+class BloomFilter:
+    """
+    Set membership in a fixed number of bits, with false positives but no false negatives
+    """
+
+    def __init__(self, size: int, hashes: int, bits: bytearray | None = None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = BLOOM_ERROR_RATE) -> 'BloomFilter':
+        capacity = max(capacity, 1)
+        size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        return cls(size, max(1, round(size / capacity * math.log(2))))
+
+    def _positions(self, value: str) -> Iterator[int]:
+        digest = blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position // 8] |= 1 << position % 8
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[position // 8] & 1 << position % 8 for position in self._positions(value))
+
+    def to_dict(self) -> dict:
+        return {'size': self.size, 'hashes': self.hashes, 'bits': base64.b64encode(self.bits).decode()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BloomFilter':
+        return cls(data['size'], data['hashes'], bytearray(base64.b64decode(data['bits'])))
+
+
+def hourly_files(log_dir: str, log_name: str, before: date) -> dict[str, list[tuple[str, str]]]:
+    """
+    Rotated hourly files of days before `before`, as {day: [(hour, path)]} in hour order
+    """
+    days = {}
+    for name in os.listdir(log_dir):
+        match = HOURLY_SUFFIX.search(name)
+        if match is None or name[:match.start()] != log_name:
+            continue
+        if date.fromisoformat(match['day']) < before:
+            days.setdefault(match['day'], []).append((match['hour'], os.path.join(log_dir, name)))
+    return {day: sorted(hours) for day, hours in sorted(days.items())}
+
+
+def archive_path(archive_dir: str, log_name: str, day: str) -> str:
+    return os.path.join(archive_dir, f'{log_name}.{day}.gz')
+
+
+def index_path(archive_dir: str, log_name: str, day: str) -> str:
+    return os.path.join(archive_dir, f'{log_name}.{day}.index.json')
+
+
+def legacy_archive_path(archive_dir: str, log_name: str, day: str) -> str:
+    return os.path.join(archive_dir, f'{log_name}.{day}.tar.gz')
+
+
+def compress_hour(source: str, part: str, compress_level: int) -> dict:
+    """
+    Compress one hourly file into a gzip member at `part` and describe what it holds.
+    Runs in a worker process.
+    """
+    first = last = None
+    lines = 0
+    levels = {}
+    request_ids = set()
+    with open(source, 'rb') as file, open(part, 'wb') as out:
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=compress_level, mtime=0) as member:
+            for raw in file:
+                member.write(raw)
+                lines += 1
+                head = parse_record(raw.decode('utf-8', errors='replace'))
+                if head is None:
+                    continue
+                first = head.time if first is None else min(first, head.time)
+                last = head.time if last is None else max(last, head.time)
+                levels[head.level] = levels.get(head.level, 0) + 1
+                if head.request_id and head.request_id != '-':
+                    request_ids.add(head.request_id)
+    bloom = BloomFilter.for_capacity(len(request_ids))
+    for request_id in request_ids:
+        bloom.add(request_id)
+    return {
+        'first': first.isoformat() if first else None,
+        'last': last.isoformat() if last else None,
+        'lines': lines,
+        'levels': levels,
+        'request_ids': bloom.to_dict(),
+    }
+
+
+def archive_days(
+    days: dict[str, list[tuple[str, str]]],
+    archive_dir: str,
+    log_name: str,
+    executor: Executor,
+    compress_level: int = 6,
+) -> Iterator[tuple[str, int]]:
+    """
+    Append every hour of `days` to its day's archive and index, compressing all
+    hours of all days in parallel on `executor`. Each hourly file is removed
+    only once its day's archive and index are on disk. Yield (day, hours archived).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    jobs = {}
+    for day, hours in days.items():
+        archive = archive_path(archive_dir, log_name, day)
+        # An hour already in the index was archived by a run that stopped before removing its file
+        archived = {entry['hour'] for entry in _load_index(archive_dir, log_name, day)['hours']}
+        jobs[day] = []
+        for hour, source in hours:
+            job = None
+            if hour not in archived:
+                job = executor.submit(compress_hour, source, f'{archive}.{hour}.part', compress_level)
+            jobs[day].append((hour, source, job))
+    for day, day_jobs in jobs.items():
+        index = _load_index(archive_dir, log_name, day)
+        archive = archive_path(archive_dir, log_name, day)
+        new_hours = 0
+        with open(archive, 'r+b' if os.path.exists(archive) else 'wb') as out:
+            # Drop anything written after the last indexed hour by an interrupted run
+            out.truncate(max((entry['offset'] + entry['length'] for entry in index['hours']), default=0))
+            out.seek(0, os.SEEK_END)
+            for hour, source, job in day_jobs:
+                if job is None:
+                    continue
+                entry = job.result()
+                part = f'{archive}.{hour}.part'
+                entry.update(hour=hour, offset=out.tell(), length=os.path.getsize(part))
+                with open(part, 'rb') as member:
+                    shutil.copyfileobj(member, out)
+                index['hours'].append(entry)
+                new_hours += 1
+            out.flush()
+            os.fsync(out.fileno())
+        index['hours'].sort(key=lambda entry: entry['hour'])
+        _write_index(archive_dir, log_name, day, index)
+        for hour, source, job in day_jobs:
+            os.remove(source)
+            if job is not None:
+                os.remove(f'{archive}.{hour}.part')
+        yield day, new_hours
+
+
+def remove_expired(archive_dir: str, log_name: str, keep_from: date) -> list[str]:
+    """
+    Delete the archives, indexes and legacy archives of days before `keep_from`,
+    return the days removed
+    """
+    removed = []
+    days = set(archived_days(archive_dir, log_name)) | set(_days_with_suffix(archive_dir, log_name, '.tar.gz'))
+    for day in sorted(days):
+        if date.fromisoformat(day) < keep_from:
+            for path in (
+                archive_path(archive_dir, log_name, day),
+                index_path(archive_dir, log_name, day),
+                legacy_archive_path(archive_dir, log_name, day),
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+            removed.append(day)
+    return removed
+
+
+def archived_days(archive_dir: str, log_name: str) -> list[str]:
+    return _days_with_suffix(archive_dir, log_name, '.index.json')
+
+
+def _days_with_suffix(archive_dir: str, log_name: str, suffix: str) -> list[str]:
+    if not os.path.isdir(archive_dir):
+        return []
+    pattern = re.compile(rf'{re.escape(log_name)}\.(\d{{4}}-\d{{2}}-\d{{2}}){re.escape(suffix)}$')
+    return sorted(match[1] for match in map(pattern.match, os.listdir(archive_dir)) if match)
+
+
+def query(
+    archive_dir: str,
+    log_name: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    levels: Iterable[str] | None = None,
+    request_id: str | None = None,
+    first_day: date | None = None,
+) -> Iterator[str]:
+    """
+    Yield the lines of the archived records that match every given condition,
+    a record's continuation lines with it. Hours the index rules out are never read.
+    """
+    levels = set(levels) if levels else None
+    # Times without an offset are the server's local time, like the verbose format's
+    since = since.astimezone() if since else None
+    until = until.astimezone() if until else None
+    for day in archived_days(archive_dir, log_name):
+        if first_day and date.fromisoformat(day) < first_day:
+            continue
+        index = _load_index(archive_dir, log_name, day)
+        with open(archive_path(archive_dir, log_name, day), 'rb') as archive:
+            for entry in index['hours']:
+                if not _hour_may_match(entry, since, until, levels, request_id):
+                    continue
+                archive.seek(entry['offset'])
+                text = gzip.decompress(archive.read(entry['length'])).decode('utf-8', errors='replace')
+                yield from _matching_lines(text.splitlines(), since, until, levels, request_id)
+
+
+def _hour_may_match(entry: dict, since, until, levels, request_id) -> bool:
+    if entry['first'] is None:
+        return False
+    if since and datetime.fromisoformat(entry['last']) < since:
+        return False
+    if until and datetime.fromisoformat(entry['first']) > until:
+        return False
+    if levels and not any(entry['levels'].get(level) for level in levels):
+        return False
+    return not request_id or request_id in BloomFilter.from_dict(entry['request_ids'])
+
+
+def _matching_lines(lines: list[str], since, until, levels, request_id) -> Iterator[str]:
+    matched = False
+    for line in lines:
+        head = parse_record(line)
+        if head is not None:
+            matched = (
+                (since is None or head.time >= since)
+                and (until is None or head.time <= until)
+                and (levels is None or head.level in levels)
+                and (request_id is None or head.request_id == request_id)
+            )
+        if matched:
+            yield line
+
+
+def _load_index(archive_dir: str, log_name: str, day: str) -> dict:
+    try:
+        with open(index_path(archive_dir, log_name, day)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'day': day, 'hours': []}
+
+
+def _write_index(archive_dir: str, log_name: str, day: str, index: dict):
+    path = index_path(archive_dir, log_name, day)
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(index, file, separators=(',', ':'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+def days_ago(days: int) -> date:
+    return date.today() - timedelta(days=days)
@@ -0,0 +1,119 @@
+"""
+Logging off the request thread.
+
+QueueingHandler puts records on a bounded in-memory queue and a listener
+thread formats and writes them, so a request never waits on a disk flush.
+When the queue is full a record is dropped, or with the "block" policy the
+caller waits briefly for room before dropping it. Every record carries the id
+of the request that logged it, and JsonFormatter writes one JSON object per line.
+"""
+import json
+import logging
+import queue
+import sys
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from django.utils.module_loading import import_string
+
+request_id: ContextVar[str] = ContextVar('request_id', default='-')
+
+DROP = 'drop'
+BLOCK = 'block'
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamp each record with the id of the request being served, '-' outside one
+    """
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueingHandler(QueueHandler):
+    """
+    Hand records to `handler_class`, built from the remaining keyword
+    arguments, on a listener thread. The formatter set on this handler is the
+    one the listener writes with.
+    """
+
+    def __init__(
+        self,
+        handler_class: str,
+        queue_size: int = 10_000,
+        full_policy: str = DROP,
+        block_timeout: float = 0.1,
+        **handler_kwargs,
+    ):
+        if full_policy not in (DROP, BLOCK):
+            raise ValueError(f'Unknown full_policy {full_policy!r}, use {DROP!r} or {BLOCK!r}')
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self.target = import_string(handler_class)(**handler_kwargs)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        self._running = True
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, the queued record is left as logged
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Merge the arguments now, they may change after the call returns. Exceptions
+        # are formatted on the listener thread, the record never leaves the process.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.full_policy == BLOCK:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                sys.stderr.write(f'Log queue full, {dropped} records dropped so far\n')
+
+    def stop(self):
+        """
+        Write what is still queued and stop the listener
+        """
+        if self._running:
+            self._running = False
+            self.listener.stop()
+            self.target.close()
+
+    def close(self):
+        # Called by logging.shutdown at exit and when the logging config is replaced
+        self.stop()
+        super().close()
@@ -0,0 +1,265 @@
+"""
+Per-request instrumentation and the in-process metrics it feeds.
+
+The middleware opens a RequestMetrics for each request in a context variable.
+sync_to_async copies the context into the thread a view's database and cache
+calls run on, so the SQL, cache and template hooks below add to the right
+request without being handed it. When the request ends its totals go into
+counters and histograms labelled by view, which /metrics serves in the
+Prometheus text format. Each process keeps its own metrics.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from django.template.backends.django import DjangoTemplates, Template
+
+_current_request: ContextVar['RequestMetrics | None'] = ContextVar('request_metrics', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Taking a pooled connection is far quicker than a request
+ACQUIRE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, *DURATION_BUCKETS)
+
+
+class RequestMetrics:
+    __slots__ = (
+        'started', 'queries', 'query_seconds', 'cache_hits', 'cache_misses', 'cache_sets', 'template_seconds',
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_sets = 0
+        self.template_seconds = 0.0
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in sorted(values):
+            lines.extend(self._samples(dict(zip(self.labels, label_values)), value))
+        return lines
+
+    def _samples(self, labels: dict, value) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def _samples(self, labels: dict, value) -> list[str]:
+        return [f'{self.name}{_labels(labels)} {_number(value)}']
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def _samples(self, labels: dict, value) -> list[str]:
+        return [f'{self.name}{_labels(labels)} {_number(value)}']
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...], buckets: tuple):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                # Per-bucket counts, then the sum and the count
+                state = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, labels: dict, value) -> list[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += bucket_count
+            le = bound if bound == '+Inf' else _number(bound)
+            lines.append(f'{self.name}_bucket{_labels({**labels, "le": le})} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(labels)} {_number(total)}')
+        lines.append(f'{self.name}_count{_labels(labels)} {count}')
+        return lines
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUESTS = Counter('http_requests_total', 'Requests by view, method and status.', ('view', 'method', 'status'))
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Wall time of a request.', ('view',), DURATION_BUCKETS
+)
+QUERIES = Histogram('db_queries_per_request', 'SQL queries run by a request.', ('view',), COUNT_BUCKETS)
+QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds', 'Time a request spent in SQL queries.', ('view',), DURATION_BUCKETS
+)
+TEMPLATE_SECONDS = Histogram(
+    'template_render_duration_seconds', 'Time a request spent rendering templates.', ('view',), DURATION_BUCKETS
+)
+CACHE_OPERATIONS = Counter(
+    'cache_operations_total',
+    'Cache-aside lookups by view and result (hit or miss), and the values stored after a miss (set).',
+    ('view', 'operation'),
+)
+EMAILS = Counter(
+    'email_outbox_deliveries_total',
+    'Outbox delivery attempts by result: sent, retried later or failed for good.',
+    ('result',),
+)
+EMAIL_DELIVERY_SECONDS = Histogram(
+    'email_delivery_duration_seconds', 'Time to hand one email to the mail server.', (), DURATION_BUCKETS
+)
+EMAIL_OUTBOX_PENDING = Gauge('email_outbox_pending', 'Emails waiting in the outbox.', ())
+DB_CONNECTION_ACQUIRE_SECONDS = Histogram(
+    'db_connection_acquire_seconds',
+    'Time to get a database connection, by database and source: reused from the pool or newly opened.',
+    ('database', 'source'),
+    ACQUIRE_BUCKETS,
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections',
+    'Pooled database connections by state: in use, idle, and the most the pool opens (max).',
+    ('database', 'state'),
+)
+DB_POOL_WAITS = Counter(
+    'db_pool_waits_total', 'Checkouts that found every pooled connection in use and waited.', ('database',)
+)
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total', 'Checkouts that gave up waiting for a pooled connection.', ('database',)
+)
+METRICS = (
+    REQUESTS, REQUEST_SECONDS, QUERIES, QUERY_SECONDS, TEMPLATE_SECONDS, CACHE_OPERATIONS,
+    EMAILS, EMAIL_DELIVERY_SECONDS, EMAIL_OUTBOX_PENDING,
+    DB_CONNECTION_ACQUIRE_SECONDS, DB_POOL_CONNECTIONS, DB_POOL_WAITS, DB_POOL_TIMEOUTS,
+)
+
+
+def start_request() -> tuple[RequestMetrics, object]:
+    metrics = RequestMetrics()
+    return metrics, _current_request.set(metrics)
+
+
+def finish_request(metrics: RequestMetrics, token, view: str, method: str, status: int):
+    _current_request.reset(token)
+    REQUESTS.inc(view, method, str(status))
+    REQUEST_SECONDS.observe(time.perf_counter() - metrics.started, view)
+    QUERIES.observe(metrics.queries, view)
+    QUERY_SECONDS.observe(metrics.query_seconds, view)
+    if metrics.template_seconds:
+        TEMPLATE_SECONDS.observe(metrics.template_seconds, view)
+    for operation, count in (
+        ('hit', metrics.cache_hits), ('miss', metrics.cache_misses), ('set', metrics.cache_sets)
+    ):
+        if count:
+            CACHE_OPERATIONS.inc(view, operation, amount=count)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every database connection, a no-op outside a request
+    """
+    metrics = _current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_seconds += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver, connections are opened per thread
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_cache(hit: bool, stored: bool = False):
+    """
+    Count one cache-aside lookup, and the value stored after a miss
+    """
+    metrics = _current_request.get()
+    if metrics is None:
+        return
+    if hit:
+        metrics.cache_hits += 1
+    else:
+        metrics.cache_misses += 1
+    if stored:
+        metrics.cache_sets += 1
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current_request.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing every render made during a request.
+    Included templates render inside their parent, so each page is timed once.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
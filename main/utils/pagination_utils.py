@@ -0,0 +1,106 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from django.db.models import Q
+
+
+def encode_cursor(*values) -> str:
+    """
+    Pack the sort key of the last row on a page into an opaque URL-safe token
+    """
+    data = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> list | None:
+    """
+    Unpack a token made by encode_cursor, None when it is missing or malformed
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+# Review lists run newest first, keyed on (pub_date, id). A cursor names the
+# row to continue from and which way to go.
+NEXT = "n"
+PREVIOUS = "p"
+
+
+def get_page_size(request, default: int, maximum: int) -> int:
+    """
+    Read ?page_size=, falling back to the default when it is missing or invalid
+    """
+    try:
+        page_size = int(request.GET.get("page_size", default))
+    except ValueError:
+        return default
+    return min(max(page_size, 1), maximum)
+
+
+def _page_query(queryset, cursor: str | None, page_size: int):
+    """
+    Return the slice to fetch for a page, whether a valid cursor was given and
+    whether the page is read backwards
+    """
+    values = decode_cursor(cursor)
+    if not values or len(values) != 3 or values[0] not in (NEXT, PREVIOUS):
+        return queryset.order_by("-pub_date", "-id")[:page_size + 1], False, False
+    direction, pub_date, pk = values
+    try:
+        pub_date = datetime.fromisoformat(pub_date)
+    except (TypeError, ValueError):
+        pub_date = None
+    if pub_date is None or not isinstance(pk, int):
+        return queryset.order_by("-pub_date", "-id")[:page_size + 1], False, False
+
+    # The plain pub_date bound is implied by the OR, it is there so the index
+    # scan starts at the cursor instead of filtering from the first row
+    if direction == PREVIOUS:
+        queryset = queryset.filter(pub_date__gte=pub_date).filter(
+            Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=pk)
+        )
+        return queryset.order_by("pub_date", "id")[:page_size + 1], True, True
+    queryset = queryset.filter(pub_date__lte=pub_date).filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+    )
+    return queryset.order_by("-pub_date", "-id")[:page_size + 1], True, False
+
+
+def _page_result(rows: list, page_size: int, has_cursor: bool, backwards: bool) -> tuple:
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+        has_next, has_previous = bool(rows), more
+    else:
+        has_next, has_previous = more, has_cursor
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(NEXT, rows[-1].pub_date.isoformat(), rows[-1].id)
+    if rows and has_previous:
+        previous_cursor = encode_cursor(PREVIOUS, rows[0].pub_date.isoformat(), rows[0].id)
+    return rows, next_cursor, previous_cursor
+
+
+def keyset_page(queryset, cursor: str | None, page_size: int) -> tuple[list, str | None, str | None]:
+    """
+    Fetch one newest first page of a queryset with a single range query.
+    Return the rows and the cursors of the next (older) and previous (newer) pages
+    """
+    query, has_cursor, backwards = _page_query(queryset, cursor, page_size)
+    return _page_result(list(query), page_size, has_cursor, backwards)
+
+
+async def akeyset_page(queryset, cursor: str | None, page_size: int) -> tuple[list, str | None, str | None]:
+    """
+    Async version of keyset_page
+    """
+    query, has_cursor, backwards = _page_query(queryset, cursor, page_size)
+    return _page_result([row async for row in query], page_size, has_cursor, backwards)
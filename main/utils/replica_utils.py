@@ -0,0 +1,95 @@
+"""
+Read replicas.
+
+ReplicaRouter sends reads to a random one of DATABASE_REPLICAS and writes to
+the primary. Reads stay on the primary when a replica could be behind it:
+
+- inside a transaction, which must see its own writes
+- for requests that may write (any method but GET, HEAD and OPTIONS), whose
+  checks must see the rows they are about to change
+- for a browser that wrote in the last DB_PRIMARY_PIN_SECONDS, so its user
+  sees their review right away. A write sets a cookie saying until when
+  (see PrimaryPinningMiddleware), anonymous visitors who register included.
+- while rebuilding a shared cache entry whose scope was written to within
+  that window, which would otherwise be cached stale for everyone
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Set for the length of a request, and copied by sync_to_async into the threads its queries run on
+_current_request: ContextVar['RequestRouting | None'] = ContextVar('request_routing', default=None)
+_reading_primary: ContextVar[bool] = ContextVar('reading_primary', default=False)
+
+
+class RequestRouting:
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned: bool):
+        self.pinned = pinned
+        self.wrote = False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas:
+            return None
+        if _reading_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        routing = _current_request.get()
+        if routing is not None and routing.pinned:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        routing = _current_request.get()
+        if routing is not None:
+            # Later reads of this request see the write too
+            routing.wrote = routing.pinned = True
+        return DEFAULT_DB_ALIAS if settings.DATABASE_REPLICAS else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the primary's rows
+        return True
+
+
+def start_request(request) -> tuple[RequestRouting, object]:
+    try:
+        pinned = request.method not in SAFE_METHODS or float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        pinned = False
+    routing = RequestRouting(pinned)
+    return routing, _current_request.set(routing)
+
+
+def finish_request(routing: RequestRouting, token, response):
+    _current_request.reset(token)
+    if routing.wrote and settings.DATABASE_REPLICAS:
+        seconds = settings.DB_PRIMARY_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite='Lax')
+
+
+def written_recently(modified: float | None) -> bool:
+    """
+    Whether a scope last changed at `modified` may not have reached the replicas yet
+    """
+    return modified is not None and time.time() - modified < settings.DB_PRIMARY_PIN_SECONDS
+
+
+@contextmanager
+def reading_primary():
+    """
+    Send the reads made inside the block to the primary
+    """
+    token = _reading_primary.set(True)
+    try:
+        yield
+    finally:
+        _reading_primary.reset(token)
@@ -1,11 +1,30 @@
-def get_rating_average(reviews) -> float:
+from statistics import median
+
+
+def get_rent_stats(rents) -> dict:
     """
-    Calculate the average rating for a address
+    Calculate the min, max and median of the non-null rents for an address
     """
-    rating_sum = 0
-    num_reviews = len(reviews)
-    for review in reviews:
-        rating_sum += review.rating
-    if num_reviews > 0:
-        return round(rating_sum / num_reviews, 1)
-    return 0.0
+    values = sorted(rent for rent in rents if rent is not None)
+    if not values:
+        return {"min": None, "max": None, "median": None}
+    return {"min": values[0], "max": values[-1], "median": float(median(values))}
+
+
+def get_summary_fields(rows) -> dict:
+    """
+    Calculate every AddressSummary field from (rating, starting_rent, ending_rent) rows
+    """
+    rows = list(rows)
+    starting = get_rent_stats(row[1] for row in rows)
+    ending = get_rent_stats(row[2] for row in rows)
+    return {
+        "review_count": len(rows),
+        "rating_sum": sum(row[0] for row in rows),
+        "starting_rent_min": starting["min"],
+        "starting_rent_max": starting["max"],
+        "starting_rent_median": starting["median"],
+        "ending_rent_min": ending["min"],
+        "ending_rent_max": ending["max"],
+        "ending_rent_median": ending["median"],
+    }
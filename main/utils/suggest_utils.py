@@ -0,0 +1,188 @@
+"""
+In-memory index of known addresses for the address typeahead.
+
+Addresses are kept normalized in one sorted list, so a prefix query is a bisect
+and a short scan. When too few addresses start with the query, an optional
+trigram index finds addresses that share most of the query's trigrams, which
+catches typos and out of order input.
+"""
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from typing import Iterable
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+# Fuzzy matching counts the postings of the query's rarest trigrams, up to this
+# many ids in all. Common trigrams (the state, the country, "street") say little
+# about which address is meant and cost the most to count, a query made only of
+# those gets no fuzzy matches.
+FUZZY_POSTINGS_BUDGET = 20000
+# Share of the counted trigrams an address must contain
+FUZZY_MIN_MATCH = 0.5
+
+
+def normalize_address(text: str) -> str:
+    """
+    Lowercase an address and reduce punctuation and runs of spaces to one space
+    """
+    return _SEPARATORS.sub(' ', text.casefold()).strip()
+
+
+def _trigrams(key: str) -> set:
+    # Three spaces between words pad each word the way pg_trgm does, "  w", " wo", "wor", "ord", "rd "
+    padded = '  ' + key.replace(' ', '   ') + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2) if padded[i + 1:i + 3] != '  '}
+
+
+class AddressIndex:
+    """
+    Prefix and trigram index over full addresses.
+    `generation` and `last_id` record how far the index has read the address
+    table, and `removals_seen` how far it has read the log of deleted ones.
+    `lock` serializes changes: callers hold it around build and catch_up,
+    add and remove take it themselves.
+    """
+
+    def __init__(self, fuzzy: bool = True):
+        self.fuzzy = fuzzy
+        self.lock = threading.Lock()
+        self.generation = None
+        self.last_id = 0
+        self.removals_seen = None
+        self._clear()
+
+    def _clear(self):
+        # (normalized, full_address) pairs, one list so a reader never sees the two halves disagree
+        self._sorted = []
+        self._entries = []
+        self._entry_ids = {}
+        self._postings = {}
+
+    @property
+    def built(self) -> bool:
+        return self.generation is not None
+
+    def build(self, rows: Iterable[tuple[int, str]], generation):
+        """
+        Replace the index with (id, full_address) rows
+        """
+        self._clear()
+        # Plain lists append faster, they're packed into arrays once the build is done
+        postings = defaultdict(list)
+        last_id = 0
+        for pk, full_address in rows:
+            self._add_entry(full_address, postings)
+            last_id = max(last_id, pk)
+        self._sorted.sort()
+        self._postings = {gram: array('I', ids) for gram, ids in postings.items()}
+        self.last_id = last_id
+        self.generation = generation
+
+    def catch_up(self, rows: Iterable[tuple[int, str]], generation, removed: Iterable[str] = ()):
+        """
+        Drop the `removed` addresses, then add (id, full_address) rows written
+        since the index last read the table
+        """
+        for full_address in removed:
+            self._remove(full_address)
+        for pk, full_address in rows:
+            self._add(full_address)
+            self.last_id = max(self.last_id, pk)
+        self.generation = generation
+
+    def add(self, full_address: str):
+        # Until the index is built, the build or the next catch-up picks the address up
+        if self.built:
+            with self.lock:
+                self._add(full_address)
+
+    def remove(self, full_address: str):
+        if self.built:
+            with self.lock:
+                self._remove(full_address)
+
+    def _add(self, full_address: str):
+        entry = self._add_entry(full_address)
+        if entry is not None:
+            insort(self._sorted, entry)
+
+    def _remove(self, full_address: str):
+        entry_id = self._entry_ids.pop(full_address, None)
+        if entry_id is None:
+            return
+        # The id stays in the postings and is skipped once its entry is gone
+        self._entries[entry_id] = None
+        entry = (normalize_address(full_address), full_address)
+        position = bisect_left(self._sorted, entry)
+        if position < len(self._sorted) and self._sorted[position] == entry:
+            del self._sorted[position]
+
+    def _add_entry(self, full_address: str, build_postings: dict | None = None) -> tuple | None:
+        """
+        Record a new address and its trigrams. While building, the sorted list is
+        filled in any order and sorted at the end; otherwise the caller inserts the
+        returned entry in place.
+        """
+        if full_address in self._entry_ids:
+            return None
+        key = normalize_address(full_address)
+        entry_id = len(self._entries)
+        self._entries.append(full_address)
+        self._entry_ids[full_address] = entry_id
+        if self.fuzzy:
+            for gram in _trigrams(key):
+                if build_postings is not None:
+                    build_postings[gram].append(entry_id)
+                else:
+                    self._postings.setdefault(gram, array('I')).append(entry_id)
+        entry = (key, full_address)
+        if build_postings is not None:
+            self._sorted.append(entry)
+        return entry
+
+    def suggest(self, query: str, limit: int) -> list[str]:
+        """
+        Return up to `limit` addresses starting with the query, topped up with
+        fuzzy matches when there are fewer than that
+        """
+        key = normalize_address(query)
+        if not key:
+            return []
+        results = []
+        position = bisect_left(self._sorted, (key,))
+        for normalized, full_address in self._sorted[position:position + limit]:
+            if not normalized.startswith(key):
+                break
+            results.append(full_address)
+        if self.fuzzy and len(results) < limit:
+            results.extend(self._fuzzy(key, limit - len(results), set(results)))
+        return results
+
+    def _fuzzy(self, key: str, limit: int, exclude: set) -> list[str]:
+        postings = sorted(
+            (self._postings[gram] for gram in _trigrams(key) if gram in self._postings),
+            key=len,
+        )
+        counts = Counter()
+        counted = budget = 0
+        for ids in postings:
+            budget += len(ids)
+            if budget > FUZZY_POSTINGS_BUDGET:
+                break
+            counts.update(ids)
+            counted += 1
+        if not counted:
+            return []
+        needed = counted * FUZZY_MIN_MATCH
+        candidates = (
+            (shared, -len(full_address), full_address)
+            for entry_id, shared in counts.items()
+            if shared >= needed
+            and (full_address := self._entries[entry_id]) is not None
+            and full_address not in exclude
+        )
+        return [full_address for _, _, full_address in heapq.nlargest(limit, candidates)]
@@ -0,0 +1,100 @@
+"""
+Read-only JSON API, /api/<version>/...
+"""
+from rest_framework.decorators import api_view
+from main.models import Address, AddressSummary, Review
+from main.serializers.api.serializers import (
+    CITY_REVIEW_COLUMNS,
+    REVIEW_COLUMNS,
+    SUMMARY_COLUMNS,
+    AddressSummarySerializer,
+    CityReviewSerializer,
+    ReviewSerializer,
+)
+from main.utils.api_utils import api_response, cached_response, cached_review_page, not_found
+from main.utils.cache_utils import address_id_scope, address_scope, cache_aside, city_scope
+from main.utils.database_utils import city_reviews_query, get_cities, get_countries, get_states
+
+
+@api_view(["GET"])
+def countries(request, version):
+    """
+    /api/<version>/countries
+    """
+    return api_response(get_countries())
+
+
+@api_view(["GET"])
+def states(request, version, country):
+    """
+    /api/<version>/countries/<country>/states
+    """
+    return api_response(get_states(country))
+
+
+@api_view(["GET"])
+def cities(request, version, country, state):
+    """
+    /api/<version>/countries/<country>/states/<state>/cities
+    """
+    return api_response(get_cities(state, country))
+
+
+@api_view(["GET"])
+def address_summary(request, version, address_id: int):
+    """
+    /api/<version>/addresses/<address_id>
+    Review count, average rating and rent ranges of an address
+    """
+    full_address = _full_address(address_id)
+    if full_address is None:
+        return not_found()
+
+    def load_summary():
+        summary = (
+            AddressSummary.objects.filter(address_id=address_id)
+            .select_related("address")
+            .only(*SUMMARY_COLUMNS)
+            .first()
+        )
+        return dict(AddressSummarySerializer(summary).data) if summary else None
+
+    return cached_response("api_address_summary", address_scope(full_address), load_summary)
+
+
+@api_view(["GET"])
+def address_reviews(request, version, address_id: int):
+    """
+    /api/<version>/addresses/<address_id>/reviews?cursor=<cursor>&page_size=<n>
+    """
+    full_address = _full_address(address_id)
+    if full_address is None:
+        return not_found()
+    reviews = (
+        Review.objects.filter(address_id=address_id)
+        .select_related("user")
+        .only(*REVIEW_COLUMNS)
+    )
+    return cached_review_page(
+        request, "api_address_reviews", address_scope(full_address), reviews, ReviewSerializer
+    )
+
+
+@api_view(["GET"])
+def city_reviews(request, version, country, state, city):
+    """
+    /api/<version>/countries/<country>/states/<state>/cities/<city>/reviews?cursor=<cursor>&page_size=<n>
+    """
+    reviews = city_reviews_query(city, state, country).only(*CITY_REVIEW_COLUMNS)
+    return cached_review_page(
+        request, "api_city_reviews", city_scope(city, state, country), reviews, CityReviewSerializer
+    )
+
+
+def _full_address(address_id: int) -> str | None:
+    # Cached until the address is deleted, see main.signals
+    return cache_aside(
+        "address_name",
+        address_id_scope(address_id),
+        lambda: Address.objects.filter(pk=address_id).values_list("full_address", flat=True).first(),
+    )
@@ -1,12 +1,17 @@
 """
 Home page view
 """
+import gzip
 import logging
-from django.shortcuts import render, redirect
+from django.http import HttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.shortcuts import redirect
 from django.urls import reverse
-from common import INDEX_TEMPLATE
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from common import INDEX_TEMPLATE, SUGGEST_CACHE_SECONDS, SUGGEST_LIMIT
 from main.utils.database_utils import *
-from main.utils.address_utils import get_address_dict
+from main.utils.address_utils import get_address_dict, get_slug_parts
+from main.utils.common_utils import arender
 from main.forms.home_page.forms import GetAddressForm
 from django.http import JsonResponse
 
@@ -15,74 +20,98 @@ from django.http import JsonResponse
 logger = logging.getLogger()
 
 
-def index(request):
+async def index(request):
     if request.method == "POST":
         if request.POST.get("address"):
             form = GetAddressForm(request.POST)
             if form.errors:
-                return _get_index_error_form(request, form)
+                return await _get_index_error_form(request, form)
             if form.is_valid():
                 full_address = form.cleaned_data["address"]
-                request.session['address'] = full_address
                 address_dict = get_address_dict(full_address)
 
-                if address_pk_exists(full_address):
-                    return _list_reviews(address_dict)
+                address = await aget_address(full_address)
+                if address is not None:
+                    return _list_reviews(address)
                 else:
-                    return _address_not_found(request, full_address, address_dict, form)
+                    return await _address_not_found(request, full_address, address_dict, form)
     else:
-        countries = get_countries()
-        return _get_get_address_form(request, countries)
+        countries = await aget_countries()
+        return await _get_get_address_form(request, countries)
 
 
-def get_states_list(request):
+async def get_states_list(request):
     """
     Get a list of states for a given country
     """
-    states = get_states(request.GET.get('country'))
+    states = await aget_states(request.GET.get('country'))
     return _get_json_response(list(states))
 
 
-def get_cities_list(request):
+async def get_cities_list(request):
     """
     Get a list of cities for a given state
     """
-    cities = get_cities(request.GET.get('state'), request.GET.get('country'))
+    cities = await aget_cities(request.GET.get('state'), request.GET.get('country'))
     return _get_json_response(list(cities))
 
 
+async def geography(request):
+    """
+    Every country, state and city as one JSON document, for clients that fill
+    the dropdowns without a request per selection. Sent gzipped as built, the
+    ETag lets a client keep its copy until the geography changes.
+    """
+    snapshot = await aget_geography()
+    response = get_conditional_response(request, etag=snapshot.etag)
+    if response is None:
+        if re_accepts_gzip.search(request.headers.get("Accept-Encoding", "")):
+            response = HttpResponse(snapshot.json, content_type="application/json")
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(gzip.decompress(snapshot.json), content_type="application/json")
+    response.headers["ETag"] = snapshot.etag
+    patch_vary_headers(response, ("Accept-Encoding",))
+    # Served from memory, the page cache would only add a round trip
+    patch_cache_control(response, max_age=0)
+    return response
+
+
+async def suggest_addresses(request):
+    """
+    Known addresses matching what has been typed so far, for the address typeahead
+    """
+    addresses = await asuggest_addresses(request.GET.get('q', ''), SUGGEST_LIMIT)
+    response = _get_json_response(addresses)
+    patch_cache_control(response, max_age=SUGGEST_CACHE_SECONDS)
+    return response
+
+
 def _get_json_response(data: list) -> JsonResponse:
     return JsonResponse(data, safe=False)
 
 
-def _get_index_error_form(request, form: GetAddressForm):
+async def _get_index_error_form(request, form: GetAddressForm):
     logger.error(
         "Error creating GetaddressAddressForm form: %s",
         form.errors.as_text,
     )
-    return render(
+    return await arender(
         request,
         template_name=INDEX_TEMPLATE,
         context={"errors": form.errors, "get_address_form": form},
     )
 
 
-def _list_reviews(address_dict: dict):
-    redirect_url = reverse(
-        "list_reviews",
-        kwargs={
-            "street": address_dict["street"],
-            "city": address_dict["city"],
-            "state": address_dict["state"],
-            "country": address_dict["country"]
-        },
-    )
+def _list_reviews(address):
+    # The address may have been entered under another spelling, its page is under the stored one
+    redirect_url = reverse("list_reviews", kwargs=get_slug_parts(address.slug))
     return redirect(redirect_url)
 
 
-def _address_not_found(request, full_address: str, address_dict: dict, form: GetAddressForm):
+async def _address_not_found(request, full_address: str, address_dict: dict, form: GetAddressForm):
     logger.info("Address not found: [%s]", full_address)
-    return render(
+    return await arender(
         request,
         template_name=INDEX_TEMPLATE,
         context={
@@ -98,9 +127,9 @@ def _address_not_found(request, full_address: str, address_dict: dict, form: Get
     )
 
 
-def _get_get_address_form(request, countries):
+async def _get_get_address_form(request, countries):
     get_address_form = GetAddressForm()
-    return render(
+    return await arender(
         request,
         template_name=INDEX_TEMPLATE,
         context={
@@ -0,0 +1,27 @@
+"""
+Prometheus metrics, /metrics
+"""
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+from main.utils.metrics_utils import render_metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@never_cache
+def metrics(request):
+    """
+    /metrics
+    This process's request, SQL, cache and template metrics. Hidden unless a
+    token is configured or public metrics are opted in to
+    """
+    if settings.METRICS_TOKEN:
+        if not constant_time_compare(
+            request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+        ):
+            return HttpResponse(status=401)
+    elif not settings.METRICS_PUBLIC:
+        return HttpResponse(status=404)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -11,10 +11,12 @@ from django.contrib.auth.models import User
 from django.contrib.auth.forms import AuthenticationForm, PasswordResetForm
 from django.core.mail import send_mail
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import never_cache
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy, reverse
 from main.forms.profile.forms import NewUserForm, ResetPasswordForm
-from main.utils.database_utils import get_user_reviews
+from main.utils.database_utils import get_user_reviews_page
+from main.utils.pagination_utils import get_page_size
 from rental_app.settings import EMAIL_HOST_USER, EMAIL_HOST_PASSWORD
 import common
 
@@ -96,7 +98,6 @@ def register(request) -> HttpResponse:
     Register a new user
     Forwards the user to the registration page
     """
-    logger.info(request.META)
     if request.method == "POST":
         form = NewUserForm(request.POST)
         if form.is_valid():
@@ -107,7 +108,7 @@ def register(request) -> HttpResponse:
                 redirect_url = request.session['relay_state_url']
                 request.session.pop('relay_state_url', None)
                 return redirect(redirect_url)
-            request.session[common.USERNAME] = user.get_username
+            request.session[common.USERNAME] = user.get_username()
             return user_profile(request)
 
         logger.warning("Could not register user. %s", form.errors.as_json)
@@ -124,6 +125,7 @@ def register(request) -> HttpResponse:
     )
 
 
+@never_cache
 @login_required
 def user_profile(request) -> HttpResponse:
     """
@@ -134,11 +136,20 @@ def user_profile(request) -> HttpResponse:
     if request.user.is_authenticated and request.user.is_staff:
         return redirect(reverse('admin:index'))
     
-    user_reviews = get_user_reviews(username)
+    user_reviews, next_cursor, previous_cursor = get_user_reviews_page(
+        username,
+        request.GET.get("cursor"),
+        get_page_size(request, common.REVIEWS_PAGE_SIZE, common.MAX_REVIEWS_PAGE_SIZE),
+    )
     return render(
         request,
         template_name=common.USER_PROFILE_TEMPLATE,
-        context={"username": username, "user_reviews": user_reviews}
+        context={
+            "username": username,
+            "user_reviews": user_reviews,
+            "next_cursor": next_cursor,
+            "previous_cursor": previous_cursor,
+        }
     )
 
 
@@ -149,8 +160,6 @@ def user_login(request) -> HttpResponse:
     Log the user in and redirect to the user profile page
     """
     if request.method == "POST":
-        forgot_username(request)
-
         form = AuthenticationForm(request, data=request.POST)
         if form.is_valid():
             username = form.cleaned_data.get("username")
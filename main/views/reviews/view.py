@@ -4,14 +4,16 @@ Reviews views
 import logging
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.http import HttpResponse
-from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.db import IntegrityError
 import common
-from main.models import Address
+from main.models import Address, Review
 from main.utils.database_utils import *
 from main.utils.review_utils import *
 from main.utils.common_utils import *
-from main.utils.address_utils import get_address_dict
+from main.utils.address_utils import get_address_slug, get_slug_parts, get_url_slug
+from main.utils.pagination_utils import get_page_size
 from ...forms.reviews.forms import ReviewForm
 
 logger = logging.getLogger()
@@ -23,86 +25,79 @@ def create_review(request, street, city, state, country) -> HttpResponse:
     Create a new review
     """
     if request.user.is_authenticated:
-        full_address = request.session['address']
-        address_dict = get_address_dict(full_address)
+        full_address = _create_review_address(request, street, city, state, country)
 
         if request.method == "POST":
             form = ReviewForm(request.POST)
             if form.is_valid():
-                _save_review(request.user, form, full_address)
-                redirect_url = reverse(
-                    "list_reviews",
-                    kwargs={
-                        "city": city,
-                        "state": state,
-                        "street": street,
-                        "country": country
-                    },
-                )
-                return redirect(redirect_url)
+                review = _save_review(request.user, form, full_address)
+                if review is not None:
+                    return _list_reviews(review.address)
+                address = _already_reviewed(form.instance, full_address)
+                if address is not None:
+                    add_error_to_session_cookie('User has already reviewed address', request)
+                    return _list_reviews(address)
+                form.add_error(None, 'The review could not be saved, please try again')
         else:
-            if _user_reviewed_address(full_address, request.user):
+            if user_reviewed_address(request.user.pk, full_address):
                 add_error_to_session_cookie('User has already reviewed address', request)
-                redirect_url = reverse(
-                    "list_reviews",
-                    kwargs={
-                        "city": city,
-                        "state": state,
-                        "street": street,
-                        "country": address_dict["country"]
-                    },
-                )
-                return redirect(redirect_url)
+                return _list_reviews(get_address(full_address))
             form = ReviewForm()
-            return render(request, common.CREATE_REVIEW_FORM, {"form": form})
+        return render(request, common.CREATE_REVIEW_FORM, {"form": form})
 
     current_url = request.build_absolute_uri()
     request.session["relay_state_url"] = current_url
     return redirect("user_login")
 
 
-def list_reviews(request, street, city, state, country):
+async def list_reviews(request, street, city, state, country):
     """
     /review/list/<country>/<state>/<city>/<street>
     List reviews
     """
-    full_address = request.session['address']
-    address_pk = get_address(full_address)
-    reviews = get_reviews(address_pk=address_pk)
-    rating_average = get_rating_average(reviews)
-    errors = []
-    if 'errors' in request.session:
-        errors.append(request.session['errors'])
-        request.session.pop('errors', None)
-
-    return render(
+    address_pk = await aget_address_by_slug(street, city, state, country)
+    if address_pk is None:
+        raise Http404("No reviews for this address")
+    reviews, next_cursor, previous_cursor = await aget_reviews_page(
+        address_pk, request.GET.get('cursor'), _page_size(request)
+    )
+    summary = await aget_address_summary(address_pk)
+    rating_average = summary.rating_average if summary else 0.0
+    errors = await apop_session_errors(request)
+    reviewed_address_ids = await aget_reviewed_address_ids(await auser_id(request))
+
+    return await arender(
         request,
         template_name=common.REVIEW_TEMPLATE,
         context={
-            "address": full_address,
+            "address": address_pk.full_address,
             "country": country,
             "state": state,
             "city": city,
             "street": street,
             "reviews": reviews,
+            "next_cursor": next_cursor,
+            "previous_cursor": previous_cursor,
             "rating_average": rating_average,
+            "summary": summary,
+            "reviewed": address_pk.pk in reviewed_address_ids,
             "errors": errors
         },
     )
 
 
-def list_reviews_by_city(request, city, state, country):
+async def list_reviews_by_city(request, city, state, country):
     """
     /review/list/<country>/<state>/<city>
     List reviews
     """
-    reviews = get_city_reviews(city, state, country)
-    errors = []
-    if 'errors' in request.session:
-        errors.append(request.session['errors'])
-        request.session.pop('errors', None)
+    reviews, next_cursor, previous_cursor = await aget_city_reviews(
+        city, state, country, request.GET.get('cursor'), _page_size(request)
+    )
+    errors = await apop_session_errors(request)
+    reviewed_address_ids = await aget_reviewed_address_ids(await auser_id(request))
 
-    return render(
+    return await arender(
         request,
         template_name=common.CITY_REVIEWS_TEMPLATE,
         context={
@@ -110,11 +105,49 @@ def list_reviews_by_city(request, city, state, country):
             "state": state,
             "city": city,
             "reviews": reviews,
+            "next_cursor": next_cursor,
+            "previous_cursor": previous_cursor,
+            "reviewed_address_ids": reviewed_address_ids,
             "errors": errors
         },
     )
 
 
+async def search_reviews(request):
+    """
+    /review/search?q=<terms>&country=<country>&state=<state>&city=<city>&cursor=<cursor>
+    Search review titles and comments
+    """
+    query = request.GET.get('q', '').strip()
+    scope = {
+        'country': request.GET.get('country') or None,
+        'state': request.GET.get('state') or None,
+        'city': request.GET.get('city') or None,
+    }
+    reviews, next_cursor = [], None
+    if query:
+        reviews, next_cursor = await asearch_reviews(
+            query,
+            cursor=request.GET.get('cursor'),
+            page_size=common.SEARCH_PAGE_SIZE,
+            **scope,
+        )
+
+    response = await arender(
+        request,
+        template_name=common.SEARCH_REVIEWS_TEMPLATE,
+        context={
+            "query": query,
+            "reviews": reviews,
+            "next_cursor": next_cursor,
+            **scope,
+        },
+    )
+    # Any review write can change the results, so the page cache only keeps them briefly
+    patch_cache_control(response, max_age=common.SEARCH_CACHE_SECONDS)
+    return response
+
+
 def edit_review(request):
     full_address = request.POST.get('address')
     username = request.user.username
@@ -137,44 +170,65 @@ def delete_review(request):
     logger.info("username: %s updating: %s", request.user.username, full_address)
     cur_review = get_user_review(username, full_address)
     if request.POST.get('delete') == 'true':
-        logger.info(f"username: {username}, deleting review: {cur_review}")
+        logger.info("username: %s, deleting review: %s", username, cur_review)
         delete_user_review(cur_review)
 
     return redirect('user_profile')
 
 
-def _save_review(user, form: ReviewForm, full_address: str):
-    address_pk = get_address(full_address)
-    address_dict = get_address_dict(full_address)
-    if address_pk is None:
-        country = address_dict["country"]
-        state = address_dict["state"]
-        city = address_dict["city"]
-        country_pk = save_country(country)
-        state_pk = save_state(country_pk, state)
-        city_pk = save_city(state_pk, city)
-        address_pk = Address.objects.create(
-            full_address=full_address,
-            city=city_pk
-        )
+def _create_review_address(request, street, city, state, country) -> str:
+    """
+    The full address a new review is for. A known address is looked up from the
+    URL, a new one arrives in the address parameter and must match the URL.
+    """
+    address = get_address_by_slug(street, city, state, country)
+    if address is not None:
+        return address.full_address
+    full_address = request.GET.get('address', '')
+    if not full_address or get_address_slug(full_address) != get_url_slug(street, city, state, country):
+        raise Http404("Unknown address")
+    return full_address
+
+
+def _page_size(request) -> int:
+    return get_page_size(request, common.REVIEWS_PAGE_SIZE, common.MAX_REVIEWS_PAGE_SIZE)
+
+
+def _list_reviews(address) -> HttpResponse:
+    # The review may be for another spelling of the address, its page is under the stored one
+    return redirect(reverse("list_reviews", kwargs=get_slug_parts(address.slug)))
+
+
+def _save_review(user, form: ReviewForm, full_address: str) -> Review | None:
+    """
+    Save the review in the form. Return None if the database refused it.
+    """
     review = form.save(commit=False)
-    review.address = address_pk
     review.user = user
-    with transaction.atomic():
-        try:
-            review.save()
-            logger.info("Review created: %s" % review)
-        except Exception as e:
-            logger.error("Could not commit transaction: %s" % e)
-            transaction.rollback()
-
-
-def _user_reviewed_address(full_address, user) -> bool:
-    if address_pk_exists(full_address):
-        address_pk = get_address(full_address)
-        reviews = get_reviews(address_pk)
-        for review in reviews:
-            if review.user == user:
-                return True
-
-    return False
\ No newline at end of file
+    try:
+        save_new_review(review, full_address)
+    except IntegrityError as e:
+        logger.warning("Could not save review of %s by %s: %s", full_address, user, e)
+        return None
+    logger.info("Review created: %s", review)
+    return review
+
+
+def _already_reviewed(review: Review, full_address: str) -> Address | None:
+    """
+    The stored address if the review's user already reviewed it for the same
+    rental dates, the unique constraint a refused review can run into. Reviews
+    without both dates never conflict.
+    """
+    if review.starting_rent_month_year is None or review.ending_rent_month_year is None:
+        return None
+    address = get_address(full_address)
+    if address is None:
+        return None
+    duplicate = Review.objects.filter(
+        address=address,
+        user=review.user,
+        starting_rent_month_year=review.starting_rent_month_year,
+        ending_rent_month_year=review.ending_rent_month_year,
+    )
+    return address if duplicate.exists() else None
@@ -8,9 +8,18 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 """
 
 import os
+import threading
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rental_app.settings')
 
 application = get_asgi_application()
+
+# Imported after the app registry is ready
+from main.utils.database_utils import warm_address_index, warm_geography  # noqa: E402
+from main.utils.email_utils import start_worker  # noqa: E402
+
+threading.Thread(target=warm_address_index, name="warm-address-index", daemon=True).start()
+threading.Thread(target=warm_geography, name="warm-geography", daemon=True).start()
+start_worker()
@@ -47,23 +47,27 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "django.middleware.cache.UpdateCacheMiddleware",    # must remain here
+    "main.middleware.RequestIdMiddleware",
+    "main.middleware.RequestMetricsMiddleware",
+    "main.middleware.PrimaryPinningMiddleware",
+    "main.middleware.GenerationalUpdateCacheMiddleware",    # must remain here
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "main.middleware.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "django.middleware.cache.FetchFromCacheMiddleware", # must remain here
+    "main.middleware.ConditionalPageMiddleware",
+    "main.middleware.GenerationalFetchFromCacheMiddleware", # must remain here
 ]
 
 ROOT_URLCONF = "rental_app.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "main.utils.metrics_utils.TimedDjangoTemplates",
         "DIRS": [BASE_DIR],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -85,20 +89,83 @@ WSGI_APPLICATION = "rental_app.wsgi.application"
 ############################################################
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 POSTGRES_PASSWORD = str(os.getenv("POSTGRES_PASSWORD"))
+# DB_CONNECTIONS picks how connections to Postgres are reused:
+#   pool        each process keeps up to DB_POOL_SIZE connections and lends them
+#               to whichever thread serves a request (default)
+#   persistent  each thread keeps its own connection for DB_CONN_MAX_AGE seconds,
+#               checked before reuse. Only sync (WSGI) workers reuse threads, under
+#               ASGI every request runs its queries on a new one.
+#   per_request a new connection for every request
+# Connection time and pool saturation are served on /metrics.
+DB_CONNECTIONS = os.getenv("DB_CONNECTIONS", "pool")
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": "postgres",
-        "USER": "postgres.zmcavbxpvdadyszaipaq",
+        "ENGINE": "main.backends.postgresql_pool",
+        "NAME": os.getenv("POSTGRES_NAME", "postgres"),
+        "USER": os.getenv("POSTGRES_USER", "postgres.zmcavbxpvdadyszaipaq"),
         "PASSWORD": POSTGRES_PASSWORD,
-        "HOST": "aws-0-us-west-1.pooler.supabase.com",
-        "PORT": "5432",
+        "HOST": os.getenv("POSTGRES_HOST", "aws-0-us-west-1.pooler.supabase.com"),
+        "PORT": os.getenv("POSTGRES_PORT", "5432"),
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+if DB_CONNECTIONS == "pool":
+    DATABASES["default"]["POOL"] = {
+        "MAX_SIZE": int(os.getenv("DB_POOL_SIZE", 10)),
+        "TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        "MAX_IDLE": 300,
+        "HEALTH_CHECK_AFTER": 30,
+    }
+elif DB_CONNECTIONS == "persistent":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 600))
+elif DB_CONNECTIONS != "per_request":
+    raise ValueError(f"Unknown DB_CONNECTIONS {DB_CONNECTIONS!r}, use pool, persistent or per_request")
+# Reads go to the replicas in POSTGRES_REPLICA_HOSTS (comma separated host[:port]
+# list) and writes to the primary. A browser that writes reads from the primary
+# for the next DB_PRIMARY_PIN_SECONDS, so it sees its own writes whatever the
+# replication lag. See main/utils/replica_utils.py.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.getenv("POSTGRES_REPLICA_HOSTS", "").split(",")), 1):
+    host, _, port = replica.strip().partition(":")
+    DATABASES[f"replica{number}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["main.utils.replica_utils.ReplicaRouter"]
+DB_PRIMARY_PIN_SECONDS = int(os.getenv("DB_PRIMARY_PIN_SECONDS", 15))
+# SQLITE_PATH runs the app on a local SQLite file instead, for benchmarks and
+# development without network access. Full-text search needs Postgres.
+SQLITE_PATH = os.getenv("SQLITE_PATH")
+if SQLITE_PATH:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": SQLITE_PATH,
+        }
+    }
+    DATABASE_REPLICAS = []
 
 
 SESSION_COOKIE_AGE = 3600  # 60 minutes in seconds
 
+# Pages never read the session for anonymous visitors, so they don't create one.
+# SESSION_BACKEND picks where the sessions of logged in users live:
+#   db             the session table (default)
+#   cached_db      the session table, read through the cache
+#   cache          the cache only, needs MEMCACHED_LOCATION to share sessions between workers
+#   signed_cookies the session cookie itself, signed with SECRET_KEY
+SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+SESSION_ENGINE = SESSION_ENGINES[os.getenv("SESSION_BACKEND", "db")]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -137,18 +204,81 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 ############################################################
 # CACHING
 ############################################################
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "unique-snowflake",
-        "TIMEOUT": 300
+# Keys are namespaced by generation and every write bumps the generations it
+# touches (see main/utils/cache_utils.py), so entries can live for a long time.
+CACHE_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", 3600))
+
+# Set MEMCACHED_LOCATION (comma separated host:port list) to share one cache
+# across every uvicorn worker. Without it each process keeps its own cache.
+MEMCACHED_LOCATION = os.getenv("MEMCACHED_LOCATION")
+if MEMCACHED_LOCATION:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
+            "LOCATION": MEMCACHED_LOCATION.split(","),
+            "TIMEOUT": CACHE_TIMEOUT,
+            "OPTIONS": {
+                "no_delay": True,
+                "ignore_exc": True,
+                "use_pooling": True,
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "unique-snowflake",
+            "TIMEOUT": CACHE_TIMEOUT
+        }
     }
+CACHE_MIDDLEWARE_SECONDS = CACHE_TIMEOUT
+CACHE_MIDDLEWARE_KEY_PREFIX = "pages"
+
+############################################################
+# API
+############################################################
+# Read-only and public, so no authentication or browsable renderer to pay for
+REST_FRAMEWORK = {
+    "DEFAULT_VERSIONING_CLASS": "rest_framework.versioning.URLPathVersioning",
+    "ALLOWED_VERSIONS": ["v1"],
+    "DEFAULT_RENDERER_CLASSES": ["main.utils.api_utils.CompactJSONRenderer"],
+    "DEFAULT_PARSER_CLASSES": [],
+    "DEFAULT_AUTHENTICATION_CLASSES": [],
+    "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.AllowAny"],
+    "UNAUTHENTICATED_USER": None,
 }
 
+############################################################
+# ADDRESS SUGGESTIONS
+############################################################
+# The address typeahead falls back to trigram matching when few addresses start
+# with what was typed. The trigrams cost memory in every worker, set
+# ADDRESS_SUGGEST_FUZZY=false to keep only the prefix index.
+ADDRESS_SUGGEST_FUZZY = os.getenv("ADDRESS_SUGGEST_FUZZY", "true").lower() == "true"
+
+############################################################
+# METRICS
+############################################################
+# /metrics serves request, SQL, cache and template metrics in the Prometheus
+# text format. With METRICS_TOKEN set, scrapers must send it as a bearer token.
+# Without it /metrics is a 404, unless METRICS_PUBLIC opts in to serving it to anyone.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+
 ############################################################
 # EMAIL CONFIGURATION
 ############################################################
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Emails are queued in the outbox table and delivered in the background through
+# EMAIL_OUTBOX_BACKEND, a batch at a time. EMAIL_OUTBOX_WORKER runs the worker in
+# every web process, turn it off to run `manage.py deliver_email` on its own instead.
+EMAIL_BACKEND = "main.utils.email_utils.OutboxEmailBackend"
+EMAIL_OUTBOX_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+EMAIL_OUTBOX_WORKER = os.getenv("EMAIL_OUTBOX_WORKER", "true").lower() == "true"
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_POLL_SECONDS = 5
+EMAIL_TIMEOUT = 30
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
@@ -159,23 +289,42 @@ EMAIL_HOST_PASSWORD = str(os.getenv("EMAIL_HOST_PASSWORD"))
 # LOGGING CONFIGURATION
 ############################################################
 THIRTY_DAYS_IN_HOURS = 30 * 24
+# Records are written by a background thread. LOG_FORMAT=json writes one JSON
+# object per line. LOG_QUEUE_SIZE bounds the records waiting to be written, and
+# LOG_QUEUE_FULL picks what a full queue does: "drop" the record, or "block"
+# the logging request for up to 100ms before dropping it.
+LOG_FILE = "application.log"
+# `manage.py archive_logs` moves the hourly files here, `manage.py query_logs` searches them
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "application_log")
+LOG_RETENTION_DAYS = 14
+LOG_FORMAT = os.getenv("LOG_FORMAT", "verbose")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+LOG_QUEUE_FULL = os.getenv("LOG_QUEUE_FULL", "drop")
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "root": {"level": "INFO", "handlers": ["default"], "propagate": True},
+    "filters": {
+        "request_id": {"()": "main.utils.logging_utils.RequestIdFilter"},
+    },
     "formatters": {
         "verbose": {
-            "format": "%(asctime)s [%(levelname)s][pid:%(process)d][thread:%(thread)d][%(pathname)s:%(lineno)d] %(message)s"
-        }
+            "format": "%(asctime)s [%(levelname)s][pid:%(process)d][request:%(request_id)s][%(module)s:%(lineno)d] %(message)s"
+        },
+        "json": {"()": "main.utils.logging_utils.JsonFormatter"},
     },
     "handlers": {
         "default": {
             "level": "INFO",
-            "class": "logging.handlers.TimedRotatingFileHandler",
-            "filename": "application.log",
+            "class": "main.utils.logging_utils.QueueingHandler",
+            "handler_class": "logging.handlers.TimedRotatingFileHandler",
+            "queue_size": LOG_QUEUE_SIZE,
+            "full_policy": LOG_QUEUE_FULL,
+            "filename": LOG_FILE,
             "when": "H",
             "backupCount": THIRTY_DAYS_IN_HOURS,
-            "formatter": "verbose",
+            "formatter": LOG_FORMAT,
+            "filters": ["request_id"],
         },
     },
     "loggers": {